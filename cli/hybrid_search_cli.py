@@ -31,6 +31,17 @@ def main() -> None:
     weighted_parser.add_argument(
         "--limit", type=int, default=5, help="Number of results to return (default=5)"
     )
+    weighted_parser.add_argument(
+        "--bm25-depth",
+        type=int,
+        help="Number of BM25 candidates to fuse (default=limit*500)",
+    )
+    weighted_parser.add_argument(
+        "--filter",
+        dest="filter_expr",
+        help='Only return movies matching a metadata filter, e.g. "year>=1990 '
+        'genres=comedy"',
+    )
 
     rrf_parser = subparsers.add_parser(
         "rrf-search", help="Perform Reciprocal Rank Fusion search"
@@ -45,8 +56,13 @@ def main() -> None:
     rrf_parser.add_argument(
         "--enhance",
         type=str,
-        choices=["spell", "rewrite", "expand"],
-        help="Query enhancement method",
+        choices=["spell", "fuzzy", "rewrite", "expand"],
+        help="Query enhancement method (fuzzy corrects typos locally)",
+    )
+    rrf_parser.add_argument(
+        "--llm-fallback",
+        action="store_true",
+        help="With --enhance fuzzy, ask the LLM about words with no local match",
     )
     rrf_parser.add_argument(
         "--limit", type=int, default=5, help="Number of results to return (default=5)"
@@ -57,6 +73,17 @@ def main() -> None:
     rrf_parser.add_argument(
         "--evaluate", action="store_true", help="Use LLM to evaluate result relevance"
     )
+    rrf_parser.add_argument(
+        "--bm25-depth",
+        type=int,
+        help="Number of BM25 candidates to fuse (default=limit*500)",
+    )
+    rrf_parser.add_argument(
+        "--filter",
+        dest="filter_expr",
+        help='Only return movies matching a metadata filter, e.g. "year>=1990 '
+        'genres=comedy"',
+    )
 
     args = parser.parse_args()
 
@@ -66,7 +93,9 @@ def main() -> None:
             for score in normalized:
                 print(f"* {score:.4f}")
         case "weighted-search":
-            result = weighted_search_command(args.query, args.alpha, args.limit)
+            result = weighted_search_command(
+                args.query, args.alpha, args.limit, args.bm25_depth, args.filter_expr
+            )
 
             print(
                 f"Weighted Hybrid Search Results for '{result['query']}' (alpha={result['alpha']}):"
@@ -86,7 +115,14 @@ def main() -> None:
                 print()
         case "rrf-search":
             result = rrf_search_command(
-                args.query, args.k, args.enhance, args.rerank_method, args.limit
+                args.query,
+                args.k,
+                args.enhance,
+                args.rerank_method,
+                args.limit,
+                args.bm25_depth,
+                args.llm_fallback,
+                args.filter_expr,
             )
 
             if result["enhanced_query"]:
@@ -1,14 +1,19 @@
 import argparse
+import json
 
 from lib.keyword_search import (
+    add_command,
     bm25_idf_command,
     bm25_tf_command,
     bm25search_command,
     build_command,
+    delete_command,
     idf_command,
+    merge_command,
     search_command,
     tf_command,
     tfidf_command,
+    update_command,
 )
 from lib.search_utils import BM25_B, BM25_K1
 
@@ -17,7 +22,47 @@ def main() -> None:
     parser = argparse.ArgumentParser(description="Keyword Search CLI")
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
-    subparsers.add_parser("build", help="Build the inverted index")
+    build_parser = subparsers.add_parser("build", help="Build the inverted index")
+    build_parser.add_argument(
+        "--impacts",
+        action="store_true",
+        help="Precompute BM25 impacts for dynamic pruning (MaxScore) at query time",
+    )
+    build_parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes used to analyze and invert the corpus",
+    )
+    build_parser.add_argument(
+        "--sparse",
+        action="store_true",
+        help="Also store BM25 weights as a CSR matrix for vectorized scoring",
+    )
+    build_parser.add_argument(
+        "--positions",
+        action="store_true",
+        help='Store token positions to support "phrase" and "proximity"~N queries',
+    )
+
+    add_parser = subparsers.add_parser(
+        "add", help="Add a movie to the index without a full rebuild"
+    )
+    add_parser.add_argument("movie", type=str, help="Movie as a JSON object")
+
+    update_parser = subparsers.add_parser(
+        "update", help="Replace an indexed movie without a full rebuild"
+    )
+    update_parser.add_argument("movie", type=str, help="Movie as a JSON object")
+
+    delete_parser = subparsers.add_parser(
+        "delete", help="Remove a movie from the index without a full rebuild"
+    )
+    delete_parser.add_argument("doc_id", type=int, help="Document ID")
+
+    subparsers.add_parser(
+        "merge", help="Compact incremental updates into a single index"
+    )
 
     search_parser = subparsers.add_parser("search", help="Search movies using BM25")
     search_parser.add_argument("query", type=str, help="Search query")
@@ -61,15 +106,42 @@ def main() -> None:
     bm25search_parser = subparsers.add_parser(
         "bm25search", help="Search movies using full BM25 scoring"
     )
-    bm25search_parser.add_argument("query", type=str, help="Search query")
+    bm25search_parser.add_argument(
+        "query",
+        type=str,
+        help='Search query; quoted phrases ("..." or "..."~N) need --positions',
+    )
+    bm25search_parser.add_argument(
+        "--limit", type=int, default=5, help="Number of results to return"
+    )
+    bm25search_parser.add_argument(
+        "--filter",
+        dest="filter_expr",
+        help='Only return movies matching a metadata filter, e.g. "year>=1990 '
+        'genres=comedy"',
+    )
 
     args = parser.parse_args()
 
     match args.command:
         case "build":
             print("Building inverted index...")
-            build_command()
+            build_command(args.impacts, args.workers, args.sparse, args.positions)
             print("Inverted index built successfully.")
+        case "add":
+            movie = json.loads(args.movie)
+            add_command(movie)
+            print(f"Added document '{movie['id']}'.")
+        case "update":
+            movie = json.loads(args.movie)
+            update_command(movie)
+            print(f"Updated document '{movie['id']}'.")
+        case "delete":
+            delete_command(args.doc_id)
+            print(f"Deleted document '{args.doc_id}'.")
+        case "merge":
+            merge_command()
+            print("Index segments merged successfully.")
         case "search":
             print("Searching for:", args.query)
             results = search_command(args.query)
@@ -96,7 +168,7 @@ def main() -> None:
             )
         case "bm25search":
             print("Searching for:", args.query)
-            results = bm25search_command(args.query)
+            results = bm25search_command(args.query, args.limit, args.filter_expr)
             for i, res in enumerate(results, 1):
                 print(f"{i}. ({res['id']}) {res['title']} - Score: {res['score']:.2f}")
         case _:
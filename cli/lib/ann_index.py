@@ -0,0 +1,146 @@
+import json
+import math
+import os
+from typing import Optional
+
+import numpy as np
+
+from .search_utils import (
+    EMBEDDING_DTYPE,
+    IVF_ASSIGN_BATCH_SIZE,
+    IVF_KMEANS_ITERATIONS,
+    IVF_TRAIN_SAMPLE,
+)
+from .sparse_bm25 import top_k_indices
+
+
+class IVFIndex:
+    """Inverted-file ANN index over L2-normalized embeddings
+
+    Rows are bucketed by their nearest k-means centroid (spherical k-means,
+    so nearness is cosine similarity). A query only scores the rows of its
+    `nprobe` closest buckets; raising nprobe trades speed for recall, and
+    probing every bucket is exact.
+    """
+
+    def __init__(
+        self, centroids: np.ndarray, list_offsets: np.ndarray, list_rows: np.ndarray
+    ) -> None:
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def row_count(self) -> int:
+        return len(self.list_rows)
+
+    @classmethod
+    def build(
+        cls,
+        embeddings: np.ndarray,
+        n_lists: Optional[int] = None,
+        iterations: int = IVF_KMEANS_ITERATIONS,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        n_rows = len(embeddings)
+        if n_lists is None:
+            n_lists = max(1, round(math.sqrt(n_rows)))
+        n_lists = max(1, min(n_lists, n_rows))
+        rng = np.random.default_rng(seed)
+
+        # Centroids are trained on a sample; every row is then assigned.
+        sample = embeddings
+        if n_rows > IVF_TRAIN_SAMPLE:
+            sample = embeddings[np.sort(rng.choice(n_rows, IVF_TRAIN_SAMPLE, False))]
+        centroids = np.array(
+            sample[rng.choice(len(sample), n_lists, replace=False)],
+            dtype=EMBEDDING_DTYPE,
+        )
+        for _ in range(iterations):
+            assignments = assign_lists(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            counts = np.bincount(assignments, minlength=n_lists)
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1
+            centroids = (sums / norms).astype(EMBEDDING_DTYPE)
+
+        assignments = assign_lists(embeddings, centroids)
+        list_rows = np.argsort(assignments, kind="stable").astype(np.int32)
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=n_lists), out=list_offsets[1:])
+        return cls(centroids, list_offsets, list_rows)
+
+    def save(self, directory: str, generation: Optional[str] = None) -> None:
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "centroids.npy"), self.centroids)
+        np.save(os.path.join(directory, "list_offsets.npy"), self.list_offsets)
+        np.save(os.path.join(directory, "list_rows.npy"), self.list_rows)
+        with open(os.path.join(directory, "ivf.json"), "w") as f:
+            json.dump(
+                {
+                    "n_lists": self.n_lists,
+                    "row_count": self.row_count,
+                    "generation": generation,
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, directory: str) -> "IVFIndex":
+        return cls(
+            np.load(os.path.join(directory, "centroids.npy")),
+            np.load(os.path.join(directory, "list_offsets.npy"), mmap_mode="r"),
+            np.load(os.path.join(directory, "list_rows.npy"), mmap_mode="r"),
+        )
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """Rows in the `nprobe` buckets whose centroids are closest to query"""
+        probes = top_k_indices(self.centroids @ query, nprobe)
+        rows = []
+        for probe in probes.tolist():
+            start, end = self.list_offsets[probe], self.list_offsets[probe + 1]
+            rows.append(self.list_rows[start:end])
+        return np.concatenate(rows) if rows else np.zeros(0, dtype=np.int32)
+
+
+def assign_lists(
+    embeddings: np.ndarray,
+    centroids: np.ndarray,
+    batch_size: int = IVF_ASSIGN_BATCH_SIZE,
+) -> np.ndarray:
+    """Index of the most similar centroid for every row, in bounded batches"""
+    assignments = np.empty(len(embeddings), dtype=np.int64)
+    for start in range(0, len(embeddings), batch_size):
+        batch = embeddings[start : start + batch_size]
+        assignments[start : start + len(batch)] = np.argmax(batch @ centroids.T, 1)
+    return assignments
+
+
+def load_or_build_ivf(
+    directory: str, embeddings: np.ndarray, generation: Optional[str]
+) -> IVFIndex:
+    """Open the index saved next to the embeddings, rebuilding it if stale
+
+    The index is only reused if it was built from the same `generation` of
+    the embedding store; a rewrite of the same size can hold other vectors.
+    """
+    meta_path = os.path.join(directory, "ivf.json")
+    if generation is not None and os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        if (
+            meta.get("generation") == generation
+            and meta["row_count"] == len(embeddings)
+        ):
+            return IVFIndex.load(directory)
+    index = IVFIndex.build(embeddings)
+    index.save(directory, generation)
+    return index
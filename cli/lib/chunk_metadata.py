@@ -0,0 +1,137 @@
+from typing import Optional
+
+import numpy as np
+
+AGGREGATION_MODES = ("max", "mean_top_n", "sum")
+METADATA_FIELDS = ("movie_idx", "chunk_idx", "total_chunks", "vector_row")
+
+
+class ChunkMetadata:
+    """Movie position, chunk number, chunk count and vector row of every chunk
+
+    Chunks with the same text share one embedding row, which `vector_row`
+    points at. Stored as parallel int32 arrays inside the chunk embedding
+    store, so the metadata is always swapped in together with the vectors
+    it describes.
+    """
+
+    def __init__(
+        self,
+        movie_idx: np.ndarray,
+        chunk_idx: np.ndarray,
+        total_chunks: np.ndarray,
+        vector_row: np.ndarray,
+    ) -> None:
+        self.movie_idx = movie_idx
+        self.chunk_idx = chunk_idx
+        self.total_chunks = total_chunks
+        self.vector_row = vector_row
+        # Chunks of each vector, as runs of `vector_chunks` starting at
+        # `vector_starts`.
+        self.vector_chunks = np.argsort(vector_row, kind="stable")
+        self.vector_counts = np.bincount(vector_row)
+        self.vector_starts = np.cumsum(self.vector_counts) - self.vector_counts
+        # Builds emit chunks movie by movie, which lets full scans reduce
+        # contiguous runs without sorting.
+        self.grouped = bool(np.all(movie_idx[1:] >= movie_idx[:-1]))
+        self.group_starts = run_starts(movie_idx) if self.grouped else None
+
+    def __len__(self) -> int:
+        return len(self.movie_idx)
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        return {
+            field: np.asarray(getattr(self, field), dtype=np.int32)
+            for field in METADATA_FIELDS
+        }
+
+    def allowed_rows(self, movie_mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Masks of the embedding rows and the chunks of the allowed movies"""
+        chunks = movie_mask[self.movie_idx]
+        rows = np.zeros(len(self.vector_counts), dtype=bool)
+        rows[self.vector_row[chunks]] = True
+        return rows, chunks
+
+    def expand(
+        self, rows: Optional[np.ndarray], scores: np.ndarray
+    ) -> tuple[Optional[np.ndarray], np.ndarray]:
+        """Turn scores of embedding rows into scores of the chunks using them
+
+        Args:
+            scores: Score of every embedding row, or of `rows` when given
+            rows: Embedding rows the scores belong to (None for all, in order)
+
+        Returns:
+            Chunk rows (None for all, in order) and their scores
+        """
+        if rows is None:
+            return None, scores[self.vector_row]
+        counts = self.vector_counts[rows]
+        # Each embedding row's run of chunks, laid out one after another.
+        run_offsets = np.cumsum(counts) - counts
+        shifts = np.repeat(self.vector_starts[rows] - run_offsets, counts)
+        chunks = self.vector_chunks[shifts + np.arange(len(shifts))]
+        return chunks, np.repeat(scores, counts)
+
+    def aggregate(
+        self,
+        scores: np.ndarray,
+        rows: Optional[np.ndarray] = None,
+        mode: str = "max",
+        top_n: int = 1,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Combine chunk scores into one score per movie
+
+        Args:
+            scores: Score of every chunk row, or of `rows` when given
+            rows: Chunk rows the scores belong to (None for all, in order)
+            mode: "max" (best chunk), "mean_top_n" (mean of the best `top_n`
+                chunks) or "sum" (all chunks)
+            top_n: Chunks averaged per movie in "mean_top_n" mode
+
+        Returns:
+            Movie positions and their aggregated scores
+        """
+        if mode not in AGGREGATION_MODES:
+            raise ValueError(f"unknown aggregation mode: {mode}")
+        movies = self.movie_idx if rows is None else self.movie_idx[rows]
+        if len(movies) == 0:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=scores.dtype)
+
+        starts = None
+        if mode == "mean_top_n":
+            # Movie runs with each movie's best chunks first.
+            order = np.lexsort((-scores, movies))
+        elif rows is None and self.grouped:
+            order, starts = None, self.group_starts
+        else:
+            order = np.argsort(movies, kind="stable")
+        if order is not None:
+            movies, scores = movies[order], scores[order]
+        if starts is None:
+            starts = run_starts(movies)
+
+        if mode == "max":
+            values = np.maximum.reduceat(scores, starts)
+        elif mode == "sum":
+            values = np.add.reduceat(scores, starts)
+        else:
+            lengths = np.diff(np.append(starts, len(movies)))
+            ranks = np.arange(len(movies)) - np.repeat(starts, lengths)
+            kept = np.where(ranks < top_n, scores, 0)
+            values = np.add.reduceat(kept, starts) / np.minimum(lengths, top_n)
+        return movies[starts], values
+
+
+def run_starts(values: np.ndarray) -> np.ndarray:
+    """Index where each run of equal consecutive values begins"""
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero(np.concatenate(([True], values[1:] != values[:-1])))
+
+
+def chunk_metadata_from(arrays: dict[str, np.ndarray]) -> Optional[ChunkMetadata]:
+    """Metadata stored alongside chunk embeddings, or None if it is missing"""
+    if not all(field in arrays for field in METADATA_FIELDS):
+        return None
+    return ChunkMetadata(*(arrays[field] for field in METADATA_FIELDS))
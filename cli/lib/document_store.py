@@ -0,0 +1,199 @@
+import json
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+from typing import Iterable, Iterator, Optional
+
+from .search_utils import DATA_PATH, DOCUMENT_STORE_PATH, load_movies
+
+STORE_MAGIC = b"RSDS"
+STORE_VERSION = 1
+HEADER = struct.Struct("<4sIQ")
+ALIGNMENT = 8
+
+
+def write_document_store(path: str, documents: Iterable[dict]) -> None:
+    """Write documents as compact JSON records behind fixed-width tables
+
+    Layout after the header: int32 ids in record order, int32 record
+    positions sorted by id, int64 offsets (one per record plus the end), then
+    the record blob. The file is written beside the target and renamed.
+    """
+    ids = array("i")
+    offsets = array("q", [0])
+    blob = bytearray()
+    for doc in documents:
+        ids.append(doc["id"])
+        blob += json.dumps(doc, separators=(",", ":")).encode("utf-8")
+        offsets.append(len(blob))
+    by_id = array("i", sorted(range(len(ids)), key=ids.__getitem__))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(STORE_MAGIC, STORE_VERSION, len(ids)))
+        for section in (ids.tobytes(), by_id.tobytes(), offsets.tobytes(), blob):
+            f.write(b"\0" * (_align(f.tell()) - f.tell()))
+            f.write(section)
+    os.replace(tmp_path, path)
+
+
+def _align(position: int) -> int:
+    return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class DocumentStore(Sequence):
+    """Memory-mapped documents, decoded one record at a time
+
+    Behaves like the list `load_movies` returns (records in corpus order), so
+    only the documents that are actually read are ever parsed. `by_id` gives
+    a mapping view keyed by movie id. `fingerprint` identifies the opened
+    file (format version, size and modification time), so anything derived
+    from the documents can tell it is stale without reading them.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.fingerprint = f"{STORE_VERSION}-{stat.st_size:x}-{stat.st_mtime_ns:x}"
+        buffer = memoryview(self._mmap)
+
+        magic, version, count = HEADER.unpack_from(buffer, 0)
+        if magic != STORE_MAGIC:
+            raise ValueError(f"{path} is not a document store")
+        if version != STORE_VERSION:
+            raise ValueError(
+                f"unsupported document store version {version}, "
+                f"expected {STORE_VERSION}"
+            )
+
+        position = _align(HEADER.size)
+        self.ids = buffer[position : position + 4 * count].cast("i")
+        position = _align(position + 4 * count)
+        self.id_order = buffer[position : position + 4 * count].cast("i")
+        position = _align(position + 4 * count)
+        self.offsets = buffer[position : position + 8 * (count + 1)].cast("q")
+        self.blob = buffer[_align(position + 8 * (count + 1)) :]
+        self.by_id = DocumentMap(self)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return json.loads(bytes(self.blob[start:end]))
+
+    def position(self, doc_id: int) -> int:
+        """Record position of a movie id, or -1 if it is not stored"""
+        lo, hi = 0, len(self.id_order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.ids[self.id_order[mid]] < doc_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.id_order) and self.ids[self.id_order[lo]] == doc_id:
+            return self.id_order[lo]
+        return -1
+
+    def get(self, doc_id: int, default: Optional[dict] = None) -> Optional[dict]:
+        position = self.position(doc_id)
+        if position < 0:
+            return default
+        return self[position]
+
+
+class DocumentMap(Mapping):
+    """Read-only movie id -> document view of a store, iterated in id order"""
+
+    def __init__(self, store: DocumentStore) -> None:
+        self.store = store
+
+    def __getitem__(self, doc_id: int) -> dict:
+        position = self.store.position(doc_id)
+        if position < 0:
+            raise KeyError(doc_id)
+        return self.store[position]
+
+    def __contains__(self, doc_id: object) -> bool:
+        return isinstance(doc_id, int) and self.store.position(doc_id) >= 0
+
+    def __iter__(self) -> Iterator[int]:
+        for position in self.store.id_order:
+            yield self.store.ids[position]
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+
+class IndexedDocuments(Mapping):
+    """Movie id -> document for the ids of an index, read from a shared store
+
+    `doc_ids` is the index's sorted id array. Records come from `overlay`
+    when it holds the id (documents added or edited through index updates)
+    and from the corpus store otherwise, so the index keeps no copy of the
+    corpus itself.
+    """
+
+    def __init__(
+        self,
+        doc_ids: Sequence[int],
+        store: DocumentStore,
+        overlay: Optional[DocumentStore] = None,
+    ) -> None:
+        self.doc_ids = doc_ids
+        self.store = store
+        self.overlay = overlay
+
+    def __getitem__(self, doc_id: int) -> dict:
+        if doc_id not in self:
+            raise KeyError(doc_id)
+        if self.overlay is not None:
+            doc = self.overlay.get(doc_id)
+            if doc is not None:
+                return doc
+        doc = self.store.get(doc_id)
+        if doc is None:
+            raise KeyError(doc_id)
+        return doc
+
+    def __contains__(self, doc_id: object) -> bool:
+        if not isinstance(doc_id, int):
+            return False
+        pos = bisect_left(self.doc_ids, doc_id)
+        return pos < len(self.doc_ids) and self.doc_ids[pos] == doc_id
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.doc_ids)
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+
+def document_map(documents: Sequence[dict]) -> Mapping[int, dict]:
+    """Movie id -> document for a store or a plain list of movies"""
+    if isinstance(documents, DocumentStore):
+        return documents.by_id
+    return {doc["id"]: doc for doc in documents}
+
+
+def load_documents(path: str = DOCUMENT_STORE_PATH) -> DocumentStore:
+    """Open the corpus document store, converting movies.json when it changed"""
+    stale = not os.path.exists(path) or (
+        os.path.exists(DATA_PATH)
+        and os.path.getmtime(path) < os.path.getmtime(DATA_PATH)
+    )
+    if stale:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_document_store(path, load_movies())
+    return DocumentStore(path)
@@ -0,0 +1,244 @@
+import json
+import os
+import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+from .embedding_store import (
+    HASH_DTYPE,
+    ShardedEmbeddings,
+    encode_incremental,
+    hash_row_finder,
+)
+from .model_registry import SENTENCE_TRANSFORMER, get_model
+from .search_utils import (
+    EMBED_BATCH_SIZE,
+    EMBED_CHECKPOINT_ROWS,
+    EMBED_TASKS_PER_WORKER,
+    EMBEDDING_DTYPE,
+)
+from .vector_search import normalize_embeddings
+
+PROGRESS_NAME = "progress.json"
+
+_worker_model_name: Optional[str] = None
+
+
+def token_lengths(model, texts: list[str]) -> np.ndarray:
+    """Tokens each text is encoded as, capped at the model's sequence length
+
+    Models without a tokenizer fall back to character counts.
+    """
+    tokenizer = getattr(model, "tokenizer", None)
+    if tokenizer is None or not texts:
+        return np.fromiter((len(text) for text in texts), np.int64, len(texts))
+    ids = tokenizer(texts, add_special_tokens=False)["input_ids"]
+    lengths = np.fromiter((len(row) for row in ids), np.int64, len(ids))
+    max_length = getattr(model, "max_seq_length", None)
+    return lengths if max_length is None else np.minimum(lengths, max_length)
+
+
+def length_batches(lengths: np.ndarray, batch_size: int) -> list[np.ndarray]:
+    """Positions of texts grouped into batches of similar token length
+
+    Each batch is padded only to its own longest text, so sorting by length
+    first keeps short texts from being padded to long ones.
+    """
+    if batch_size <= 0:
+        raise ValueError("batch_size must be positive")
+    order = np.argsort(lengths, kind="stable")
+    return [
+        order[start : start + batch_size] for start in range(0, len(order), batch_size)
+    ]
+
+
+def _init_worker(model_name: str, threads: int) -> None:
+    global _worker_model_name
+    _worker_model_name = model_name
+    try:
+        import torch
+
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def _token_lengths(texts: list[str]) -> np.ndarray:
+    return token_lengths(get_model(SENTENCE_TRANSFORMER, _worker_model_name), texts)
+
+
+def _encode_batch(texts: list[str], batch_size: int) -> np.ndarray:
+    model = get_model(SENTENCE_TRANSFORMER, _worker_model_name)
+    return model.encode(texts, batch_size=batch_size)
+
+
+def encoder_pool(
+    model_name: str, workers: int, threads: Optional[int] = None
+) -> Optional[ProcessPoolExecutor]:
+    """Worker processes for `encode_texts`, or None to encode in this process
+
+    Each worker loads the model once and runs `threads` intra-op threads
+    (the CPUs split evenly between workers by default).
+    """
+    if workers <= 1:
+        return None
+    if threads is None:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(model_name, threads),
+    )
+
+
+def encode_texts(
+    texts: list[str],
+    model_name: str,
+    workers: int = 1,
+    batch_size: int = EMBED_BATCH_SIZE,
+    threads: Optional[int] = None,
+    pool: Optional[ProcessPoolExecutor] = None,
+) -> np.ndarray:
+    """Normalized embeddings of texts, in input order
+
+    Batches sorted by token length are encoded in this process or by a pool of
+    `workers` processes (see `encoder_pool`; one is started if not given).
+    Every text is tokenized once up front, by the workers when there is a
+    pool. Only a few batches per worker are in flight at a time, and every
+    result is written straight into a preallocated matrix.
+    """
+    if pool is None and workers > 1:
+        with encoder_pool(model_name, workers, threads) as pool:
+            return encode_texts(texts, model_name, workers, batch_size, threads, pool)
+
+    if pool is None:
+        model = get_model(SENTENCE_TRANSFORMER, model_name)
+        lengths = token_lengths(model, texts)
+    else:
+        step = max(1, -(-len(texts) // workers))
+        slices = [texts[start : start + step] for start in range(0, len(texts), step)]
+        lengths = np.concatenate(
+            [np.zeros(0, np.int64), *pool.map(_token_lengths, slices)]
+        )
+    batches = length_batches(lengths, batch_size)
+    output = None
+
+    def store(rows: np.ndarray, embeddings: np.ndarray) -> None:
+        nonlocal output
+        if output is None:
+            output = np.empty((len(texts), embeddings.shape[1]), EMBEDDING_DTYPE)
+        output[rows] = normalize_embeddings(embeddings)
+
+    if pool is None:
+        for rows in batches:
+            store(rows, model.encode([texts[i] for i in rows], batch_size=batch_size))
+    else:
+        in_flight = deque()
+        for rows in batches:
+            batch = [texts[i] for i in rows]
+            in_flight.append((rows, pool.submit(_encode_batch, batch, batch_size)))
+            if len(in_flight) >= workers * EMBED_TASKS_PER_WORKER:
+                done_rows, future = in_flight.popleft()
+                store(done_rows, future.result())
+        while in_flight:
+            done_rows, future = in_flight.popleft()
+            store(done_rows, future.result())
+
+    if output is None:
+        return np.zeros((0, 0), dtype=EMBEDDING_DTYPE)
+    return output
+
+
+def encode_stream(
+    texts: Iterable[str],
+    model_name: str,
+    work_dir: str,
+    job: str,
+    previous: Optional[ShardedEmbeddings] = None,
+    workers: int = 1,
+    piece_rows: int = EMBED_CHECKPOINT_ROWS,
+) -> tuple[ShardedEmbeddings, np.ndarray]:
+    """Embed a stream of texts piece by piece into part files in `work_dir`
+
+    Texts are pulled `piece_rows` at a time, so memory is bounded by one
+    piece whatever the corpus size. Texts whose content hash is in
+    `previous` reuse its rows and only the rest are encoded. Each finished
+    piece is saved with its hashes and recorded in progress.json under
+    `job` (an id of the whole text stream), so a rerun of the same job
+    skips the recorded pieces and continues after the last one. The caller
+    removes `work_dir` once its final artifacts are in place.
+
+    Returns:
+        The parts as one memory-mapped matrix and the hash of every row
+    """
+    if piece_rows <= 0:
+        raise ValueError("piece_rows must be positive")
+    progress = _load_progress(work_dir)
+    if (
+        progress is None
+        or progress["job"] != job
+        or progress["piece_rows"] != piece_rows
+    ):
+        # Progress from a different text stream is useless; start over.
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(work_dir)
+        progress = {"job": job, "piece_rows": piece_rows, "parts": []}
+        _save_progress(work_dir, progress)
+
+    find_rows = hash_row_finder(None if previous is None else previous.hashes)
+    parts, hash_parts = [], []
+    pool = None
+
+    def encode(missing: list[str]) -> np.ndarray:
+        # Worker processes start only once a piece has texts to encode.
+        nonlocal pool
+        if pool is None:
+            pool = encoder_pool(model_name, workers)
+        return encode_texts(missing, model_name, workers, pool=pool)
+
+    try:
+        for number, piece in enumerate(_pieces(texts, piece_rows)):
+            path = os.path.join(work_dir, f"part-{number:05d}.npy")
+            hashes_path = os.path.join(work_dir, f"hashes-{number:05d}.npy")
+            if number >= len(progress["parts"]):
+                part, hashes = encode_incremental(
+                    piece, model_name, encode, previous, find_rows
+                )
+                np.save(path, part)
+                np.save(hashes_path, hashes)
+                progress["parts"].append(os.path.basename(path))
+                _save_progress(work_dir, progress)
+            parts.append(np.load(path, mmap_mode="r"))
+            hash_parts.append(np.load(hashes_path))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    dim = parts[0].shape[1] if parts else 0
+    hashes = np.concatenate(hash_parts) if hash_parts else np.zeros(0, HASH_DTYPE)
+    return ShardedEmbeddings(parts, dim), hashes
+
+
+def _pieces(texts: Iterable[str], size: int) -> Iterator[list[str]]:
+    iterator = iter(texts)
+    while piece := list(islice(iterator, size)):
+        yield piece
+
+
+def _load_progress(work_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(work_dir, PROGRESS_NAME), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_progress(work_dir: str, progress: dict) -> None:
+    path = os.path.join(work_dir, PROGRESS_NAME)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(progress, f)
+    os.replace(f"{path}.tmp", path)
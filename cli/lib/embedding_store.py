@@ -0,0 +1,289 @@
+import hashlib
+import heapq
+import json
+import os
+import time
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+
+from .search_utils import EMBEDDING_DTYPE, EMBEDDING_SHARD_ROWS
+from .sparse_bm25 import top_k_indices
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+HASH_DTYPE = "S16"
+
+
+def text_hash(model_name: str, text: str) -> bytes:
+    """Content hash of a text as embedded by a given model"""
+    data = f"{model_name}\0{text}".encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def corpus_digest(hashes: Iterable[bytes]) -> str:
+    """Order-sensitive digest of a sequence of content hashes"""
+    digest = hashlib.blake2b(digest_size=16)
+    for value in hashes:
+        digest.update(value)
+    return digest.hexdigest()
+
+
+def write_embedding_shards(
+    directory: str,
+    embeddings: np.ndarray,
+    hashes: Optional[np.ndarray] = None,
+    source_digest: Optional[str] = None,
+    arrays: Optional[dict[str, np.ndarray]] = None,
+    shard_rows: int = EMBEDDING_SHARD_ROWS,
+    source_fingerprint: Optional[str] = None,
+) -> None:
+    """Save a matrix as fixed-size .npy shards described by a manifest
+
+    `hashes` holds the content hash of each row's text, and `source_digest`
+    identifies the corpus the rows were built from; `source_fingerprint` is
+    a cheap stand-in for it that loads compare instead of rehashing. The
+    manifest also names the write's generation, which indexes derived from
+    the rows record to detect that they are stale. `arrays` are extra
+    per-row arrays (such as chunk metadata) that must always be swapped in
+    together with the rows they describe. The manifest is written last and
+    renamed into place, so a reader never sees a manifest that points at
+    missing shards. Every write uses new file names, so files that are still
+    mapped are never truncated; unlisted files are removed after.
+    """
+    if shard_rows <= 0:
+        raise ValueError("shard_rows must be positive")
+    os.makedirs(directory, exist_ok=True)
+    n_rows, dim = embeddings.shape
+    generation = f"{time.time_ns():x}"
+    shards = []
+    for number, start in enumerate(range(0, n_rows, shard_rows)):
+        name = f"shard-{generation}-{number:05d}.npy"
+        rows = np.asarray(embeddings[start : start + shard_rows], EMBEDDING_DTYPE)
+        np.save(os.path.join(directory, name), rows)
+        shards.append({"file": name, "rows": len(rows)})
+    listed = {shard["file"] for shard in shards}
+    hashes_name = None
+    if hashes is not None:
+        hashes_name = f"hashes-{generation}.npy"
+        np.save(os.path.join(directory, hashes_name), hashes.astype(HASH_DTYPE))
+        listed.add(hashes_name)
+    array_names = {}
+    for field, values in (arrays or {}).items():
+        array_names[field] = f"{field}-{generation}.npy"
+        np.save(os.path.join(directory, array_names[field]), values)
+        listed.add(array_names[field])
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "dtype": EMBEDDING_DTYPE,
+        "dim": dim,
+        "row_count": n_rows,
+        "shards": shards,
+        "hashes": hashes_name,
+        "source_digest": source_digest,
+        "source_fingerprint": source_fingerprint,
+        "arrays": array_names,
+        "generation": generation,
+    }
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    with open(f"{manifest_path}.tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+    for name in os.listdir(directory):
+        if name.endswith(".npy") and name not in listed:
+            os.remove(os.path.join(directory, name))
+
+
+class ShardedEmbeddings:
+    """Read-only embedding matrix spread over memory-mapped shard files
+
+    Supports the parts of the ndarray interface the search code uses (len,
+    shape, row indexing and `@`), so nothing is read into memory until rows
+    are scored, and processes opening the same shards share their pages.
+    """
+
+    def __init__(
+        self,
+        shards: list[np.ndarray],
+        dim: int,
+        hashes: Optional[np.ndarray] = None,
+        source_digest: Optional[str] = None,
+        arrays: Optional[dict[str, np.ndarray]] = None,
+        generation: Optional[str] = None,
+        source_fingerprint: Optional[str] = None,
+    ) -> None:
+        self.shards = shards
+        self.dim = dim
+        self.hashes = hashes
+        self.source_digest = source_digest
+        self.arrays = arrays or {}
+        self.generation = generation
+        self.source_fingerprint = source_fingerprint
+        self.offsets = np.zeros(len(shards) + 1, dtype=np.int64)
+        np.cumsum([len(shard) for shard in shards], out=self.offsets[1:])
+
+    @classmethod
+    def load(cls, directory: str) -> "ShardedEmbeddings":
+        with open(os.path.join(directory, MANIFEST_NAME), "r") as f:
+            manifest = json.load(f)
+        if manifest["version"] != MANIFEST_VERSION:
+            raise ValueError(
+                f"unsupported embedding manifest version {manifest['version']}, "
+                f"expected {MANIFEST_VERSION}"
+            )
+        shards = [
+            np.load(os.path.join(directory, shard["file"]), mmap_mode="r")
+            for shard in manifest["shards"]
+        ]
+        hashes = None
+        if manifest.get("hashes"):
+            hashes = np.load(os.path.join(directory, manifest["hashes"]))
+        arrays = {
+            field: np.load(os.path.join(directory, name), mmap_mode="r")
+            for field, name in manifest.get("arrays", {}).items()
+        }
+        return cls(
+            shards,
+            manifest["dim"],
+            hashes,
+            manifest.get("source_digest"),
+            arrays,
+            manifest.get("generation"),
+            manifest.get("source_fingerprint"),
+        )
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return len(self), self.dim
+
+    @property
+    def size(self) -> int:
+        return len(self) * self.dim
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype(EMBEDDING_DTYPE)
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        matrix = self[0 : len(self)]
+        return matrix if dtype is None else matrix.astype(dtype, copy=False)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += len(self)
+            shard = int(np.searchsorted(self.offsets, key, side="right")) - 1
+            return self.shards[shard][key - self.offsets[shard]]
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return self[np.arange(start, stop, step)]
+            parts = []
+            for shard, offset in zip(self.shards, self.offsets.tolist()):
+                lo, hi = max(start - offset, 0), min(stop - offset, len(shard))
+                if lo < hi:
+                    parts.append(shard[lo:hi])
+            if not parts:
+                return np.zeros((0, self.dim), dtype=EMBEDDING_DTYPE)
+            return np.concatenate(parts) if len(parts) > 1 else np.array(parts[0])
+
+        rows = np.asarray(key, dtype=np.int64)
+        out = np.empty((len(rows), self.dim), dtype=EMBEDDING_DTYPE)
+        owners = np.searchsorted(self.offsets, rows, side="right") - 1
+        for shard in np.unique(owners).tolist():
+            mask = owners == shard
+            out[mask] = self.shards[shard][rows[mask] - self.offsets[shard]]
+        return out
+
+    def __matmul__(self, other: np.ndarray) -> np.ndarray:
+        if not self.shards:
+            return np.zeros((0,) + np.shape(other)[1:], dtype=EMBEDDING_DTYPE)
+        return np.concatenate([shard @ other for shard in self.shards])
+
+    def top_k(self, query: np.ndarray, limit: int) -> tuple[np.ndarray, np.ndarray]:
+        """Rows with the highest dot product, scanning one shard at a time
+
+        Each shard contributes its local top `limit`, merged through a
+        bounded min-heap, so only one shard's scores exist at any moment.
+        """
+        heap = []
+        for shard, offset in zip(self.shards, self.offsets.tolist()):
+            scores = shard @ query
+            for row in top_k_indices(scores, limit).tolist():
+                # Equal scores prefer the lower row.
+                item = (float(scores[row]), -(offset + row))
+                if len(heap) < limit:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+        best = sorted(heap, reverse=True)
+        rows = np.array([-row for _, row in best], dtype=np.int64)
+        scores = np.array([score for score, _ in best], dtype=EMBEDDING_DTYPE)
+        return rows, scores
+
+
+def hash_row_finder(
+    hashes: Optional[np.ndarray],
+) -> Callable[[np.ndarray], np.ndarray]:
+    """Function mapping content hashes to their row in `hashes` (-1 if absent)
+
+    Lookups binary-search a sorted copy of the hashes, so a large store is
+    matched without building a Python object per row.
+    """
+    if hashes is None or len(hashes) == 0:
+        return lambda values: np.full(len(values), -1, dtype=np.int64)
+    order = np.argsort(hashes, kind="stable")
+    ordered = hashes[order]
+
+    def find(values: np.ndarray) -> np.ndarray:
+        positions = np.minimum(np.searchsorted(ordered, values), len(ordered) - 1)
+        return np.where(ordered[positions] == values, order[positions], -1)
+
+    return find
+
+
+def encode_incremental(
+    texts: list[str],
+    model_name: str,
+    encode: Callable[[list[str]], np.ndarray],
+    previous: Optional[ShardedEmbeddings] = None,
+    find_rows: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Embeddings for texts, reusing rows whose content is unchanged
+
+    Rows of `previous` are matched by content hash, so only new or edited
+    texts are passed to `encode`, which must return normalized rows. Callers
+    encoding many batches against the same store pass `find_rows` (see
+    `hash_row_finder`) to sort its hashes only once.
+
+    Returns:
+        The embedding matrix and the content hash of every row
+    """
+    hashes = np.array([text_hash(model_name, text) for text in texts], HASH_DTYPE)
+    if find_rows is None:
+        find_rows = hash_row_finder(None if previous is None else previous.hashes)
+    old_rows = find_rows(hashes)
+
+    missing = np.flatnonzero(old_rows < 0)
+    encoded = None
+    if len(missing):
+        encoded = encode([texts[i] for i in missing])
+    dim = previous.dim if encoded is None else encoded.shape[1]
+    embeddings = np.empty((len(texts), dim), dtype=EMBEDDING_DTYPE)
+    if encoded is not None:
+        embeddings[missing] = encoded
+    reused = np.flatnonzero(old_rows >= 0)
+    if len(reused):
+        embeddings[reused] = previous[old_rows[reused]]
+    return embeddings, hashes
+
+
+def load_embedding_shards(directory: str) -> Optional[ShardedEmbeddings]:
+    if not os.path.exists(os.path.join(directory, MANIFEST_NAME)):
+        return None
+    return ShardedEmbeddings.load(directory)
@@ -4,11 +4,9 @@ import os
 from dotenv import load_dotenv
 from google import genai
 
+from .document_store import load_documents
 from .hybrid_search import HybridSearch
-from .search_utils import (
-    load_golden_dataset,
-    load_movies,
-)
+from .search_utils import load_golden_dataset
 from .semantic_search import SemanticSearch
 
 
@@ -39,7 +37,7 @@ def recall_at_k(
 
 
 def evaluate_command(limit: int = 5) -> dict:
-    movies = load_movies()
+    movies = load_documents()
     golden_data = load_golden_dataset()
     test_cases = golden_data["test_cases"]
 
@@ -50,10 +48,11 @@ def evaluate_command(limit: int = 5) -> dict:
     total_precision = 0
     total_recall = 0
     results_by_query = {}
-    for test_case in test_cases:
+    queries = [test_case["query"] for test_case in test_cases]
+    batch_results = hybrid_search.rrf_search_batch(queries, k=60, limit=limit)
+    for test_case, search_results in zip(test_cases, batch_results):
         query = test_case["query"]
         relevant_docs = set(test_case["relevant_docs"])
-        search_results = hybrid_search.rrf_search(query, k=60, limit=limit)
         retrieved_docs = []
         for result in search_results:
             title = result.get("title", "")
@@ -1,49 +1,98 @@
-import os
 from typing import Optional
 
+from .document_store import load_documents
 from .keyword_search import InvertedIndex
 from .query_enhancement import enhance_query
 from .reranking import rerank
 from .search_utils import (
     DEFAULT_ALPHA,
     DEFAULT_SEARCH_LIMIT,
+    HYBRID_DEPTH_MULTIPLIER,
     RRF_K,
     SEARCH_MULTIPLIER,
     format_search_result,
-    load_movies,
 )
 from .semantic_search import ChunkedSemanticSearch
 
 
 class HybridSearch:
-    def __init__(self, documents: list[dict]) -> None:
+    def __init__(
+        self, documents: list[dict], bm25_depth: Optional[int] = None
+    ) -> None:
         self.documents = documents
+        self.bm25_depth = bm25_depth
         self.semantic_search = ChunkedSemanticSearch()
         self.semantic_search.load_or_create_chunk_embeddings(documents)
 
         self.idx = InvertedIndex()
-        if not os.path.exists(self.idx.index_path):
-            self.idx.build()
-            self.idx.save()
-
-    def _bm25_search(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
-        self.idx.load()
-        return self.idx.bm25_search(query, limit)
-
-    def weighted_search(self, query: str, alpha: float, limit: int = 5) -> list[dict]:
-        bm25_results = self._bm25_search(query, limit * 500)
-        semantic_results = self.semantic_search.search_chunks(query, limit * 500)
+        self.idx.load_or_build()
+
+    def _bm25_search(
+        self,
+        query: str,
+        limit: int = DEFAULT_SEARCH_LIMIT,
+        filter_expr: Optional[str] = None,
+    ) -> list[dict]:
+        return self.idx.bm25_search(query, limit, filter_expr)
+
+    def _bm25_candidates(self, limit: int) -> int:
+        if self.bm25_depth is not None:
+            return max(self.bm25_depth, limit)
+        return limit * HYBRID_DEPTH_MULTIPLIER
+
+    def weighted_search(
+        self,
+        query: str,
+        alpha: float,
+        limit: int = 5,
+        filter_expr: Optional[str] = None,
+    ) -> list[dict]:
+        # A metadata filter is applied inside both retrieval legs, so each
+        # returns its full depth of matching movies.
+        bm25_results = self._bm25_search(
+            query, self._bm25_candidates(limit), filter_expr
+        )
+        semantic_results = self.semantic_search.search_chunks(
+            query, limit * HYBRID_DEPTH_MULTIPLIER, filter_expr
+        )
 
         combined = combine_search_results(bm25_results, semantic_results, alpha)
         return combined[:limit]
 
-    def rrf_search(self, query: str, k: int, limit: int = 10) -> list[dict]:
-        bm25_results = self._bm25_search(query, limit * 500)
-        semantic_results = self.semantic_search.search_chunks(query, limit * 500)
+    def rrf_search(
+        self, query: str, k: int, limit: int = 10, filter_expr: Optional[str] = None
+    ) -> list[dict]:
+        bm25_results = self._bm25_search(
+            query, self._bm25_candidates(limit), filter_expr
+        )
+        semantic_results = self.semantic_search.search_chunks(
+            query, limit * HYBRID_DEPTH_MULTIPLIER, filter_expr
+        )
 
         fused = reciprocal_rank_fusion(bm25_results, semantic_results, k)
         return fused[:limit]
 
+    def rrf_search_batch(
+        self,
+        queries: list[str],
+        k: int,
+        limit: int = 10,
+        filter_expr: Optional[str] = None,
+    ) -> list[list[dict]]:
+        """`rrf_search` for several queries, batching both retrieval legs"""
+        bm25_batch = self.idx.bm25_search_batch(
+            queries, self._bm25_candidates(limit), filter_expr
+        )
+        semantic_batch = self.semantic_search.search_chunks_batch(
+            queries, limit * HYBRID_DEPTH_MULTIPLIER, filter_expr
+        )
+
+        results = []
+        for bm25_results, semantic_results in zip(bm25_batch, semantic_batch):
+            fused = reciprocal_rank_fusion(bm25_results, semantic_results, k)
+            results.append(fused[:limit])
+        return results
+
 
 def normalize_scores(scores: list[float]) -> list[float]:
     if not scores:
@@ -185,15 +234,19 @@ def reciprocal_rank_fusion(
 
 
 def weighted_search_command(
-    query: str, alpha: float = DEFAULT_ALPHA, limit: int = DEFAULT_SEARCH_LIMIT
+    query: str,
+    alpha: float = DEFAULT_ALPHA,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    bm25_depth: Optional[int] = None,
+    filter_expr: Optional[str] = None,
 ) -> dict:
-    movies = load_movies()
-    searcher = HybridSearch(movies)
+    movies = load_documents()
+    searcher = HybridSearch(movies, bm25_depth)
 
     original_query = query
 
     search_limit = limit
-    results = searcher.weighted_search(query, alpha, search_limit)
+    results = searcher.weighted_search(query, alpha, search_limit, filter_expr)
 
     return {
         "original_query": original_query,
@@ -209,18 +262,21 @@ def rrf_search_command(
     enhance: Optional[str] = None,
     rerank_method: Optional[str] = None,
     limit: int = DEFAULT_SEARCH_LIMIT,
+    bm25_depth: Optional[int] = None,
+    llm_fallback: bool = False,
+    filter_expr: Optional[str] = None,
 ) -> dict:
-    movies = load_movies()
-    searcher = HybridSearch(movies)
+    movies = load_documents()
+    searcher = HybridSearch(movies, bm25_depth)
 
     original_query = query
     enhanced_query = None
     if enhance:
-        enhanced_query = enhance_query(query, method=enhance)
+        enhanced_query = enhance_query(query, enhance, llm_fallback)
         query = enhanced_query
 
     search_limit = limit * SEARCH_MULTIPLIER if rerank_method else limit
-    results = searcher.rrf_search(query, k, search_limit)
+    results = searcher.rrf_search(query, k, search_limit, filter_expr)
 
     reranked = False
     if rerank_method:
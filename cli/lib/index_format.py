@@ -0,0 +1,373 @@
+import mmap
+import os
+import struct
+from array import array
+from functools import lru_cache
+from typing import Iterator, Optional
+
+from .postings import (
+    POSTINGS_CACHE_SIZE,
+    decode_positions,
+    decode_postings,
+    postings_doc_freq,
+)
+
+INDEX_MAGIC = b"RSIX"
+INDEX_VERSION = 2
+BYTE_ORDER_MARK = 0x01020304
+
+# Every section is a flat array; the header records (offset, length) pairs in
+# this order. Sections for optional features are written empty when unused.
+SECTIONS = (
+    "doc_ids",  # int32 per dense id: movie id, ascending
+    "doc_lengths",  # int32 per dense id
+    "length_norms",  # float64 per dense id: k1 * (1 - b + b * len / avg)
+    "term_offsets",  # int64 per term + 1: slices of term_blob
+    "term_blob",  # utf-8 terms, sorted
+    "postings_offsets",  # int64 per term + 1: slices of postings_blob
+    "postings_blob",  # varint postings, see postings.encode_postings
+    "bm25_idfs",  # float64 per term
+    "posting_starts",  # int64 per term + 1: slices of impacts (impacts only)
+    "max_impacts",  # float64 per term (impacts only)
+    "impacts",  # float64 per posting (impacts only)
+    "positions_offsets",  # int64 per term + 1: slices of positions_blob
+    "positions_blob",  # varint position gaps, see postings.encode_positions
+)
+SECTION_TYPECODES = {
+    "doc_ids": "i",
+    "doc_lengths": "i",
+    "length_norms": "d",
+    "term_offsets": "q",
+    "term_blob": "B",
+    "postings_offsets": "q",
+    "postings_blob": "B",
+    "bm25_idfs": "d",
+    "posting_starts": "q",
+    "max_impacts": "d",
+    "impacts": "d",
+    "positions_offsets": "q",
+    "positions_blob": "B",
+}
+HEADER = struct.Struct("<4sIIIIId")
+SECTION_ENTRY = struct.Struct("<QQ")
+FLAG_IMPACTS = 1
+FLAG_POSITIONS = 2
+ALIGNMENT = 8
+
+
+def write_index(
+    path: str,
+    doc_ids: array,
+    doc_lengths: array,
+    length_norms: array,
+    avg_doc_length: float,
+    terms: list[str],
+    encoded_postings: list[bytes],
+    bm25_idfs: array,
+    max_impacts: Optional[array] = None,
+    impacts: Optional[list[array]] = None,
+    encoded_positions: Optional[list[bytes]] = None,
+) -> None:
+    """Write a versioned binary index that `IndexFile` can mmap
+
+    Arrays use native byte order, which is recorded in the header. The file is
+    written beside the target and renamed over it, so processes that already
+    mapped the previous version keep reading a consistent file.
+    """
+    term_blob = bytearray()
+    term_offsets = array("q", [0])
+    for term in terms:
+        term_blob += term.encode("utf-8")
+        term_offsets.append(len(term_blob))
+
+    postings_blob = bytearray()
+    postings_offsets = array("q", [0])
+    for data in encoded_postings:
+        postings_blob += data
+        postings_offsets.append(len(postings_blob))
+
+    flags = 0
+    posting_starts = array("q")
+    impacts_blob = array("d")
+    if impacts is not None and max_impacts is not None:
+        flags |= FLAG_IMPACTS
+        posting_starts.append(0)
+        for term_impacts in impacts:
+            impacts_blob.extend(term_impacts)
+            posting_starts.append(len(impacts_blob))
+    else:
+        max_impacts = array("d")
+
+    positions_blob = bytearray()
+    positions_offsets = array("q")
+    if encoded_positions is not None:
+        flags |= FLAG_POSITIONS
+        positions_offsets.append(0)
+        for data in encoded_positions:
+            positions_blob += data
+            positions_offsets.append(len(positions_blob))
+
+    payloads = {
+        "doc_ids": doc_ids.tobytes(),
+        "doc_lengths": doc_lengths.tobytes(),
+        "length_norms": length_norms.tobytes(),
+        "term_offsets": term_offsets.tobytes(),
+        "term_blob": bytes(term_blob),
+        "postings_offsets": postings_offsets.tobytes(),
+        "postings_blob": bytes(postings_blob),
+        "bm25_idfs": bm25_idfs.tobytes(),
+        "posting_starts": posting_starts.tobytes(),
+        "max_impacts": max_impacts.tobytes(),
+        "impacts": impacts_blob.tobytes(),
+        "positions_offsets": positions_offsets.tobytes(),
+        "positions_blob": bytes(positions_blob),
+    }
+
+    position = _align(HEADER.size + SECTION_ENTRY.size * len(SECTIONS))
+    table = []
+    for name in SECTIONS:
+        table.append((position, len(payloads[name])))
+        position = _align(position + len(payloads[name]))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(
+            HEADER.pack(
+                INDEX_MAGIC,
+                INDEX_VERSION,
+                BYTE_ORDER_MARK,
+                flags,
+                len(doc_ids),
+                len(terms),
+                avg_doc_length,
+            )
+        )
+        for offset, length in table:
+            f.write(SECTION_ENTRY.pack(offset, length))
+        for name, (offset, _) in zip(SECTIONS, table):
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(payloads[name])
+    os.replace(tmp_path, path)
+
+
+def _align(position: int) -> int:
+    return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class IndexFile:
+    """Read-only, memory-mapped view of an index written by `write_index`
+
+    Opening only parses the header; sections are typed memoryviews over the
+    mapping, so pages are faulted in on demand and shared through the OS
+    page cache between processes reading the same file.
+    """
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+
+        magic, version, byte_order, flags, doc_count, term_count, avg_doc_length = (
+            HEADER.unpack_from(buffer, 0)
+        )
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{path} is not an index file")
+        if version != INDEX_VERSION:
+            raise ValueError(
+                f"unsupported index format version {version}, expected {INDEX_VERSION}"
+            )
+        if byte_order != BYTE_ORDER_MARK:
+            raise ValueError(f"{path} was written on a machine with another byte order")
+
+        self.doc_count = doc_count
+        self.term_count = term_count
+        self.avg_doc_length = avg_doc_length
+        self.has_impacts = bool(flags & FLAG_IMPACTS)
+        self.has_positions = bool(flags & FLAG_POSITIONS)
+
+        sections = {}
+        for i, name in enumerate(SECTIONS):
+            offset, length = SECTION_ENTRY.unpack_from(
+                buffer, HEADER.size + i * SECTION_ENTRY.size
+            )
+            sections[name] = buffer[offset : offset + length].cast(
+                SECTION_TYPECODES[name]
+            )
+
+        self.doc_ids = sections["doc_ids"]
+        self.doc_lengths = sections["doc_lengths"]
+        self.length_norms = sections["length_norms"]
+        self.terms = TermDictionary(sections["term_offsets"], sections["term_blob"])
+        self.postings = MappedPostings(
+            self.terms, sections["postings_offsets"], sections["postings_blob"]
+        )
+        if self.has_positions:
+            self.postings.attach_positions(
+                sections["positions_offsets"], sections["positions_blob"]
+            )
+        self.bm25_idfs = TermValues(self.terms, sections["bm25_idfs"])
+        self.max_impacts = TermValues(self.terms, sections["max_impacts"])
+        self.impacts = TermSlices(
+            self.terms, sections["posting_starts"], sections["impacts"]
+        )
+
+
+class TermDictionary:
+    """Sorted term list resolved to ordinals by binary search over the mmap"""
+
+    def __init__(self, offsets: memoryview, blob: memoryview) -> None:
+        self.offsets = offsets
+        self.blob = blob
+        self.ordinal = lru_cache(maxsize=POSTINGS_CACHE_SIZE)(self.__ordinal)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self.term(i)
+
+    def term(self, ordinal: int) -> str:
+        return self.__term_bytes(ordinal).decode("utf-8")
+
+    def __term_bytes(self, ordinal: int) -> bytes:
+        return bytes(self.blob[self.offsets[ordinal] : self.offsets[ordinal + 1]])
+
+    def __ordinal(self, term: str) -> int:
+        key = term.encode("utf-8")
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.__term_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self.__term_bytes(lo) == key:
+            return lo
+        return -1
+
+
+class MappedPostings:
+    """Same interface as `CompactPostings`, backed by the mmap postings blob"""
+
+    def __init__(
+        self, terms: TermDictionary, offsets: memoryview, blob: memoryview
+    ) -> None:
+        self.terms = terms
+        self.offsets = offsets
+        self.blob = blob
+        self.positions_offsets: Optional[memoryview] = None
+        self.positions_blob: Optional[memoryview] = None
+        self._decode = lru_cache(maxsize=POSTINGS_CACHE_SIZE)(self.__decode)
+        self._decode_positions = lru_cache(maxsize=POSTINGS_CACHE_SIZE)(
+            self.__decode_positions
+        )
+
+    def attach_positions(self, offsets: memoryview, blob: memoryview) -> None:
+        self.positions_offsets = offsets
+        self.positions_blob = blob
+
+    @property
+    def has_positions(self) -> bool:
+        return self.positions_offsets is not None
+
+    def __contains__(self, term: object) -> bool:
+        return isinstance(term, str) and self.terms.ordinal(term) >= 0
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.terms)
+
+    def get(self, term: str) -> Optional[tuple[array, array]]:
+        ordinal = self.terms.ordinal(term)
+        if ordinal < 0:
+            return None
+        return self._decode(ordinal)
+
+    def positions(self, term: str) -> Optional[list[array]]:
+        ordinal = self.terms.ordinal(term)
+        if ordinal < 0 or self.positions_offsets is None:
+            return None
+        return self._decode_positions(ordinal)
+
+    def doc_freq(self, term: str) -> int:
+        ordinal = self.terms.ordinal(term)
+        if ordinal < 0:
+            return 0
+        return postings_doc_freq(self.__raw(ordinal))
+
+    def raw(self, term: str) -> bytes:
+        ordinal = self.terms.ordinal(term)
+        if ordinal < 0:
+            raise KeyError(term)
+        return self.__raw(ordinal)
+
+    def raw_positions(self, term: str) -> bytes:
+        ordinal = self.terms.ordinal(term)
+        if ordinal < 0 or self.positions_offsets is None:
+            raise KeyError(term)
+        return self.__raw_positions(ordinal)
+
+    def __raw(self, ordinal: int) -> bytes:
+        return bytes(self.blob[self.offsets[ordinal] : self.offsets[ordinal + 1]])
+
+    def __decode(self, ordinal: int) -> tuple[array, array]:
+        return decode_postings(self.__raw(ordinal))
+
+    def __raw_positions(self, ordinal: int) -> bytes:
+        start = self.positions_offsets[ordinal]
+        return bytes(self.positions_blob[start : self.positions_offsets[ordinal + 1]])
+
+    def __decode_positions(self, ordinal: int) -> list[array]:
+        _, tfs = self._decode(ordinal)
+        return decode_positions(self.__raw_positions(ordinal), tfs)
+
+
+class TermValues:
+    """Read-only term -> float mapping over a per-term mmap column"""
+
+    def __init__(self, terms: TermDictionary, values: memoryview) -> None:
+        self.terms = terms
+        self.values = values
+
+    def __contains__(self, term: object) -> bool:
+        return (
+            len(self.values) > 0
+            and isinstance(term, str)
+            and self.terms.ordinal(term) >= 0
+        )
+
+    def __getitem__(self, term: str) -> float:
+        ordinal = self.terms.ordinal(term)
+        if ordinal < 0 or not self.values:
+            raise KeyError(term)
+        return self.values[ordinal]
+
+    def get(self, term: str, default: Optional[float] = None) -> Optional[float]:
+        return self[term] if term in self else default
+
+
+class TermSlices:
+    """Read-only term -> per-posting float slice over a flat mmap column"""
+
+    def __init__(
+        self, terms: TermDictionary, starts: memoryview, values: memoryview
+    ) -> None:
+        self.terms = terms
+        self.starts = starts
+        self.values = values
+
+    def __contains__(self, term: object) -> bool:
+        return (
+            len(self.starts) > 0
+            and isinstance(term, str)
+            and self.terms.ordinal(term) >= 0
+        )
+
+    def __getitem__(self, term: str) -> memoryview:
+        ordinal = self.terms.ordinal(term)
+        if ordinal < 0 or not self.starts:
+            raise KeyError(term)
+        return self.values[self.starts[ordinal] : self.starts[ordinal + 1]]
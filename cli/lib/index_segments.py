@@ -0,0 +1,248 @@
+import json
+import os
+import shutil
+from array import array
+from collections.abc import Mapping
+from typing import Iterator, Optional
+
+from .document_store import DocumentStore, IndexedDocuments, write_document_store
+from .index_format import IndexFile, write_index
+from .postings import (
+    CompactPostings,
+    PostingsBuilder,
+    encode_positions,
+    encode_postings,
+    find_posting,
+)
+
+MANIFEST_NAME = "manifest.json"
+BASE_SEGMENT = "index"
+
+
+class Segment:
+    """One immutable slice of the index plus the tombstones recorded against it
+
+    Segments share the dense-id layout of the base index: doc_ids is sorted
+    and postings refer to positions in it. Deletions never rewrite a segment;
+    they add the dense id to `deleted` until the next merge drops it. A
+    segment with a `corpus_path` reads its records from that shared document
+    store, with `docs_path` holding only the documents the store lacks.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        postings,
+        doc_ids,
+        doc_lengths,
+        total_length: int,
+        docs: Optional[Mapping[int, dict]] = None,
+        docs_path: Optional[str] = None,
+        deleted: Optional[set[int]] = None,
+        corpus_path: Optional[str] = None,
+    ) -> None:
+        self.name = name
+        self.postings = postings
+        self.doc_ids = doc_ids
+        self.doc_lengths = doc_lengths
+        self.total_length = total_length
+        self._docs = docs
+        self.docs_path = docs_path
+        self.corpus_path = corpus_path
+        self.deleted: set[int] = deleted if deleted is not None else set()
+
+    @property
+    def docs(self) -> Mapping[int, dict]:
+        if self._docs is None:
+            if self.corpus_path is not None:
+                overlay = None
+                if self.docs_path is not None and os.path.exists(self.docs_path):
+                    overlay = DocumentStore(self.docs_path)
+                self._docs = IndexedDocuments(
+                    self.doc_ids, DocumentStore(self.corpus_path), overlay
+                )
+            elif self.docs_path is None:
+                self._docs = {}
+            else:
+                self._docs = DocumentStore(self.docs_path).by_id
+        return self._docs
+
+    @property
+    def live_count(self) -> int:
+        return len(self.doc_ids) - len(self.deleted)
+
+    @property
+    def live_total_length(self) -> int:
+        deleted_length = 0
+        for dense_id in self.deleted:
+            deleted_length += self.doc_lengths[dense_id]
+        return self.total_length - deleted_length
+
+    def locate(self, doc_id: int) -> int:
+        """Dense id of a live document in this segment, or -1"""
+        dense_id = find_posting(self.doc_ids, doc_id)
+        if dense_id in self.deleted:
+            return -1
+        return dense_id
+
+    def live_postings(self, term: str) -> Iterator[tuple[int, int]]:
+        postings = self.postings.get(term)
+        if postings is None:
+            return
+        if not self.deleted:
+            yield from zip(*postings)
+            return
+        for dense_id, tf in zip(*postings):
+            if dense_id not in self.deleted:
+                yield dense_id, tf
+
+
+def memtable_segment(
+    pending: dict[int, tuple[dict, list[str]]], positions: bool = False
+) -> Segment:
+    """Queryable segment over documents added since the last flush"""
+    builder = PostingsBuilder(positions)
+    doc_ids = array("i")
+    doc_lengths = array("i")
+    docs = {}
+    for doc_id in sorted(pending):
+        doc, tokens = pending[doc_id]
+        builder.add(len(doc_ids), tokens)
+        doc_ids.append(doc_id)
+        doc_lengths.append(len(tokens))
+        docs[doc_id] = doc
+    return Segment(
+        "memtable", builder.finish(), doc_ids, doc_lengths, sum(doc_lengths), docs
+    )
+
+
+def segment_paths(directory: str, name: str) -> tuple[str, str]:
+    return (
+        os.path.join(directory, f"{name}.bin"),
+        os.path.join(directory, f"{name}.docs"),
+    )
+
+
+def write_segment(directory: str, name: str, segment: Segment) -> Segment:
+    # Segments carry no precomputed scoring data: norms and IDFs depend on
+    # corpus-wide statistics, which are recomputed across segments at query
+    # time and baked in again when segments are merged into the base index.
+    os.makedirs(directory, exist_ok=True)
+    index_path, docs_path = segment_paths(directory, name)
+    terms = sorted(segment.postings)
+    encoded_positions = None
+    if segment.postings.has_positions:
+        encoded_positions = [segment.postings.raw_positions(term) for term in terms]
+    write_index(
+        index_path,
+        doc_ids=segment.doc_ids,
+        doc_lengths=segment.doc_lengths,
+        length_norms=array("d"),
+        avg_doc_length=segment.total_length / max(len(segment.doc_ids), 1),
+        terms=terms,
+        encoded_postings=[segment.postings.raw(term) for term in terms],
+        bm25_idfs=array("d"),
+        encoded_positions=encoded_positions,
+    )
+    docs = segment.docs
+    write_document_store(docs_path, (docs[doc_id] for doc_id in segment.doc_ids))
+    return open_segment(directory, name)
+
+
+def open_segment(directory: str, name: str) -> Segment:
+    index_path, docs_path = segment_paths(directory, name)
+    index_file = IndexFile(index_path)
+    total_length = round(index_file.avg_doc_length * index_file.doc_count)
+    return Segment(
+        name,
+        index_file.postings,
+        index_file.doc_ids,
+        index_file.doc_lengths,
+        total_length,
+        docs_path=docs_path,
+    )
+
+
+def read_manifest(directory: str) -> dict:
+    path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {"segments": [], "deleted": {}, "next_segment": 1}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def write_manifest(directory: str, manifest: dict) -> None:
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, MANIFEST_NAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def clear_segments(directory: str) -> None:
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+
+
+def merge_segments(
+    segments: list[Segment],
+) -> tuple[CompactPostings, array, array, dict[int, dict]]:
+    """Compact live documents of all segments into one dense-id space
+
+    Postings are remapped rather than re-analyzed, and doc ids are re-sorted,
+    so the result matches a fresh build over the same documents.
+
+    Returns:
+        Postings, doc ids, doc lengths and movie records of the merged index
+    """
+    live = []
+    for segment_idx, segment in enumerate(segments):
+        for dense_id in range(len(segment.doc_ids)):
+            if dense_id not in segment.deleted:
+                live.append((segment.doc_ids[dense_id], segment_idx, dense_id))
+    live.sort()
+
+    remaps = [array("i", [-1]) * len(segment.doc_ids) for segment in segments]
+    doc_ids = array("i")
+    doc_lengths = array("i")
+    docmap = {}
+    for new_id, (doc_id, segment_idx, dense_id) in enumerate(live):
+        segment = segments[segment_idx]
+        remaps[segment_idx][dense_id] = new_id
+        doc_ids.append(doc_id)
+        doc_lengths.append(segment.doc_lengths[dense_id])
+        docmap[doc_id] = segment.docs[doc_id]
+
+    terms = set()
+    for segment in segments:
+        terms.update(segment.postings)
+
+    with_positions = all(segment.postings.has_positions for segment in segments)
+    encoded = {}
+    encoded_positions = {} if with_positions else None
+    for term in sorted(terms):
+        merged = []
+        for segment, remap in zip(segments, remaps):
+            postings = segment.postings.get(term)
+            if postings is None:
+                continue
+            positions = segment.postings.positions(term) if with_positions else None
+            for i, (dense_id, tf) in enumerate(zip(*postings)):
+                new_id = remap[dense_id]
+                if new_id >= 0:
+                    merged.append((new_id, tf, positions[i] if positions else None))
+        if not merged:
+            continue
+        merged.sort(key=lambda posting: posting[0])
+        encoded[term] = encode_postings(
+            array("i", (posting[0] for posting in merged)),
+            array("i", (posting[1] for posting in merged)),
+        )
+        if encoded_positions is not None:
+            encoded_positions[term] = encode_positions(
+                [posting[2] for posting in merged]
+            )
+
+    postings = CompactPostings(encoded, encoded_positions)
+    return postings, doc_ids, doc_lengths, docmap
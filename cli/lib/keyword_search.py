@@ -1,87 +1,525 @@
+import heapq
 import math
 import os
-import pickle
-import string
+import shutil
+from array import array
+from bisect import bisect_left
 from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from operator import itemgetter
+from collections.abc import Mapping
+from typing import Optional
 
-from nltk.stem import PorterStemmer
+import numpy as np
 
+from .document_store import (
+    DocumentMap,
+    DocumentStore,
+    IndexedDocuments,
+    load_documents,
+    write_document_store,
+)
+from .index_format import IndexFile, write_index
+from .index_segments import (
+    BASE_SEGMENT,
+    MANIFEST_NAME,
+    Segment,
+    clear_segments,
+    memtable_segment,
+    merge_segments,
+    open_segment,
+    read_manifest,
+    write_manifest,
+    write_segment,
+)
+from .metadata_filter import (
+    FilterClause,
+    MetadataIndex,
+    matches_filter,
+    metadata_index_for,
+    parse_filter,
+)
+from .phrase_search import (
+    has_phrases,
+    intersect_candidates,
+    parse_phrase_query,
+    phrase_candidates,
+)
+from .postings import CompactPostings, PostingsBuilder, find_posting, gallop
+from .sparse_bm25 import SparseBM25, load_sparse_bm25
 from .search_utils import (
     BM25_B,
     BM25_K1,
+    BUILD_SHARDS_PER_WORKER,
     CACHE_DIR,
     DEFAULT_SEARCH_LIMIT,
+    DOCUMENT_STORE_PATH,
+    MAX_INDEX_SEGMENTS,
+    STEM_CACHE_PATH,
     format_search_result,
-    load_movies,
-    load_stopwords,
 )
+from .text_analyzer import PUNCTUATION_TABLE, get_analyzer
 
 
 class InvertedIndex:
-    def __init__(self) -> None:
-        self.index = defaultdict(set)
-        self.docmap: dict[int, dict] = {}
-        self.index_path = os.path.join(CACHE_DIR, "index.pkl")
-        self.docmap_path = os.path.join(CACHE_DIR, "docmap.pkl")
-        self.tf_path = os.path.join(CACHE_DIR, "term_frequencies.pkl")
-        self.doc_lengths_path = os.path.join(CACHE_DIR, "doc_lengths.pkl")
-        self.term_frequencies = defaultdict(Counter)
-        self.doc_lengths = {}
-
-    def build(self) -> None:
-        movies = load_movies()
-        for m in movies:
-            doc_id = m["id"]
-            doc_description = f"{m['title']} {m['description']}"
-            self.docmap[doc_id] = m
-            self.__add_document(doc_id, doc_description)
+    def __init__(
+        self, impacts: bool = False, sparse: bool = False, positions: bool = False
+    ) -> None:
+        self.use_impacts = impacts
+        self.use_sparse = sparse
+        self.use_positions = positions
+        self.postings = CompactPostings()
+        self.index_path = os.path.join(CACHE_DIR, "index.bin")
+        # Records are read from the shared document store; index.docs only
+        # holds documents that updates added or changed since it was written.
+        self.corpus_path = DOCUMENT_STORE_PATH
+        self.docs_path = os.path.join(CACHE_DIR, "index.docs")
+        self.segments_dir = os.path.join(CACHE_DIR, "segments")
+        self.sparse_dir = os.path.join(CACHE_DIR, "bm25_csr")
+        # Postings refer to documents by dense id: the position of the movie
+        # id in the sorted doc_ids array, which doc_lengths is aligned with.
+        self.doc_ids = array("i")
+        self.doc_lengths = array("i")
+        self.avg_doc_length = 0.0
+        self.bm25_idfs: dict[str, float] = {}
+        self.length_norms = array("d")
+        self.impacts: dict[str, array] = {}
+        self.max_impacts: dict[str, float] = {}
+        self.sparse: Optional[SparseBM25] = None
+        # Incremental updates: the base index is the first segment, flushed
+        # changes become further immutable segments, and unflushed additions
+        # sit in `pending` until the next flush. Tombstones live on segments.
+        self.base = Segment(
+            BASE_SEGMENT, self.postings, self.doc_ids, self.doc_lengths, 0, {}
+        )
+        self.segments: list[Segment] = []
+        self.pending: dict[int, tuple[dict, list[str]]] = {}
+        self.next_segment = 1
+        self._segments_view: Optional[list[Segment]] = None
+        self._live_docmap: Optional[dict[int, dict]] = None
+        self._metadata_index: Optional[MetadataIndex] = None
+        self._filter_positions: Optional[np.ndarray] = None
+
+    @property
+    def docmap(self) -> Mapping[int, dict]:
+        # The base records are a lazy view over the document store, so only
+        # the documents a search actually returns are ever decoded.
+        if not self.has_updates:
+            return self.base.docs
+        if self._live_docmap is None:
+            live_docmap = {}
+            for segment in self.__segments_view():
+                for dense_id, doc_id in enumerate(segment.doc_ids):
+                    if dense_id not in segment.deleted:
+                        live_docmap[doc_id] = segment.docs[doc_id]
+            self._live_docmap = live_docmap
+        return self._live_docmap
+
+    @property
+    def has_updates(self) -> bool:
+        return bool(self.segments or self.pending or self.base.deleted)
+
+    def build(self, workers: int = 1) -> None:
+        # Documents are streamed from the store in id order and only their
+        # text is analyzed; the records themselves stay on disk.
+        docs = load_documents().by_id
+        get_analyzer().load_stem_cache(STEM_CACHE_PATH)
+        builder = PostingsBuilder(self.use_positions)
+        if workers > 1:
+            doc_descriptions = []
+            for doc in docs.values():
+                self.doc_ids.append(doc["id"])
+                doc_descriptions.append(f"{doc['title']} {doc['description']}")
+            self.__build_sharded(builder, doc_descriptions, workers)
+        else:
+            analyzer = get_analyzer()
+            for doc in docs.values():
+                tokens = analyzer.analyze(f"{doc['title']} {doc['description']}")
+                self.__add_document(builder, doc["id"], tokens)
+        self.postings = builder.finish()
+        self.__reset_segments(docs)
+        self.__prepare_engines()
+
+    def __reset_segments(self, docs: Optional[Mapping[int, dict]] = None) -> None:
+        # A freshly built base has its records in hand; a loaded one opens
+        # them lazily and recovers its total length from the stored average.
+        if docs is not None:
+            total_length = sum(self.doc_lengths)
+        else:
+            total_length = round(self.avg_doc_length * len(self.doc_ids))
+        self.base = Segment(
+            BASE_SEGMENT,
+            self.postings,
+            self.doc_ids,
+            self.doc_lengths,
+            total_length,
+            docs=docs,
+            docs_path=self.docs_path,
+            corpus_path=self.corpus_path,
+        )
+        self.segments = []
+        self.pending = {}
+        self.next_segment = 1
+        self._metadata_index = None
+        self.__invalidate()
+
+    def __invalidate(self) -> None:
+        self._segments_view = None
+        self._live_docmap = None
 
     def save(self) -> None:
+        # Saving always writes one compact base index; pending segments and
+        # tombstones are merged into it first.
+        if self.has_updates:
+            self.__compact()
         os.makedirs(CACHE_DIR, exist_ok=True)
-        with open(self.index_path, "wb") as f:
-            pickle.dump(self.index, f)
-        with open(self.docmap_path, "wb") as f:
-            pickle.dump(self.docmap, f)
-        with open(self.tf_path, "wb") as f:
-            pickle.dump(self.term_frequencies, f)
-        with open(self.doc_lengths_path, "wb") as f:
-            pickle.dump(self.doc_lengths, f)
+        terms = sorted(self.postings)
+        bm25_idfs = array("d")
+        for term in terms:
+            bm25_idfs.append(self.bm25_idfs[term])
+        encoded_positions = None
+        if self.postings.has_positions:
+            encoded_positions = [self.postings.raw_positions(term) for term in terms]
+        max_impacts, impacts = None, None
+        if self.use_impacts:
+            max_impacts = array("d")
+            impacts = []
+            for term in terms:
+                max_impacts.append(self.max_impacts[term])
+                impacts.append(self.impacts[term])
+        write_index(
+            self.index_path,
+            doc_ids=self.doc_ids,
+            doc_lengths=self.doc_lengths,
+            length_norms=self.length_norms,
+            avg_doc_length=self.avg_doc_length,
+            terms=terms,
+            encoded_postings=[self.postings.raw(term) for term in terms],
+            bm25_idfs=bm25_idfs,
+            max_impacts=max_impacts,
+            impacts=impacts,
+            encoded_positions=encoded_positions,
+        )
+        overlay = self.__overlay_documents()
+        if overlay:
+            write_document_store(self.docs_path, overlay)
+        elif os.path.exists(self.docs_path):
+            os.remove(self.docs_path)
+        if os.path.exists(self.sparse_dir):
+            shutil.rmtree(self.sparse_dir)
+        if self.use_sparse and self.sparse is not None:
+            self.sparse.save(self.sparse_dir)
+        clear_segments(self.segments_dir)
+        # Merge the saved stems first so a save after a few updates does not
+        # replace them with only the ones this process computed.
+        analyzer = get_analyzer()
+        analyzer.load_stem_cache(STEM_CACHE_PATH)
+        analyzer.save_stem_cache(STEM_CACHE_PATH)
+
+    @property
+    def updated_at(self) -> float:
+        """Modification time of the saved index or its latest flushed update"""
+        mtime = os.path.getmtime(self.index_path)
+        manifest_path = os.path.join(self.segments_dir, MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            mtime = max(mtime, os.path.getmtime(manifest_path))
+        return mtime
+
+    def __overlay_documents(self) -> list[dict]:
+        # A fresh build reads every record from the store itself; after
+        # merged updates, only documents the store lacks or holds
+        # differently are written.
+        docs = self.base.docs
+        if isinstance(docs, DocumentMap) and docs.store.path == self.corpus_path:
+            return []
+        store = DocumentStore(self.corpus_path)
+        overlay = []
+        for doc_id in self.doc_ids:
+            doc = docs[doc_id]
+            if store.get(doc_id) != doc:
+                overlay.append(doc)
+        return overlay
+
+    @property
+    def is_stale(self) -> bool:
+        """Whether the saved index is missing or older than the document store"""
+        return not os.path.exists(self.index_path) or (
+            os.path.exists(self.corpus_path)
+            and os.path.getmtime(self.index_path) < os.path.getmtime(self.corpus_path)
+        )
 
     def load(self) -> None:
-        with open(self.index_path, "rb") as f:
-            self.index = pickle.load(f)
-        with open(self.docmap_path, "rb") as f:
-            self.docmap = pickle.load(f)
-        with open(self.tf_path, "rb") as f:
-            self.term_frequencies = pickle.load(f)
-        with open(self.doc_lengths_path, "rb") as f:
-            self.doc_lengths = pickle.load(f)
+        # Opening the index only maps the file; statistics, norms and IDFs
+        # were precomputed at build time and are read in place.
+        if self.is_stale and os.path.exists(self.index_path):
+            raise ValueError(
+                "the document store changed since the index was built, rebuild it"
+            )
+        index_file = IndexFile(self.index_path)
+        self.postings = index_file.postings
+        self.doc_ids = index_file.doc_ids
+        self.doc_lengths = index_file.doc_lengths
+        self.avg_doc_length = index_file.avg_doc_length
+        self.length_norms = index_file.length_norms
+        self.bm25_idfs = index_file.bm25_idfs
+        self.use_impacts = index_file.has_impacts
+        self.use_positions = index_file.has_positions
+        self.max_impacts = index_file.max_impacts
+        self.impacts = index_file.impacts
+        self.sparse = load_sparse_bm25(self.sparse_dir, index_file.terms.ordinal)
+        if self.sparse is not None and self.sparse.term_count != len(index_file.terms):
+            raise ValueError("sparse BM25 matrix does not match the index, rebuild it")
+        self.use_sparse = self.sparse is not None
+        self.__reset_segments()
+        self.__load_segments()
+
+    def load_or_build(self) -> None:
+        """Load the saved index, rebuilding it first if it is missing or stale
+
+        A stale index is rebuilt with the modes it was saved with. One with
+        unmerged updates is not rebuilt, since the store lacks those changes.
+        """
+        if not self.is_stale:
+            self.load()
+            return
+        if os.path.exists(self.index_path):
+            manifest = read_manifest(self.segments_dir)
+            if manifest["segments"] or manifest["deleted"]:
+                raise ValueError(
+                    "the document store changed since the index was built, "
+                    "rebuild it"
+                )
+            index_file = IndexFile(self.index_path)
+            self.use_impacts = index_file.has_impacts
+            self.use_positions = index_file.has_positions
+            self.use_sparse = os.path.exists(self.sparse_dir)
+        self.build()
+        self.save()
+
+    def __load_segments(self) -> None:
+        manifest = read_manifest(self.segments_dir)
+        self.segments = []
+        for name in manifest["segments"]:
+            self.segments.append(open_segment(self.segments_dir, name))
+        self.next_segment = manifest["next_segment"]
+        for segment in [self.base] + self.segments:
+            for doc_id in manifest["deleted"].get(segment.name, []):
+                segment.deleted.add(find_posting(segment.doc_ids, doc_id))
+        self.__invalidate()
+
+    def __write_manifest(self) -> None:
+        deleted = {}
+        for segment in [self.base] + self.segments:
+            if segment.deleted:
+                deleted[segment.name] = sorted(
+                    segment.doc_ids[dense_id] for dense_id in segment.deleted
+                )
+        write_manifest(
+            self.segments_dir,
+            {
+                "segments": [segment.name for segment in self.segments],
+                "deleted": deleted,
+                "next_segment": self.next_segment,
+            },
+        )
+
+    def __segments_view(self) -> list[Segment]:
+        if self._segments_view is None:
+            view = [self.base] + self.segments
+            if self.pending:
+                view.append(memtable_segment(self.pending, self.use_positions))
+            self._segments_view = view
+        return self._segments_view
+
+    def __locate(self, doc_id: int) -> tuple[Optional[Segment], int]:
+        # Newer segments shadow older ones; each live doc id is in exactly one.
+        for segment in reversed(self.__segments_view()):
+            dense_id = segment.locate(doc_id)
+            if dense_id >= 0:
+                return segment, dense_id
+        return None, -1
+
+    def add_document(self, doc: dict) -> None:
+        doc_id = doc["id"]
+        if doc_id in self.pending or self.__locate(doc_id)[0] is not None:
+            raise ValueError(f"document {doc_id} is already indexed")
+        tokens = tokenize_text(f"{doc['title']} {doc['description']}")
+        self.pending[doc_id] = (doc, tokens)
+        self.__invalidate()
+
+    def update_document(self, doc: dict) -> None:
+        self.delete_document(doc["id"])
+        self.add_document(doc)
+
+    def delete_document(self, doc_id: int) -> None:
+        if doc_id in self.pending:
+            del self.pending[doc_id]
+            self.__invalidate()
+            return
+        segment, dense_id = self.__locate(doc_id)
+        if segment is None:
+            raise ValueError(f"document {doc_id} is not indexed")
+        segment.deleted.add(dense_id)
+        self.__invalidate()
+
+    def flush(self) -> None:
+        """Persist pending changes as a new segment plus manifest tombstones"""
+        if self.pending:
+            name = f"seg-{self.next_segment:06d}"
+            self.next_segment += 1
+            segment = memtable_segment(self.pending, self.use_positions)
+            self.segments.append(write_segment(self.segments_dir, name, segment))
+            self.pending = {}
+        self.__write_manifest()
+        self.__invalidate()
+        if len(self.segments) > MAX_INDEX_SEGMENTS:
+            self.merge()
+
+    def merge(self) -> None:
+        """Compact all segments and tombstones into a fresh base index"""
+        self.save()
+
+    def __compact(self) -> None:
+        postings, doc_ids, doc_lengths, docmap = merge_segments(
+            self.__segments_view()
+        )
+        self.postings = postings
+        self.doc_ids = doc_ids
+        self.doc_lengths = doc_lengths
+        self.avg_doc_length = self.__get_avg_doc_length()
+        self.__reset_segments(docmap)
+        self.__prepare_engines()
+
+    def __doc_count(self) -> int:
+        if not self.has_updates:
+            return len(self.doc_ids)
+        doc_count = 0
+        for segment in self.__segments_view():
+            doc_count += segment.live_count
+        return doc_count
+
+    def __live_avg_doc_length(self) -> float:
+        if not self.has_updates:
+            return self.avg_doc_length
+        doc_count = self.__doc_count()
+        if doc_count == 0:
+            return 0.0
+        total_length = 0
+        for segment in self.__segments_view():
+            total_length += segment.live_total_length
+        return total_length / doc_count
+
+    def __term_doc_count(self, token: str) -> int:
+        if not self.has_updates:
+            return self.postings.doc_freq(token)
+        term_doc_count = 0
+        for segment in self.__segments_view():
+            for _ in segment.live_postings(token):
+                term_doc_count += 1
+        return term_doc_count
+
+    def __prepare_engines(self) -> None:
+        self.__prepare_scoring()
+        if self.use_impacts:
+            self.__build_impacts()
+        if self.use_sparse:
+            self.sparse = SparseBM25.from_postings(
+                self.postings, self.bm25_idfs, self.length_norms, len(self.doc_ids)
+            )
+
+    def __prepare_scoring(self) -> None:
+        # Corpus statistics only change on build/load, so BM25 IDFs and the
+        # k1-scaled length norms are computed once instead of per query term.
+        self.avg_doc_length = self.__get_avg_doc_length()
+        doc_count = len(self.doc_ids)
+        self.bm25_idfs = {}
+        for term in self.postings:
+            self.bm25_idfs[term] = bm25_idf(doc_count, self.postings.doc_freq(term))
+        self.length_norms = array("d")
+        for doc_length in self.doc_lengths:
+            self.length_norms.append(
+                BM25_K1 * length_norm(doc_length, self.avg_doc_length)
+            )
+
+    def __build_impacts(self) -> None:
+        # Impacts are the full BM25 contribution of each posting, aligned with
+        # the doc-id ordered postings, plus each term's maximum for pruning.
+        self.impacts = {}
+        self.max_impacts = {}
+        for term in self.postings:
+            idf = self.bm25_idfs[term]
+            doc_ids, tfs = self.postings.get(term)
+            term_impacts = array("d")
+            for doc_id, tf in zip(doc_ids, tfs):
+                tf_component = (tf * (BM25_K1 + 1)) / (tf + self.length_norms[doc_id])
+                term_impacts.append(tf_component * idf)
+            self.impacts[term] = term_impacts
+            self.max_impacts[term] = max(term_impacts)
 
     def get_documents(self, term: str) -> list[int]:
-        doc_ids = self.index.get(term, set())
-        return sorted(list(doc_ids))
+        if self.has_updates:
+            doc_ids = []
+            for segment in self.__segments_view():
+                for dense_id, _ in segment.live_postings(term):
+                    doc_ids.append(segment.doc_ids[dense_id])
+            return sorted(doc_ids)
+        postings = self.postings.get(term)
+        if postings is None:
+            return []
+        return [self.doc_ids[doc_id] for doc_id in postings[0]]
+
+    def __build_sharded(
+        self, builder: PostingsBuilder, doc_descriptions: list[str], workers: int
+    ) -> None:
+        # Shards are contiguous runs of the id-sorted corpus, so appending
+        # each shard's postings at its dense-id offset, in shard order, yields
+        # exactly the postings a single-process build would produce.
+        n_shards = min(len(doc_descriptions), workers * BUILD_SHARDS_PER_WORKER)
+        shard_size = max(1, -(-len(doc_descriptions) // max(n_shards, 1)))
+        shards = []
+        for start in range(0, len(doc_descriptions), shard_size):
+            shards.append(doc_descriptions[start : start + shard_size])
+
+        doc_offset = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for shard_terms, shard_positions, shard_lengths, stems in pool.map(
+                index_shard, shards, repeat(self.use_positions)
+            ):
+                builder.extend(shard_terms, doc_offset, shard_positions)
+                self.doc_lengths.extend(shard_lengths)
+                doc_offset += len(shard_lengths)
+                get_analyzer().merge_stem_cache(stems)
 
-    def __add_document(self, doc_id: int, text: str) -> None:
-        tokens = tokenize_text(text)
-        for token in set(tokens):
-            self.index[token].add(doc_id)
-        self.term_frequencies[doc_id].update(tokens)
-        self.doc_lengths[doc_id] = len(tokens)
+    def __add_document(
+        self, builder: PostingsBuilder, doc_id: int, tokens: list[str]
+    ) -> None:
+        builder.add(len(self.doc_ids), tokens)
+        self.doc_ids.append(doc_id)
+        self.doc_lengths.append(len(tokens))
 
     def get_tf(self, doc_id: int, term: str) -> int:
         tokens = tokenize_text(term)
         if len(tokens) != 1:
             raise ValueError("term must be a single token")
         token = tokens[0]
-        return self.term_frequencies[doc_id][token]
+        segment, dense_id = self.__locate(doc_id)
+        if segment is None:
+            return 0
+        postings = segment.postings.get(token)
+        if postings is None:
+            return 0
+        doc_ids, tfs = postings
+        pos = find_posting(doc_ids, dense_id)
+        return tfs[pos] if pos >= 0 else 0
 
     def get_idf(self, term: str) -> float:
         tokens = tokenize_text(term)
         if len(tokens) != 1:
             raise ValueError("term must be a single token")
         token = tokens[0]
-        doc_count = len(self.docmap)
-        term_doc_count = len(self.index[token])
+        doc_count = self.__doc_count()
+        term_doc_count = self.__term_doc_count(token)
         return math.log((doc_count + 1) / (term_doc_count + 1))
 
     def get_bm25_idf(self, term: str) -> float:
@@ -89,21 +527,18 @@ class InvertedIndex:
         if len(tokens) != 1:
             raise ValueError("term must be a single token")
         token = tokens[0]
-        doc_count = len(self.docmap)
-        term_doc_count = len(self.index[token])
-        return math.log((doc_count - term_doc_count + 0.5) / (term_doc_count + 0.5) + 1)
+        if not self.has_updates and token in self.bm25_idfs:
+            return self.bm25_idfs[token]
+        return bm25_idf(self.__doc_count(), self.__term_doc_count(token))
 
     def get_bm25_tf(
         self, doc_id: int, term: str, k1: float = BM25_K1, b: float = BM25_B
     ) -> float:
         tf = self.get_tf(doc_id, term)
-        doc_length = self.doc_lengths.get(doc_id, 0)
-        avg_doc_length = self.__get_avg_doc_length()
-        if avg_doc_length > 0:
-            length_norm = 1 - b + b * (doc_length / avg_doc_length)
-        else:
-            length_norm = 1
-        return (tf * (k1 + 1)) / (tf + k1 * length_norm)
+        segment, dense_id = self.__locate(doc_id)
+        doc_length = segment.doc_lengths[dense_id] if segment is not None else 0
+        norm = length_norm(doc_length, self.__live_avg_doc_length(), b)
+        return (tf * (k1 + 1)) / (tf + k1 * norm)
 
     def get_tf_idf(self, doc_id: int, term: str) -> float:
         tf = self.get_tf(doc_id, term)
@@ -113,31 +548,139 @@ class InvertedIndex:
     def __get_avg_doc_length(self) -> float:
         if not self.doc_lengths or len(self.doc_lengths) == 0:
             return 0.0
-        total_length = 0
-        for length in self.doc_lengths.values():
-            total_length += length
-        return total_length / len(self.doc_lengths)
+        return sum(self.doc_lengths) / len(self.doc_lengths)
 
     def bm25(self, doc_id: int, term: str) -> float:
         tf_component = self.get_bm25_tf(doc_id, term)
         idf_component = self.get_bm25_idf(term)
         return tf_component * idf_component
 
-    def bm25_search(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
-        query_tokens = tokenize_text(query)
+    def bm25_search(
+        self,
+        query: str,
+        limit: int = DEFAULT_SEARCH_LIMIT,
+        filter_expr: Optional[str] = None,
+    ) -> list[dict]:
+        """BM25 search; quoted phrases ("..." or "..."~N) must match in order
+
+        An index built without positions cannot check phrases, so there the
+        quoted words are scored as ordinary terms. With a metadata filter
+        (see `parse_filter`), postings of documents outside it are skipped
+        before scoring, so the top `limit` are taken among matching documents
+        only.
+        """
+        query, phrases = parse_phrase_query(query)
+        if not self.use_positions:
+            phrases = []
+        query_counts = Counter(tokenize_text(query))
+        allowed, clauses = None, None
+        if filter_expr is not None and self.has_updates:
+            clauses = parse_filter(filter_expr, self.__metadata_index().field_kind)
+        elif filter_expr is not None:
+            allowed = self.__filter_mask(filter_expr)
+
+        if phrases:
+            # Phrase constraints are resolved first, and only the surviving
+            # candidates are scored.
+            if self.has_updates:
+                candidates = self.__segmented_phrase_candidates(phrases)
+                top_docs = self.__segmented_search(
+                    query_counts, limit, candidates, clauses
+                )
+            else:
+                dense_candidates = self.__phrase_candidates(phrases)
+                top_dense = self.__term_at_a_time_search(
+                    query_counts, limit, dense_candidates, allowed
+                )
+                top_docs = self.__to_doc_ids(top_dense)
+        elif self.has_updates:
+            top_docs = self.__segmented_search(query_counts, limit, None, clauses)
+        else:
+            if self.sparse is not None:
+                top_dense = self.sparse.search(query_counts, limit, allowed)
+            elif self.use_impacts:
+                top_dense = self.__impact_search(query_counts, limit, allowed)
+            else:
+                top_dense = self.__term_at_a_time_search(
+                    query_counts, limit, None, allowed
+                )
+            top_docs = self.__to_doc_ids(top_dense)
+
+        return self.__format_results(top_docs)
+
+    def bm25_search_batch(
+        self,
+        queries: list[str],
+        limit: int = DEFAULT_SEARCH_LIMIT,
+        filter_expr: Optional[str] = None,
+    ) -> list[list[dict]]:
+        if (
+            self.has_updates
+            or self.sparse is None
+            or any(has_phrases(query) for query in queries)
+        ):
+            return [self.bm25_search(query, limit, filter_expr) for query in queries]
+
+        allowed = None
+        if filter_expr is not None:
+            allowed = self.__filter_mask(filter_expr)
+        query_counts = []
+        for tokens in get_analyzer().analyze_many(queries):
+            query_counts.append(Counter(tokens))
+        results = []
+        for top_dense in self.sparse.search_batch(query_counts, limit, allowed):
+            results.append(self.__format_results(self.__to_doc_ids(top_dense)))
+        return results
+
+    def __filter_mask(self, filter_expr: str) -> np.ndarray:
+        mask = self.__metadata_index().mask(filter_expr)
+        if self._filter_positions is not None:
+            mask = mask[self._filter_positions]
+        return mask
+
+    def __metadata_index(self) -> MetadataIndex:
+        # Dense ids are positions in the id-sorted base documents. When they
+        # all come from the shared store, its disk-cached filter columns are
+        # used and each mask is gathered into dense order.
+        if self._metadata_index is None:
+            docs = self.base.docs
+            store = None
+            if isinstance(docs, DocumentMap):
+                store = docs.store
+            elif isinstance(docs, IndexedDocuments) and docs.overlay is None:
+                store = docs.store
+            if store is not None:
+                ids = np.asarray(store.ids)
+                order = np.asarray(store.id_order)
+                dense_ids = np.asarray(self.doc_ids, dtype=ids.dtype)
+                positions = order[np.searchsorted(ids[order], dense_ids)]
+                self._metadata_index = metadata_index_for(store)
+                self._filter_positions = positions
+            else:
+                self._metadata_index = MetadataIndex(
+                    [docs[doc_id] for doc_id in self.doc_ids]
+                )
+                self._filter_positions = None
+        return self._metadata_index
 
-        scores = {}
-        for doc_id in self.docmap:
-            score = 0.0
-            for token in query_tokens:
-                score += self.bm25(doc_id, token)
-            scores[doc_id] = score
+    def __to_doc_ids(
+        self, top_dense: list[tuple[int, float]]
+    ) -> list[tuple[int, float]]:
+        top_docs = []
+        for dense_id, score in top_dense:
+            top_docs.append((self.doc_ids[dense_id], score))
+        return top_docs
 
-        sorted_docs = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+    def __document(self, doc_id: int) -> dict:
+        if not self.has_updates:
+            return self.base.docs[doc_id]
+        segment, _ = self.__locate(doc_id)
+        return segment.docs[doc_id]
 
+    def __format_results(self, top_docs: list[tuple[int, float]]) -> list[dict]:
         results = []
-        for doc_id, score in sorted_docs[:limit]:
-            doc = self.docmap[doc_id]
+        for doc_id, score in top_docs:
+            doc = self.__document(doc_id)
             formatted_result = format_search_result(
                 doc_id=doc["id"],
                 title=doc["title"],
@@ -148,13 +691,299 @@ class InvertedIndex:
 
         return results
 
+    def __phrase_candidates(self, phrases: list[tuple[list[str], int]]) -> array:
+        if not self.postings.has_positions:
+            raise ValueError("phrase queries need an index built with --positions")
+        candidates = None
+        # Rarest phrases first, so later intersections start from a small set.
+        for terms, slop in sorted(phrases, key=self.__phrase_doc_freq):
+            matches = phrase_candidates(self.postings, terms, slop)
+            if candidates is None:
+                candidates = matches
+            else:
+                candidates = intersect_candidates(candidates, matches)
+            if not candidates:
+                break
+        return candidates
 
-def build_command() -> None:
-    idx = InvertedIndex()
-    idx.build()
+    def __phrase_doc_freq(self, phrase: tuple[list[str], int]) -> int:
+        return min(self.postings.doc_freq(term) for term in phrase[0])
+
+    def __segmented_phrase_candidates(
+        self, phrases: list[tuple[list[str], int]]
+    ) -> set[int]:
+        candidates = None
+        for terms, slop in phrases:
+            matches = set()
+            for segment in self.__segments_view():
+                if not segment.postings.has_positions:
+                    raise ValueError(
+                        "phrase queries need an index built with --positions"
+                    )
+                for dense_id in phrase_candidates(segment.postings, terms, slop):
+                    if dense_id not in segment.deleted:
+                        matches.add(segment.doc_ids[dense_id])
+            candidates = matches if candidates is None else candidates & matches
+        return candidates
+
+    def __term_at_a_time_search(
+        self,
+        query_counts: Counter,
+        limit: int,
+        candidates: Optional[array] = None,
+        allowed: Optional[np.ndarray] = None,
+    ) -> list[tuple[int, float]]:
+        # Term-at-a-time: only documents in the postings of a query term are
+        # ever touched, so the cost grows with matches rather than corpus size.
+        scores: dict[int, float] = defaultdict(float)
+        for token, count in query_counts.items():
+            postings = self.postings.get(token)
+            if postings is None:
+                continue
+            idf = self.bm25_idfs[token]
+            if candidates is not None:
+                postings = self.__restrict_postings(postings, candidates)
+            if allowed is not None:
+                postings = filter_postings(allowed, *postings)
+            for doc_id, tf in zip(*postings):
+                tf_component = (tf * (BM25_K1 + 1)) / (tf + self.length_norms[doc_id])
+                scores[doc_id] += count * tf_component * idf
+
+        return heapq.nlargest(limit, scores.items(), key=itemgetter(1))
+
+    @staticmethod
+    def __restrict_postings(
+        postings: tuple[array, array], candidates: array
+    ) -> tuple[array, array]:
+        doc_ids, tfs = postings
+        kept_doc_ids, kept_tfs = array("i"), array("i")
+        pos = 0
+        for doc_id in candidates:
+            pos = gallop(doc_ids, doc_id, pos)
+            if pos == len(doc_ids):
+                break
+            if doc_ids[pos] == doc_id:
+                kept_doc_ids.append(doc_id)
+                kept_tfs.append(tfs[pos])
+        return kept_doc_ids, kept_tfs
+
+    def __segmented_search(
+        self,
+        query_counts: Counter,
+        limit: int,
+        candidates: Optional[set[int]] = None,
+        clauses: Optional[list[FilterClause]] = None,
+    ) -> list[tuple[int, float]]:
+        # With pending updates the precomputed IDFs, norms and impacts are
+        # stale, so statistics are taken over the live documents of every
+        # segment and scores are keyed by movie id. Segments have no filter
+        # columns, so a filter is checked on each matched document once.
+        segments = self.__segments_view()
+        doc_count = self.__doc_count()
+        avg_doc_length = self.__live_avg_doc_length()
+        scores: dict[int, float] = defaultdict(float)
+        passes: dict[int, bool] = {}
+        for token, count in query_counts.items():
+            matches = []
+            for segment in segments:
+                for dense_id, tf in segment.live_postings(token):
+                    matches.append((segment, dense_id, tf))
+            if not matches:
+                continue
+            idf = bm25_idf(doc_count, len(matches))
+            for segment, dense_id, tf in matches:
+                doc_length = segment.doc_lengths[dense_id]
+                doc_id = segment.doc_ids[dense_id]
+                if candidates is not None and doc_id not in candidates:
+                    continue
+                if clauses is not None:
+                    if doc_id not in passes:
+                        doc = segment.docs[doc_id]
+                        passes[doc_id] = matches_filter(clauses, doc)
+                    if not passes[doc_id]:
+                        continue
+                norm = BM25_K1 * length_norm(doc_length, avg_doc_length)
+                tf_component = (tf * (BM25_K1 + 1)) / (tf + norm)
+                scores[doc_id] += count * tf_component * idf
+
+        return heapq.nlargest(limit, scores.items(), key=itemgetter(1))
+
+    def __impact_search(
+        self, query_counts: Counter, limit: int, allowed: Optional[np.ndarray] = None
+    ) -> list[tuple[int, float]]:
+        term_postings = []
+        for token, count in query_counts.items():
+            postings = self.postings.get(token)
+            if postings is None:
+                continue
+            # The unfiltered maximum still bounds the filtered impacts.
+            upper_bound = count * self.max_impacts[token]
+            doc_ids, term_impacts = postings[0], self.impacts[token]
+            if allowed is not None:
+                doc_ids, term_impacts = filter_postings(allowed, doc_ids, term_impacts)
+            term_postings.append((doc_ids, term_impacts, count, upper_bound))
+        return max_score_top_k(term_postings, limit)
+
+
+def index_shard(doc_descriptions: list[str], positions: bool = False) -> tuple[
+    dict[str, tuple[array, array]],
+    Optional[dict[str, list[array]]],
+    array,
+    dict[str, str],
+]:
+    """Analyze and invert one shard of a parallel build in a worker process
+
+    Returns:
+        Shard-local postings keyed by term, their token positions if
+        requested, document lengths, and the stems computed for this shard so
+        the parent can persist them
+    """
+    analyzer = get_analyzer()
+    # Workers keep their analyzer across shards; only the stems that are new
+    # since the previous shard are sent back.
+    analyzer.take_new_stems()
+    builder = PostingsBuilder(positions)
+    doc_lengths = array("i")
+    for doc_id, tokens in enumerate(analyzer.analyze_many(doc_descriptions)):
+        builder.add(doc_id, tokens)
+        doc_lengths.append(len(tokens))
+    return builder.terms, builder.positions, doc_lengths, analyzer.take_new_stems()
+
+
+def max_score_top_k(
+    term_postings: list[tuple[array, array, int, float]], limit: int
+) -> list[tuple[int, float]]:
+    """Exact top-k over impact postings using MaxScore dynamic pruning
+
+    Args:
+        term_postings: Per query term (doc_ids, impacts, weight, upper_bound),
+            with doc_ids sorted ascending and impacts aligned to them
+        limit: Number of results to return
+
+    Returns:
+        (doc_id, score) pairs ordered by descending score
+    """
+    if limit <= 0 or not term_postings:
+        return []
+
+    # Terms are ordered by their score upper bound. Once the running sum of the
+    # smallest bounds cannot beat the k-th best score, those terms become
+    # non-essential: they are only probed for documents found via the others.
+    term_postings = sorted(term_postings, key=itemgetter(3))
+    n_terms = len(term_postings)
+    prefix_bounds = []
+    bound_sum = 0.0
+    for _, _, _, upper_bound in term_postings:
+        bound_sum += upper_bound
+        prefix_bounds.append(bound_sum)
+
+    cursors = [0] * n_terms
+    heap: list[tuple[float, int]] = []
+    threshold = 0.0
+    first_essential = 0
+
+    while first_essential < n_terms:
+        doc_id = None
+        for i in range(first_essential, n_terms):
+            doc_ids = term_postings[i][0]
+            if cursors[i] < len(doc_ids) and (
+                doc_id is None or doc_ids[cursors[i]] < doc_id
+            ):
+                doc_id = doc_ids[cursors[i]]
+        if doc_id is None:
+            break
+
+        score = 0.0
+        for i in range(first_essential, n_terms):
+            doc_ids, term_impacts, weight, _ = term_postings[i]
+            pos = cursors[i]
+            if pos < len(doc_ids) and doc_ids[pos] == doc_id:
+                score += weight * term_impacts[pos]
+                cursors[i] = pos + 1
+
+        for i in range(first_essential - 1, -1, -1):
+            if score + prefix_bounds[i] <= threshold:
+                break
+            doc_ids, term_impacts, weight, _ = term_postings[i]
+            pos = bisect_left(doc_ids, doc_id, cursors[i])
+            cursors[i] = pos
+            if pos < len(doc_ids) and doc_ids[pos] == doc_id:
+                score += weight * term_impacts[pos]
+
+        if len(heap) < limit:
+            heapq.heappush(heap, (score, doc_id))
+        elif score > heap[0][0]:
+            heapq.heapreplace(heap, (score, doc_id))
+        else:
+            continue
+
+        if len(heap) == limit:
+            threshold = heap[0][0]
+            while (
+                first_essential < n_terms
+                and prefix_bounds[first_essential] <= threshold
+            ):
+                first_essential += 1
+
+    top_docs = sorted(heap, reverse=True)
+    return [(doc_id, score) for score, doc_id in top_docs]
+
+
+def filter_postings(allowed: np.ndarray, doc_ids, *values) -> tuple[list, ...]:
+    """Posting entries, and the values aligned with them, of allowed documents"""
+    dense_ids = np.asarray(doc_ids, dtype=np.int32)
+    keep = allowed[dense_ids]
+    return (dense_ids[keep].tolist(), *(np.asarray(v)[keep].tolist() for v in values))
+
+
+def bm25_idf(doc_count: int, term_doc_count: int) -> float:
+    return math.log((doc_count - term_doc_count + 0.5) / (term_doc_count + 0.5) + 1)
+
+
+def length_norm(doc_length: int, avg_doc_length: float, b: float = BM25_B) -> float:
+    if avg_doc_length > 0:
+        return 1 - b + b * (doc_length / avg_doc_length)
+    return 1
+
+
+def build_command(
+    impacts: bool = False,
+    workers: int = 1,
+    sparse: bool = False,
+    positions: bool = False,
+) -> None:
+    idx = InvertedIndex(impacts, sparse, positions)
+    idx.build(workers)
     idx.save()
 
 
+def add_command(doc: dict) -> None:
+    idx = InvertedIndex()
+    idx.load()
+    idx.add_document(doc)
+    idx.flush()
+
+
+def update_command(doc: dict) -> None:
+    idx = InvertedIndex()
+    idx.load()
+    idx.update_document(doc)
+    idx.flush()
+
+
+def delete_command(doc_id: int) -> None:
+    idx = InvertedIndex()
+    idx.load()
+    idx.delete_document(doc_id)
+    idx.flush()
+
+
+def merge_command() -> None:
+    idx = InvertedIndex()
+    idx.load()
+    idx.merge()
+
+
 def search_command(query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
     idx = InvertedIndex()
     idx.load()
@@ -176,27 +1005,12 @@ def search_command(query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
 
 def preprocess_text(text: str) -> str:
     text = text.lower()
-    text = text.translate(str.maketrans("", "", string.punctuation))
+    text = text.translate(PUNCTUATION_TABLE)
     return text
 
 
 def tokenize_text(text: str) -> list[str]:
-    text = preprocess_text(text)
-    tokens = text.split()
-    valid_tokens = []
-    for token in tokens:
-        if token:
-            valid_tokens.append(token)
-    stop_words = load_stopwords()
-    filtered_words = []
-    for word in valid_tokens:
-        if word not in stop_words:
-            filtered_words.append(word)
-    stemmer = PorterStemmer()
-    stemmed_words = []
-    for word in filtered_words:
-        stemmed_words.append(stemmer.stem(word))
-    return stemmed_words
+    return get_analyzer().analyze(text)
 
 
 def tf_command(doc_id: int, term: str) -> int:
@@ -231,7 +1045,9 @@ def tfidf_command(doc_id: int, term: str) -> float:
     return idx.get_tf_idf(doc_id, term)
 
 
-def bm25search_command(query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
+def bm25search_command(
+    query: str, limit: int = DEFAULT_SEARCH_LIMIT, filter_expr: Optional[str] = None
+) -> list[dict]:
     idx = InvertedIndex()
     idx.load()
-    return idx.bm25_search(query, limit)
+    return idx.bm25_search(query, limit, filter_expr)
@@ -0,0 +1,340 @@
+import os
+import re
+import shlex
+from collections import OrderedDict
+from collections.abc import Sequence
+from typing import Callable, NamedTuple, Optional, Union
+
+import numpy as np
+
+from .document_store import DocumentStore
+from .search_utils import METADATA_FILTER_CACHE_SIZE, METADATA_INDEX_DIR
+
+CLAUSE_PATTERN = re.compile(r"^([A-Za-z_]\w*)\s*(<=|>=|!=|=|<|>)\s*(.+)$")
+RANGE_SEPARATOR = ".."
+
+
+class FilterClause(NamedTuple):
+    field: str
+    op: str
+    values: tuple[str, ...]
+
+
+def parse_filter(
+    expression: str, field_kind: Optional[Callable[[str], Optional[str]]] = None
+) -> list[FilterClause]:
+    """Parse a filter such as `year>=1990 genres=comedy,drama`
+
+    Clauses are separated by spaces (quote a clause that contains spaces)
+    and must all hold. `=` and `!=` take comma-separated alternatives,
+    and numeric fields also accept inclusive ranges like `year=1990..1999`.
+    With `field_kind` (see `MetadataIndex.field_kind`), each clause is also
+    checked against its field's type, so every search path rejects the same
+    filters.
+    """
+    clauses = []
+    for token in shlex.split(expression):
+        match = CLAUSE_PATTERN.match(token)
+        if match is None:
+            raise ValueError(f"invalid filter clause: {token}")
+        field, op, raw = match.groups()
+        values = tuple(value.strip() for value in raw.split(","))
+        if not all(values):
+            raise ValueError(f"empty value in filter clause: {token}")
+        if op not in ("=", "!=") and len(values) > 1:
+            raise ValueError(f"{op} takes a single value: {token}")
+        clause = FilterClause(field, op, values)
+        if field_kind is not None:
+            _check_clause(clause, field_kind(field))
+        clauses.append(clause)
+    return clauses
+
+
+def _check_clause(clause: FilterClause, kind: Optional[str]) -> None:
+    if kind is None:
+        raise ValueError(f"unknown filter field: {clause.field}")
+    for value in clause.values:
+        if kind == NumericColumn.kind:
+            # Raises unless the value is a number or a range of numbers.
+            if RANGE_SEPARATOR in value:
+                _range(value)
+            else:
+                _number(value)
+        elif clause.op not in ("=", "!="):
+            raise ValueError(f"{clause.op} needs a numeric field: {clause.field}")
+        elif RANGE_SEPARATOR in value:
+            raise ValueError(f"ranges need a numeric field: {value}")
+
+
+def clause_matches(clause: FilterClause, doc: dict) -> bool:
+    """Whether a single document satisfies a clause (list fields match any item)"""
+    raw = doc.get(clause.field)
+    items = raw if isinstance(raw, list) else [] if raw is None else [raw]
+    if clause.op in ("=", "!="):
+        found = any(_item_equals(item, clause.values) for item in items)
+        return found if clause.op == "=" else not found
+    bound = _number(clause.values[0])
+    for item in items:
+        if not _is_number(item):
+            continue
+        if (
+            (clause.op == "<" and item < bound)
+            or (clause.op == "<=" and item <= bound)
+            or (clause.op == ">" and item > bound)
+            or (clause.op == ">=" and item >= bound)
+        ):
+            return True
+    return False
+
+
+def matches_filter(clauses: list[FilterClause], doc: dict) -> bool:
+    return all(clause_matches(clause, doc) for clause in clauses)
+
+
+def _item_equals(item, values: tuple[str, ...]) -> bool:
+    for value in values:
+        if _is_number(item) and RANGE_SEPARATOR in value:
+            low, high = _range(value)
+            if low <= item <= high:
+                return True
+        elif _is_number(item):
+            if item == _number(value):
+                return True
+        elif _term(item) == value.lower():
+            return True
+    return False
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _number(text: str) -> float:
+    try:
+        return float(text)
+    except ValueError:
+        raise ValueError(f"expected a number in filter, got {text!r}") from None
+
+
+def _range(text: str) -> tuple[float, float]:
+    low, _, high = text.partition(RANGE_SEPARATOR)
+    return (
+        _number(low) if low else -np.inf,
+        _number(high) if high else np.inf,
+    )
+
+
+def _term(value) -> str:
+    return str(value).lower()
+
+
+class NumericColumn:
+    """A numeric field as a value array plus the positions sorted by value
+
+    Comparisons and ranges are two binary searches over the sorted values;
+    documents missing the field hold NaN, which sorts last and never matches.
+    """
+
+    kind = "numeric"
+
+    def __init__(self, values: np.ndarray, order: Optional[np.ndarray] = None) -> None:
+        self.values = values
+        self.order = np.argsort(values, kind="stable") if order is None else order
+        self.sorted_values = values[self.order]
+        self.valid_count = int(np.count_nonzero(~np.isnan(values)))
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        return {"values": self.values, "order": self.order}
+
+    def positions(self, op: str, values: tuple[str, ...]) -> np.ndarray:
+        sorted_values = self.sorted_values[: self.valid_count]
+        if op in ("=", "!="):
+            found = []
+            for value in values:
+                low, high = (
+                    _range(value)
+                    if RANGE_SEPARATOR in value
+                    else (_number(value),) * 2
+                )
+                start = np.searchsorted(sorted_values, low, side="left")
+                end = np.searchsorted(sorted_values, high, side="right")
+                found.append(self.order[start:end])
+            return np.concatenate(found)
+        bound = _number(values[0])
+        # Strict bounds stop before equal values, inclusive ones after them.
+        side = "left" if op in ("<", ">=") else "right"
+        split = np.searchsorted(sorted_values, bound, side)
+        if op in ("<", "<="):
+            return self.order[:split]
+        return self.order[split : self.valid_count]
+
+
+class TermColumn:
+    """A text, flag or list field as a posting list of positions per value
+
+    Values are compared case-insensitively; each item of a list field (such
+    as genres) is a value of its own.
+    """
+
+    kind = "term"
+
+    def __init__(
+        self, terms: np.ndarray, offsets: np.ndarray, postings: np.ndarray
+    ) -> None:
+        self.terms = terms
+        self.offsets = offsets
+        self.postings = postings
+        self.term_rows = {term: row for row, term in enumerate(terms.tolist())}
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        return {
+            "terms": self.terms,
+            "offsets": self.offsets,
+            "postings": self.postings,
+        }
+
+    def positions(self, op: str, values: tuple[str, ...]) -> np.ndarray:
+        found = [np.zeros(0, dtype=np.int32)]
+        for value in values:
+            row = self.term_rows.get(value.lower())
+            if row is not None:
+                found.append(self.postings[self.offsets[row] : self.offsets[row + 1]])
+        return np.concatenate(found)
+
+
+Column = Union[NumericColumn, TermColumn]
+
+
+def build_column(documents: Sequence[dict], field: str) -> Optional[Column]:
+    """Column over one field of every document, or None if no document has it"""
+    raw_values = [doc.get(field) for doc in documents]
+    items = [
+        value
+        for raw in raw_values
+        for value in (raw if isinstance(raw, list) else [raw])
+        if value is not None
+    ]
+    if not items:
+        return None
+    if all(_is_number(item) for item in items) and not any(
+        isinstance(raw, list) for raw in raw_values
+    ):
+        values = np.array(
+            [np.nan if raw is None else raw for raw in raw_values], dtype=np.float64
+        )
+        return NumericColumn(values)
+
+    positions_by_term: dict[str, list[int]] = {}
+    for position, raw in enumerate(raw_values):
+        for value in raw if isinstance(raw, list) else [raw]:
+            if value is not None:
+                positions = positions_by_term.setdefault(_term(value), [])
+                if not positions or positions[-1] != position:
+                    positions.append(position)
+    terms = sorted(positions_by_term)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum([len(positions_by_term[term]) for term in terms], out=offsets[1:])
+    postings = np.fromiter(
+        (p for term in terms for p in positions_by_term[term]),
+        dtype=np.int32,
+        count=int(offsets[-1]),
+    )
+    return TermColumn(np.array(terms, dtype=str), offsets, postings)
+
+
+class MetadataIndex:
+    """Per-field columns over a document sequence, for compiling filters
+
+    A filter compiles to a boolean mask over document positions, which the
+    search engines apply while traversing postings or scoring vectors. The
+    columns are built on first use of a field; with a `source_path` (the
+    file the documents come from) they are also saved under
+    METADATA_INDEX_DIR and reused until that file changes. Recent masks
+    are kept in an LRU keyed by the filter expression.
+    """
+
+    def __init__(
+        self,
+        documents: Sequence[dict],
+        source_path: Optional[str] = None,
+        cache_size: int = METADATA_FILTER_CACHE_SIZE,
+    ) -> None:
+        self.documents = documents
+        self.source_path = source_path
+        self.directory = None
+        if source_path is not None:
+            self.directory = os.path.join(
+                METADATA_INDEX_DIR, os.path.basename(source_path)
+            )
+        self.columns: dict[str, Optional[Column]] = {}
+        self.cache_size = cache_size
+        self.masks: OrderedDict[str, np.ndarray] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def column(self, field: str) -> Optional[Column]:
+        if field not in self.columns:
+            column = self._load_column(field)
+            if column is None:
+                column = build_column(self.documents, field)
+                if column is not None:
+                    self._save_column(field, column)
+            self.columns[field] = column
+        return self.columns[field]
+
+    def field_kind(self, field: str) -> Optional[str]:
+        column = self.column(field)
+        return None if column is None else column.kind
+
+    def mask(self, expression: str) -> np.ndarray:
+        """Boolean mask of the documents matching a filter expression"""
+        clauses = parse_filter(expression, self.field_kind)
+        key = " ".join(f"{c.field}{c.op}{','.join(c.values)}" for c in clauses)
+        mask = self.masks.get(key)
+        if mask is not None:
+            self.masks.move_to_end(key)
+            return mask
+
+        mask = np.ones(len(self.documents), dtype=bool)
+        for clause in clauses:
+            column = self.columns[clause.field]
+            clause_mask = np.zeros(len(self.documents), dtype=bool)
+            clause_mask[column.positions(clause.op, clause.values)] = True
+            mask &= ~clause_mask if clause.op == "!=" else clause_mask
+        mask.setflags(write=False)
+        self.masks[key] = mask
+        while len(self.masks) > self.cache_size:
+            self.masks.popitem(last=False)
+        return mask
+
+    def _column_path(self, field: str) -> str:
+        return os.path.join(self.directory, f"{field}.npz")
+
+    def _load_column(self, field: str) -> Optional[Column]:
+        if self.directory is None:
+            return None
+        path = self._column_path(field)
+        if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(
+            self.source_path
+        ):
+            return None
+        with np.load(path) as data:
+            if str(data["kind"]) == NumericColumn.kind:
+                return NumericColumn(data["values"], data["order"])
+            return TermColumn(data["terms"], data["offsets"], data["postings"])
+
+    def _save_column(self, field: str, column: Column) -> None:
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._column_path(field)
+        with open(f"{path}.tmp", "wb") as f:
+            np.savez(f, kind=np.array(column.kind), **column.arrays())
+        os.replace(f"{path}.tmp", path)
+
+
+def metadata_index_for(documents: Sequence[dict]) -> MetadataIndex:
+    """Metadata index over a document store (columns cached on disk) or a list"""
+    source_path = documents.path if isinstance(documents, DocumentStore) else None
+    return MetadataIndex(documents, source_path)
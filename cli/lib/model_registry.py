@@ -0,0 +1,129 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+from .search_utils import MODEL_REGISTRY_MAX_BYTES
+
+SENTENCE_TRANSFORMER = "sentence_transformer"
+CROSS_ENCODER = "cross_encoder"
+
+
+def _load_sentence_transformer(name: str) -> Any:
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(name)
+
+
+def _load_cross_encoder(name: str) -> Any:
+    from sentence_transformers import CrossEncoder
+
+    return CrossEncoder(name)
+
+
+def _warm_sentence_transformer(model: Any) -> None:
+    model.encode(["warmup"])
+
+
+def _warm_cross_encoder(model: Any) -> None:
+    model.predict([["warmup", "warmup"]])
+
+
+LOADERS: dict[str, Callable[[str], Any]] = {
+    SENTENCE_TRANSFORMER: _load_sentence_transformer,
+    CROSS_ENCODER: _load_cross_encoder,
+}
+WARMERS: dict[str, Callable[[Any], None]] = {
+    SENTENCE_TRANSFORMER: _warm_sentence_transformer,
+    CROSS_ENCODER: _warm_cross_encoder,
+}
+
+
+def model_nbytes(model: Any) -> int:
+    """Bytes held by a model's parameters, or 0 if it exposes none"""
+    module = model if hasattr(model, "parameters") else getattr(model, "model", None)
+    if module is None or not hasattr(module, "parameters"):
+        return 0
+    return sum(p.numel() * p.element_size() for p in module.parameters())
+
+
+class ModelRegistry:
+    """Process-wide models, each loaded once on first use
+
+    Models are keyed by kind and name, so every search class, the CLIP
+    search and the cross-encoder reranker share one instance per model.
+    With `max_bytes`, the least recently used models are dropped once
+    their parameters exceed the budget; the model just requested is
+    always kept.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = MODEL_REGISTRY_MAX_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.models: OrderedDict[tuple[str, str], Any] = OrderedDict()
+        self.sizes: dict[tuple[str, str], int] = {}
+        self.lock = threading.Lock()
+
+    def get(self, kind: str, name: str) -> Any:
+        if kind not in LOADERS:
+            raise ValueError(f"unknown model kind: {kind}")
+        key = (kind, name)
+        with self.lock:
+            model = self.models.get(key)
+            if model is not None:
+                self.models.move_to_end(key)
+                return model
+            model = LOADERS[kind](name)
+            self.models[key] = model
+            self.sizes[key] = model_nbytes(model)
+            self._evict_over_budget()
+            return model
+
+    def warmup(self, kind: str, name: str) -> Any:
+        """Load a model ahead of time and run one tiny inference through it"""
+        model = self.get(kind, name)
+        WARMERS[kind](model)
+        return model
+
+    def is_loaded(self, kind: str, name: str) -> bool:
+        return (kind, name) in self.models
+
+    def evict(self, kind: str, name: str) -> None:
+        with self.lock:
+            self.models.pop((kind, name), None)
+            self.sizes.pop((kind, name), None)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.models.clear()
+            self.sizes.clear()
+
+    @property
+    def nbytes(self) -> int:
+        return sum(self.sizes.values())
+
+    def _evict_over_budget(self) -> None:
+        if self.max_bytes is None:
+            return
+        while len(self.models) > 1 and self.nbytes > self.max_bytes:
+            key, _ = self.models.popitem(last=False)
+            del self.sizes[key]
+
+
+_registry: Optional[ModelRegistry] = None
+
+
+def get_model_registry() -> ModelRegistry:
+    global _registry
+    if _registry is None:
+        _registry = ModelRegistry()
+    return _registry
+
+
+def get_model(kind: str, name: str) -> Any:
+    return get_model_registry().get(kind, name)
+
+
+def warmup_models(models: list[tuple[str, str]]) -> None:
+    """Load and warm (kind, name) pairs, e.g. before serving the first query"""
+    registry = get_model_registry()
+    for kind, name in models:
+        registry.warmup(kind, name)
@@ -1,9 +1,10 @@
 import os
 
 from PIL import Image
-from sentence_transformers import SentenceTransformer
 
-from .search_utils import format_search_result, load_movies
+from .document_store import load_documents
+from .model_registry import SENTENCE_TRANSFORMER, get_model
+from .search_utils import format_search_result
 from .semantic_search import cosine_similarity
 
 
@@ -14,8 +15,22 @@ class MultimodalSearch:
         for doc in self.documents:
             self.texts.append(f"{doc['title']}: {doc['description']}")
 
-        self.model = SentenceTransformer(model_name)
-        self.text_embeddings = self.model.encode(self.texts, show_progress_bar=True)
+        self.model_name = model_name
+        self._text_embeddings = None
+
+    @property
+    def model(self):
+        return get_model(SENTENCE_TRANSFORMER, self.model_name)
+
+    @property
+    def text_embeddings(self):
+        # Encoded on the first search, so embedding just an image never loads
+        # CLIP over the whole corpus.
+        if self._text_embeddings is None:
+            self._text_embeddings = self.model.encode(
+                self.texts, show_progress_bar=True
+            )
+        return self._text_embeddings
 
     def embed_image(self, image_path):
         if not os.path.exists(image_path):
@@ -58,7 +73,7 @@ def image_search_command(image_path="data/paddington.jpeg", limit=5):
     if not os.path.exists(image_path):
         raise FileNotFoundError(f"Image file not found: {image_path}")
 
-    movies = load_movies()
+    movies = load_documents()
     searcher = MultimodalSearch(movies)
     results = searcher.search_with_image(image_path, limit)
 
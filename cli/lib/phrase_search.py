@@ -0,0 +1,162 @@
+import heapq
+import math
+import re
+from array import array
+from collections import Counter, deque
+from typing import Optional
+
+from .postings import gallop
+from .text_analyzer import get_analyzer
+
+# "exact phrase" or "words near each other"~N, where N is the number of extra
+# analyzed tokens allowed inside the window spanned by the phrase terms.
+PHRASE_PATTERN = re.compile(r'"([^"]+)"(?:~(\d+))?')
+
+
+def parse_phrase_query(query: str) -> tuple[str, list[tuple[list[str], int]]]:
+    """Split quoted phrases out of a query
+
+    Returns:
+        The query text with quotes and slop markers removed, so phrase words
+        still contribute to scoring, and the analyzed (terms, slop) phrases
+    """
+    analyzer = get_analyzer()
+    phrases = []
+    for match in PHRASE_PATTERN.finditer(query):
+        terms = analyzer.analyze(match.group(1))
+        if terms:
+            phrases.append((terms, int(match.group(2) or 0)))
+    text = PHRASE_PATTERN.sub(lambda match: f" {match.group(1)} ", query)
+    return text, phrases
+
+
+def has_phrases(query: str) -> bool:
+    return PHRASE_PATTERN.search(query) is not None
+
+
+def intersect_postings(doc_id_lists: list[array]) -> list[tuple[int, list[int]]]:
+    """Documents present in every sorted postings list
+
+    Walks the shortest list and gallops through the others, so the cost is
+    bounded by the rarest term rather than the most common one.
+
+    Returns:
+        (doc_id, index of doc_id in each input list) for every common document
+    """
+    if not doc_id_lists:
+        return []
+    order = sorted(range(len(doc_id_lists)), key=lambda i: len(doc_id_lists[i]))
+    cursors = [0] * len(doc_id_lists)
+    matches = []
+    for lead_pos, doc_id in enumerate(doc_id_lists[order[0]]):
+        cursors[order[0]] = lead_pos
+        found = True
+        for i in order[1:]:
+            doc_ids = doc_id_lists[i]
+            pos = gallop(doc_ids, doc_id, cursors[i])
+            cursors[i] = pos
+            if pos == len(doc_ids):
+                return matches
+            if doc_ids[pos] != doc_id:
+                found = False
+                break
+        if found:
+            matches.append((doc_id, list(cursors)))
+    return matches
+
+
+def phrase_matches(
+    term_positions: list[array], slop: int = 0, repeats: Optional[list[int]] = None
+) -> bool:
+    """Whether one document's term positions satisfy a phrase
+
+    With slop 0 the terms must be consecutive and in order, and
+    `term_positions` holds one list per phrase word. Otherwise it holds one
+    list per distinct term, and `repeats[i]` distinct occurrences of term i
+    (1 by default) must all fit in a window of len(phrase) + slop tokens, in
+    any order.
+    """
+    if slop == 0:
+        first, rest = term_positions[0], term_positions[1:]
+        for start in first:
+            for offset, positions in enumerate(rest, 1):
+                pos = gallop(positions, start + offset)
+                if pos == len(positions) or positions[pos] != start + offset:
+                    break
+            else:
+                return True
+        return False
+    if repeats is None:
+        repeats = [1] * len(term_positions)
+    return min_window(term_positions, repeats) <= sum(repeats) + slop
+
+
+def min_window(term_positions: list[array], repeats: list[int]) -> float:
+    """Smallest span of tokens holding `repeats[i]` positions from list i
+
+    Returns infinity if some list has fewer positions than it needs.
+    """
+    events = heapq.merge(
+        *(
+            [(position, i) for position in positions]
+            for i, positions in enumerate(term_positions)
+        )
+    )
+    window = deque()
+    counts = [0] * len(term_positions)
+    missing = len(term_positions)
+    best = math.inf
+    for position, i in events:
+        window.append((position, i))
+        counts[i] += 1
+        if counts[i] == repeats[i]:
+            missing -= 1
+        # Shrink from the left while every term still has enough occurrences.
+        while missing == 0:
+            start, j = window.popleft()
+            best = min(best, position - start + 1)
+            if counts[j] == repeats[j]:
+                missing += 1
+            counts[j] -= 1
+    return best
+
+
+def phrase_candidates(postings, terms: list[str], slop: int = 0) -> array:
+    """Sorted dense ids of documents in `postings` that contain the phrase"""
+    repeats = None
+    if slop > 0:
+        # Unordered matching: a repeated word becomes one term that needs
+        # that many distinct occurrences, so one position cannot fill two
+        # slots.
+        counts = Counter(terms)
+        terms, repeats = list(counts), list(counts.values())
+    doc_id_lists, position_lists = [], []
+    for term in terms:
+        term_postings = postings.get(term)
+        if term_postings is None:
+            return array("i")
+        doc_id_lists.append(term_postings[0])
+        position_lists.append(postings.positions(term))
+
+    candidates = array("i")
+    for doc_id, cursors in intersect_postings(doc_id_lists):
+        term_positions = []
+        for positions, pos in zip(position_lists, cursors):
+            term_positions.append(positions[pos])
+        if phrase_matches(term_positions, slop, repeats):
+            candidates.append(doc_id)
+    return candidates
+
+
+def intersect_candidates(left: array, right: array) -> array:
+    if len(left) > len(right):
+        left, right = right, left
+    out = array("i")
+    pos = 0
+    for doc_id in left:
+        pos = gallop(right, doc_id, pos)
+        if pos == len(right):
+            break
+        if right[pos] == doc_id:
+            out.append(doc_id)
+    return out
@@ -0,0 +1,245 @@
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+from itertools import accumulate
+from typing import Iterable, Iterator, Optional
+
+POSTINGS_CACHE_SIZE = 1024
+
+
+def encode_varints(values: Iterable[int], out: bytearray) -> None:
+    for value in values:
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+
+
+def decode_varints(
+    data: bytes, offset: int = 0, count: int = -1
+) -> tuple[list[int], int]:
+    """Decode LEB128 varints
+
+    Args:
+        data: Encoded buffer
+        offset: Position of the first varint
+        count: Number of values to decode, or -1 for the rest of the buffer
+
+    Returns:
+        Decoded values and the offset just past the last one
+    """
+    values: list[int] = []
+    append = values.append
+    value = 0
+    shift = 0
+    end = len(data)
+    while offset < end and count != 0:
+        byte = data[offset]
+        offset += 1
+        if byte < 0x80:
+            append(value | (byte << shift))
+            value = 0
+            shift = 0
+            count -= 1
+        else:
+            value |= (byte & 0x7F) << shift
+            shift += 7
+    return values, offset
+
+
+def encode_postings(doc_ids: array, tfs: array) -> bytes:
+    """Serialize one term's postings as count, doc-id gaps, then frequencies"""
+    out = bytearray()
+    encode_varints((len(doc_ids),), out)
+    previous = 0
+    gaps = []
+    for doc_id in doc_ids:
+        gaps.append(doc_id - previous)
+        previous = doc_id
+    encode_varints(gaps, out)
+    encode_varints(tfs, out)
+    return bytes(out)
+
+
+def decode_postings(data: bytes) -> tuple[array, array]:
+    values, _ = decode_varints(data)
+    count = values[0]
+    doc_ids = array("i", accumulate(values[1 : count + 1]))
+    tfs = array("i", values[count + 1 :])
+    return doc_ids, tfs
+
+
+def encode_positions(positions: list[array]) -> bytes:
+    """Serialize each posting's sorted token positions as gaps, back to back"""
+    out = bytearray()
+    for doc_positions in positions:
+        previous = 0
+        gaps = []
+        for position in doc_positions:
+            gaps.append(position - previous)
+            previous = position
+        encode_varints(gaps, out)
+    return bytes(out)
+
+
+def decode_positions(data: bytes, tfs: array) -> list[array]:
+    values, _ = decode_varints(data)
+    positions = []
+    start = 0
+    for tf in tfs:
+        positions.append(array("i", accumulate(values[start : start + tf])))
+        start += tf
+    return positions
+
+
+def postings_doc_freq(data: bytes) -> int:
+    values, _ = decode_varints(data, count=1)
+    return values[0]
+
+
+def find_posting(doc_ids: array, doc_id: int, lo: int = 0) -> int:
+    """Index of doc_id in a sorted postings array, or -1 if absent"""
+    pos = bisect_left(doc_ids, doc_id, lo)
+    if pos < len(doc_ids) and doc_ids[pos] == doc_id:
+        return pos
+    return -1
+
+
+def gallop(doc_ids: array, doc_id: int, lo: int = 0) -> int:
+    """First index >= lo whose doc id is >= doc_id, found by exponential search
+
+    Cheaper than a full binary search when intersecting a short postings list
+    with a long one, since successive targets are usually close to lo.
+    """
+    end = len(doc_ids)
+    step = 1
+    hi = lo
+    while hi < end and doc_ids[hi] < doc_id:
+        lo = hi + 1
+        hi += step
+        step *= 2
+    return bisect_left(doc_ids, doc_id, lo, min(hi, end))
+
+
+class PostingsBuilder:
+    """Accumulates postings for documents added in ascending dense-id order"""
+
+    def __init__(self, positions: bool = False) -> None:
+        self.terms: dict[str, tuple[array, array]] = {}
+        self.positions: Optional[dict[str, list[array]]] = {} if positions else None
+
+    def add(self, doc_id: int, tokens: list[str]) -> None:
+        term_positions: dict[str, array] = {}
+        for position, token in enumerate(tokens):
+            positions = term_positions.get(token)
+            if positions is None:
+                positions = array("i")
+                term_positions[token] = positions
+            positions.append(position)
+
+        for term, positions in term_positions.items():
+            postings = self.terms.get(term)
+            if postings is None:
+                postings = (array("i"), array("i"))
+                self.terms[term] = postings
+            postings[0].append(doc_id)
+            postings[1].append(len(positions))
+            if self.positions is not None:
+                self.positions.setdefault(term, []).append(positions)
+
+    def extend(
+        self,
+        terms: dict[str, tuple[array, array]],
+        doc_offset: int,
+        positions: Optional[dict[str, list[array]]] = None,
+    ) -> None:
+        """Append postings built over a later, contiguous range of doc ids"""
+        for term, (doc_ids, tfs) in terms.items():
+            postings = self.terms.get(term)
+            if postings is None:
+                postings = (array("i"), array("i"))
+                self.terms[term] = postings
+            postings[0].extend(doc_id + doc_offset for doc_id in doc_ids)
+            postings[1].extend(tfs)
+            if self.positions is not None and positions is not None:
+                self.positions.setdefault(term, []).extend(positions[term])
+
+    def finish(self) -> "CompactPostings":
+        encoded = {}
+        encoded_positions = None if self.positions is None else {}
+        for term in sorted(self.terms):
+            doc_ids, tfs = self.terms[term]
+            encoded[term] = encode_postings(doc_ids, tfs)
+            if encoded_positions is not None:
+                encoded_positions[term] = encode_positions(self.positions[term])
+        self.terms = {}
+        if self.positions is not None:
+            self.positions = {}
+        return CompactPostings(encoded, encoded_positions)
+
+
+class CompactPostings:
+    """Term -> (sorted dense doc ids, aligned term frequencies)
+
+    Postings are kept varint-compressed and only decoded into int32 arrays
+    when a term is looked up; recently used terms stay decoded in an LRU.
+    Positional indexes also keep each posting's token positions.
+    """
+
+    def __init__(
+        self,
+        encoded: Optional[dict[str, bytes]] = None,
+        encoded_positions: Optional[dict[str, bytes]] = None,
+        cache_size: int = POSTINGS_CACHE_SIZE,
+    ) -> None:
+        self.encoded: dict[str, bytes] = encoded if encoded is not None else {}
+        self.encoded_positions = encoded_positions
+        self._decode = lru_cache(maxsize=cache_size)(self.__decode)
+        self._decode_positions = lru_cache(maxsize=cache_size)(
+            self.__decode_positions
+        )
+
+    @property
+    def has_positions(self) -> bool:
+        return self.encoded_positions is not None
+
+    def __contains__(self, term: object) -> bool:
+        return term in self.encoded
+
+    def __len__(self) -> int:
+        return len(self.encoded)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.encoded)
+
+    def get(self, term: str) -> Optional[tuple[array, array]]:
+        if term not in self.encoded:
+            return None
+        return self._decode(term)
+
+    def positions(self, term: str) -> Optional[list[array]]:
+        """Token positions of every posting of term, aligned with get(term)"""
+        if self.encoded_positions is None or term not in self.encoded:
+            return None
+        return self._decode_positions(term)
+
+    def raw(self, term: str) -> bytes:
+        return self.encoded[term]
+
+    def raw_positions(self, term: str) -> bytes:
+        if self.encoded_positions is None:
+            raise KeyError(term)
+        return self.encoded_positions[term]
+
+    def doc_freq(self, term: str) -> int:
+        data = self.encoded.get(term)
+        if data is None:
+            return 0
+        return postings_doc_freq(data)
+
+    def __decode(self, term: str) -> tuple[array, array]:
+        return decode_postings(self.encoded[term])
+
+    def __decode_positions(self, term: str) -> list[array]:
+        _, tfs = self._decode(term)
+        return decode_positions(self.encoded_positions[term], tfs)
@@ -0,0 +1,207 @@
+import json
+import os
+from typing import Optional
+
+import numpy as np
+
+from .search_utils import (
+    EMBEDDING_DTYPE,
+    PQ_CENTROIDS,
+    PQ_KMEANS_ITERATIONS,
+    PQ_SUBVECTORS,
+    PQ_TRAIN_SAMPLE,
+    QUANTIZED_SCORE_BATCH_SIZE,
+)
+
+QUANTIZATION_METHODS = ("float16", "int8", "pq")
+
+
+class QuantizedEmbeddings:
+    """Compressed copy of a normalized embedding matrix for first-pass scoring
+
+    float16 halves the matrix, int8 stores each dimension as a byte between
+    its min and max (4x smaller), and product quantization stores one byte
+    per sub-vector as the id of its nearest codebook centroid (dim/8 bytes
+    per row with the default settings, 32x smaller for 384 dimensions).
+    Scores are approximate; callers rescore a shortlist against the floats.
+    """
+
+    def __init__(self, method: str, codes: np.ndarray, params: dict) -> None:
+        if method not in QUANTIZATION_METHODS:
+            raise ValueError(f"unknown quantization method: {method}")
+        self.method = method
+        self.codes = codes
+        self.params = params
+
+    @property
+    def row_count(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + sum(p.nbytes for p in self.params.values())
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, method: str) -> "QuantizedEmbeddings":
+        match method:
+            case "float16":
+                return cls(method, _build_float16(embeddings), {})
+            case "int8":
+                return cls(method, *_build_int8(embeddings))
+            case "pq":
+                return cls(method, *_build_pq(embeddings))
+            case _:
+                raise ValueError(f"unknown quantization method: {method}")
+
+    def save(self, directory: str, generation: Optional[str] = None) -> None:
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "codes.npy"), self.codes)
+        for name, value in self.params.items():
+            np.save(os.path.join(directory, f"{name}.npy"), value)
+        with open(os.path.join(directory, "quantization.json"), "w") as f:
+            json.dump(
+                {
+                    "method": self.method,
+                    "row_count": self.row_count,
+                    "params": sorted(self.params),
+                    "generation": generation,
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, directory: str) -> "QuantizedEmbeddings":
+        with open(os.path.join(directory, "quantization.json"), "r") as f:
+            meta = json.load(f)
+        params = {}
+        for name in meta["params"]:
+            params[name] = np.load(os.path.join(directory, f"{name}.npy"))
+        codes = np.load(os.path.join(directory, "codes.npy"), mmap_mode="r")
+        return cls(meta["method"], codes, params)
+
+    def scores(
+        self, query: np.ndarray, rows: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """Approximate similarity of a normalized query to every (or some) row"""
+        query = np.asarray(query, dtype=EMBEDDING_DTYPE)
+        n_rows = self.row_count if rows is None else len(rows)
+        out = np.empty(n_rows, dtype=EMBEDDING_DTYPE)
+        if self.method == "int8":
+            weights = self.params["scale"] * query
+            bias = float(self.params["offset"] @ query)
+        elif self.method == "pq":
+            codebooks = self.params["codebooks"]
+            n_sub, _, sub_dim = codebooks.shape
+            lookup = np.einsum("mkd,md->mk", codebooks, query.reshape(n_sub, sub_dim))
+            subspaces = np.arange(n_sub)
+
+        for start in range(0, n_rows, QUANTIZED_SCORE_BATCH_SIZE):
+            end = min(start + QUANTIZED_SCORE_BATCH_SIZE, n_rows)
+            if rows is None:
+                codes = self.codes[start:end]
+            else:
+                codes = self.codes[rows[start:end]]
+            if self.method == "float16":
+                out[start:end] = codes.astype(EMBEDDING_DTYPE) @ query
+            elif self.method == "int8":
+                out[start:end] = codes.astype(EMBEDDING_DTYPE) @ weights + bias
+            else:
+                out[start:end] = lookup[subspaces, codes].sum(axis=1)
+        return out
+
+
+def _batches(embeddings: np.ndarray):
+    for start in range(0, len(embeddings), QUANTIZED_SCORE_BATCH_SIZE):
+        yield start, embeddings[start : start + QUANTIZED_SCORE_BATCH_SIZE]
+
+
+def _build_float16(embeddings: np.ndarray) -> np.ndarray:
+    codes = np.empty(embeddings.shape, dtype=np.float16)
+    for start, batch in _batches(embeddings):
+        codes[start : start + len(batch)] = batch
+    return codes
+
+
+def _build_int8(embeddings: np.ndarray) -> tuple[np.ndarray, dict]:
+    offset = np.full(embeddings.shape[1], np.inf, dtype=EMBEDDING_DTYPE)
+    high = np.full(embeddings.shape[1], -np.inf, dtype=EMBEDDING_DTYPE)
+    for _, batch in _batches(embeddings):
+        np.minimum(offset, batch.min(axis=0), out=offset)
+        np.maximum(high, batch.max(axis=0), out=high)
+    scale = (high - offset) / 255
+    scale[scale == 0] = 1
+    scale = scale.astype(EMBEDDING_DTYPE)
+    codes = np.empty(embeddings.shape, dtype=np.uint8)
+    for start, batch in _batches(embeddings):
+        codes[start : start + len(batch)] = np.rint((batch - offset) / scale)
+    return codes, {"offset": offset, "scale": scale}
+
+
+def _build_pq(embeddings: np.ndarray, seed: int = 0) -> tuple[np.ndarray, dict]:
+    n_rows, dim = embeddings.shape
+    n_sub = max(d for d in range(1, PQ_SUBVECTORS + 1) if dim % d == 0)
+    sub_dim = dim // n_sub
+    n_centroids = min(PQ_CENTROIDS, n_rows)
+    rng = np.random.default_rng(seed)
+
+    sample = embeddings
+    if n_rows > PQ_TRAIN_SAMPLE:
+        sample = embeddings[np.sort(rng.choice(n_rows, PQ_TRAIN_SAMPLE, False))]
+    sample = np.asarray(sample, dtype=EMBEDDING_DTYPE)
+
+    codebooks = np.empty((n_sub, n_centroids, sub_dim), dtype=EMBEDDING_DTYPE)
+    for m in range(n_sub):
+        part = sample[:, m * sub_dim : (m + 1) * sub_dim]
+        codebooks[m] = _kmeans(part, n_centroids, PQ_KMEANS_ITERATIONS, rng)
+
+    codes = np.empty((n_rows, n_sub), dtype=np.uint8)
+    for start, batch in _batches(embeddings):
+        batch = np.asarray(batch, dtype=EMBEDDING_DTYPE)
+        for m in range(n_sub):
+            part = batch[:, m * sub_dim : (m + 1) * sub_dim]
+            codes[start : start + len(batch), m] = _nearest(part, codebooks[m])
+    return codes, {"codebooks": codebooks}
+
+
+def _nearest(points: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # argmin ||p - c||^2 == argmax (2 p.c - ||c||^2)
+    return np.argmax(2 * points @ centroids.T - (centroids**2).sum(axis=1), axis=1)
+
+
+def _kmeans(
+    points: np.ndarray, k: int, iterations: int, rng: np.random.Generator
+) -> np.ndarray:
+    centroids = points[rng.choice(len(points), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _nearest(points, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, points)
+        counts = np.bincount(assignments, minlength=k)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        if not filled.all():
+            centroids[~filled] = points[rng.choice(len(points), int((~filled).sum()))]
+    return centroids
+
+
+def load_or_build_quantized(
+    directory: str, embeddings: np.ndarray, method: str, generation: Optional[str]
+) -> QuantizedEmbeddings:
+    """Open the codes saved next to the embeddings, rebuilding them if stale
+
+    Codes are only reused if they were built with the same method from the
+    same `generation` of the embedding store.
+    """
+    meta_path = os.path.join(directory, "quantization.json")
+    if generation is not None and os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        if (
+            meta["method"] == method
+            and meta.get("generation") == generation
+            and meta["row_count"] == len(embeddings)
+        ):
+            return QuantizedEmbeddings.load(directory)
+    quantized = QuantizedEmbeddings.build(embeddings, method)
+    quantized.save(directory, generation)
+    return quantized
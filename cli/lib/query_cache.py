@@ -0,0 +1,155 @@
+import dbm
+import os
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import numpy as np
+
+from .search_utils import (
+    EMBEDDING_DTYPE,
+    QUERY_EMBEDDING_CACHE_PATH,
+    QUERY_EMBEDDING_CACHE_SIZE,
+    QUERY_EMBEDDING_DISK_CACHE,
+)
+
+# Disk entries start with the vector's dimension.
+DIM_DTYPE = np.dtype("<u4")
+
+
+def normalize_query_text(text: str) -> str:
+    return unicodedata.normalize("NFC", " ".join(text.split()))
+
+
+class QueryEmbeddingCache:
+    """LRU of query embeddings keyed by model name and normalized query text
+
+    With a path, entries also go to a dbm file so repeats are served across
+    processes and CLI runs. Cached arrays are read-only and shared between
+    callers. Callers that know the dimension their vectors must have pass
+    `dim`, and entries of any other size (truncated, or written by another
+    model under the same name) are treated as misses.
+    """
+
+    def __init__(
+        self, capacity: int = QUERY_EMBEDDING_CACHE_SIZE, path: Optional[str] = None
+    ) -> None:
+        self.capacity = capacity
+        self.path = path
+        self.entries: OrderedDict[tuple[str, str], np.ndarray] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self, model_name: str, text: str, dim: Optional[int] = None
+    ) -> Optional[np.ndarray]:
+        key = (model_name, normalize_query_text(text))
+        embedding = self.entries.get(key)
+        if embedding is not None and (dim is None or len(embedding) == dim):
+            self.entries.move_to_end(key)
+            return embedding
+        embedding = self._read_disk(key, dim)
+        if embedding is not None:
+            self._remember(key, embedding)
+        return embedding
+
+    def put(self, model_name: str, text: str, embedding: np.ndarray) -> np.ndarray:
+        key = (model_name, normalize_query_text(text))
+        embedding = np.array(embedding, dtype=EMBEDDING_DTYPE)
+        embedding.setflags(write=False)
+        self._remember(key, embedding)
+        self._write_disk(key, embedding)
+        return embedding
+
+    def get_or_compute(
+        self,
+        model_name: str,
+        text: str,
+        encode: Callable[[str], np.ndarray],
+        dim: Optional[int] = None,
+    ) -> np.ndarray:
+        """Cached embedding, or `encode(normalized text)` stored for next time"""
+        embedding = self.get(model_name, text, dim)
+        if embedding is not None:
+            self.hits += 1
+            return embedding
+        self.misses += 1
+        return self.put(model_name, text, encode(normalize_query_text(text)))
+
+    def get_or_compute_many(
+        self,
+        model_name: str,
+        texts: list[str],
+        encode: Callable[[list[str]], np.ndarray],
+        dim: Optional[int] = None,
+    ) -> np.ndarray:
+        """Embeddings for several texts, encoding every miss in one call"""
+        embeddings = [self.get(model_name, text, dim) for text in texts]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            # Repeats within the batch are encoded once.
+            unique = list(
+                dict.fromkeys(normalize_query_text(texts[i]) for i in missing)
+            )
+            fresh = {}
+            for text, embedding in zip(unique, encode(unique)):
+                fresh[text] = self.put(model_name, text, embedding)
+            for i in missing:
+                embeddings[i] = fresh[normalize_query_text(texts[i])]
+        return np.stack(embeddings)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def _remember(self, key: tuple[str, str], embedding: np.ndarray) -> None:
+        self.entries[key] = embedding
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def _disk_key(self, key: tuple[str, str]) -> bytes:
+        return "\0".join(key).encode("utf-8")
+
+    def _read_disk(
+        self, key: tuple[str, str], dim: Optional[int] = None
+    ) -> Optional[np.ndarray]:
+        if self.path is None:
+            return None
+        try:
+            with dbm.open(self.path, "r") as db:
+                data = db.get(self._disk_key(key))
+        except dbm.error:
+            # Missing or locked by another process; treat as a miss.
+            return None
+        if data is None or len(data) < DIM_DTYPE.itemsize:
+            return None
+        stored_dim = int(np.frombuffer(data, dtype=DIM_DTYPE, count=1)[0])
+        size = DIM_DTYPE.itemsize + stored_dim * np.dtype(EMBEDDING_DTYPE).itemsize
+        if len(data) != size or (dim is not None and stored_dim != dim):
+            return None
+        return np.frombuffer(data, dtype=EMBEDDING_DTYPE, offset=DIM_DTYPE.itemsize)
+
+    def _write_disk(self, key: tuple[str, str], embedding: np.ndarray) -> None:
+        if self.path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with dbm.open(self.path, "c") as db:
+                header = np.array(len(embedding), dtype=DIM_DTYPE).tobytes()
+                db[self._disk_key(key)] = header + embedding.tobytes()
+        except dbm.error:
+            pass
+
+
+_query_cache: Optional[QueryEmbeddingCache] = None
+
+
+def get_query_cache() -> QueryEmbeddingCache:
+    """Process-wide query embedding cache shared by every search instance"""
+    global _query_cache
+    if _query_cache is None:
+        path = QUERY_EMBEDDING_CACHE_PATH if QUERY_EMBEDDING_DISK_CACHE else None
+        _query_cache = QueryEmbeddingCache(path=path)
+    return _query_cache
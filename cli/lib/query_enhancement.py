@@ -4,6 +4,8 @@ from typing import Optional
 from dotenv import load_dotenv
 from google import genai
 
+from .spell_correction import get_spell_corrector
+
 load_dotenv()
 api_key = os.getenv("gemini_api_key")
 client = genai.Client(api_key=api_key)
@@ -71,10 +73,26 @@ Query: "{query}"
     return corrected if corrected else query
 
 
-def enhance_query(query: str, method: Optional[str] = None) -> str:
+def fuzzy_correct(query: str, llm_fallback: bool = False) -> str:
+    """Correct typos against the index vocabulary without a network call
+
+    Only when a word has no dictionary match within the edit-distance bound,
+    and llm_fallback is set, is the locally corrected query sent to the LLM.
+    """
+    corrected, unresolved = get_spell_corrector().correct_query(query)
+    if unresolved and llm_fallback:
+        return spell_correct(corrected)
+    return corrected
+
+
+def enhance_query(
+    query: str, method: Optional[str] = None, llm_fallback: bool = False
+) -> str:
     match method:
         case "spell":
             return spell_correct(query)
+        case "fuzzy":
+            return fuzzy_correct(query, llm_fallback)
         case "rewrite":
             return query_rewrite(query)
         case "expand":
@@ -5,7 +5,8 @@ from time import sleep
 from dotenv import load_dotenv
 from google import genai
 
-from sentence_transformers import CrossEncoder
+from .model_registry import CROSS_ENCODER, get_model
+from .search_utils import CROSS_ENCODER_MODEL
 
 load_dotenv()
 api_key = os.getenv("GEMINI_API_KEY")
@@ -83,7 +84,7 @@ Return ONLY the IDs in order of relevance (best match first). Return a valid JSO
     return reranked[:limit]
 
 def llm_rereank_cross_encoder(query: str, documents: list[dict], limit: int = 5) -> list[dict]:
-    ce = CrossEncoder("cross-encoder/ms-marco-TinyBERT-L2-v2")
+    ce = get_model(CROSS_ENCODER, CROSS_ENCODER_MODEL)
 
     pairs = []
     for doc in documents:
@@ -3,6 +3,7 @@ import os
 from typing import Any
 
 SEARCH_MULTIPLIER = 5
+HYBRID_DEPTH_MULTIPLIER = 500
 
 DEFAULT_ALPHA = 0.5
 RRF_K = 60
@@ -25,10 +26,58 @@ CACHE_DIR = os.path.join(PROJECT_ROOT, "cache")
 DEFAULT_CHUNK_SIZE = 200
 DEFAULT_CHUNK_OVERLAP = 1
 DEFAULT_SEMANTIC_CHUNK_SIZE = 4
-
-MOVIE_EMBEDDINGS_PATH = os.path.join(CACHE_DIR, "movie_embeddings.npy")
-CHUNK_EMBEDDINGS_PATH = os.path.join(CACHE_DIR, "chunk_embeddings.npy")
-CHUNK_METADATA_PATH = os.path.join(CACHE_DIR, "chunk_metadata.json")
+DEFAULT_CHUNKING = "semantic"
+DEFAULT_CHUNK_DEDUP = "exact"
+DEFAULT_CHUNK_AGGREGATION = "max"
+CHUNK_AGGREGATION_TOP_N = 3
+
+MOVIE_EMBEDDINGS_DIR = os.path.join(CACHE_DIR, "movie_embeddings")
+CHUNK_EMBEDDINGS_DIR = os.path.join(CACHE_DIR, "chunk_embeddings")
+MOVIE_EMBEDDINGS_WORK_DIR = f"{MOVIE_EMBEDDINGS_DIR}.work"
+CHUNK_EMBEDDINGS_WORK_DIR = f"{CHUNK_EMBEDDINGS_DIR}.work"
+DOCUMENT_STORE_PATH = os.path.join(CACHE_DIR, "documents.bin")
+EMBEDDING_DTYPE = "float32"
+EMBEDDING_SHARD_ROWS = 65_536
+SEMANTIC_QUERY_BATCH_SIZE = 64
+EMBED_BATCH_SIZE = 64
+EMBED_TASKS_PER_WORKER = 2
+EMBED_CHECKPOINT_ROWS = 8192
+MOVIE_ANN_DIR = os.path.join(CACHE_DIR, "movie_embeddings.ivf")
+CHUNK_ANN_DIR = os.path.join(CACHE_DIR, "chunk_embeddings.ivf")
+IVF_NPROBE = 8
+IVF_KMEANS_ITERATIONS = 20
+IVF_TRAIN_SAMPLE = 50_000
+IVF_ASSIGN_BATCH_SIZE = 8192
+MOVIE_QUANTIZED_DIR = os.path.join(CACHE_DIR, "movie_embeddings.quantized")
+CHUNK_QUANTIZED_DIR = os.path.join(CACHE_DIR, "chunk_embeddings.quantized")
+QUANTIZED_RESCORE_FACTOR = 10
+QUANTIZED_SCORE_BATCH_SIZE = 16384
+PQ_SUBVECTORS = 48
+PQ_CENTROIDS = 256
+PQ_KMEANS_ITERATIONS = 15
+PQ_TRAIN_SAMPLE = 20_000
+
+STEM_CACHE_SIZE = 50_000
+BUILD_SHARDS_PER_WORKER = 4
+MAX_INDEX_SEGMENTS = 8
+SPARSE_QUERY_BATCH_SIZE = 64
+STEM_CACHE_PATH = os.path.join(CACHE_DIR, "stem_cache.json")
+
+# Parameter bytes kept loaded across models before the least recently used
+# are dropped; None keeps every model.
+MODEL_REGISTRY_MAX_BYTES = None
+CROSS_ENCODER_MODEL = "cross-encoder/ms-marco-TinyBERT-L2-v2"
+
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+QUERY_EMBEDDING_DISK_CACHE = True
+QUERY_EMBEDDING_CACHE_PATH = os.path.join(CACHE_DIR, "query_embeddings.db")
+
+METADATA_INDEX_DIR = os.path.join(CACHE_DIR, "metadata_index")
+METADATA_FILTER_CACHE_SIZE = 256
+
+SPELL_MAX_EDIT_DISTANCE = 2
+SPELL_PREFIX_LENGTH = 7
+SPELL_DICTIONARY_PATH = os.path.join(CACHE_DIR, "spell_dictionary.json")
 
 
 def load_movies() -> list[dict]:
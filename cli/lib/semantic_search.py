@@ -1,63 +1,280 @@
-import json
-import os
 import re
+import shutil
+from array import array
+
+from typing import Callable, Iterable, Iterator, Optional
 
 import numpy as np
-from sentence_transformers import SentenceTransformer
 
+from .ann_index import IVFIndex, load_or_build_ivf
+from .chunk_metadata import AGGREGATION_MODES, ChunkMetadata, chunk_metadata_from
+from .document_store import DocumentStore, document_map, load_documents
+from .embedding_pipeline import encode_stream
+from .embedding_store import (
+    ShardedEmbeddings,
+    corpus_digest,
+    load_embedding_shards,
+    text_hash,
+    write_embedding_shards,
+)
+from .metadata_filter import metadata_index_for
+from .model_registry import SENTENCE_TRANSFORMER, get_model, get_model_registry
+from .quantization import QuantizedEmbeddings, load_or_build_quantized
+from .query_cache import get_query_cache
 from .search_utils import (
-    CHUNK_EMBEDDINGS_PATH,
-    CHUNK_METADATA_PATH,
+    CHUNK_AGGREGATION_TOP_N,
+    CHUNK_ANN_DIR,
+    CHUNK_EMBEDDINGS_DIR,
+    CHUNK_EMBEDDINGS_WORK_DIR,
+    CHUNK_QUANTIZED_DIR,
+    DEFAULT_CHUNK_DEDUP,
+    DEFAULT_CHUNKING,
+    DEFAULT_CHUNK_AGGREGATION,
     DEFAULT_CHUNK_OVERLAP,
     DEFAULT_CHUNK_SIZE,
     DEFAULT_SEARCH_LIMIT,
     DEFAULT_SEMANTIC_CHUNK_SIZE,
     DOCUMENT_PREVIEW_LENGTH,
-    MOVIE_EMBEDDINGS_PATH,
+    IVF_NPROBE,
+    MOVIE_ANN_DIR,
+    MOVIE_EMBEDDINGS_DIR,
+    MOVIE_EMBEDDINGS_WORK_DIR,
+    MOVIE_QUANTIZED_DIR,
+    QUANTIZED_RESCORE_FACTOR,
+    SEMANTIC_QUERY_BATCH_SIZE,
     format_search_result,
-    load_movies,
+)
+from .sparse_bm25 import top_k_indices
+from .vector_search import (
+    candidate_scores,
+    normalize_embeddings,
+    score_matrix,
+    search_rows,
+    search_rows_batch,
 )
 
 
 class SemanticSearch:
-    def __init__(self, model_name="all-MiniLM-L6-v2"):
-        self.model = SentenceTransformer(model_name)
+    def __init__(
+        self,
+        model_name="all-MiniLM-L6-v2",
+        ann=False,
+        nprobe=IVF_NPROBE,
+        quantization=None,
+        rescore=True,
+        workers=1,
+    ):
+        # The model is loaded from the shared registry on first use, so
+        # cached embeddings and query vectors never pay for it. Corpus
+        # builds encode with `workers` processes.
+        self.model_name = model_name
+        self.workers = workers
         self.embeddings = None
         self.documents = None
         self.document_map = {}
+        # Saved embeddings are memory-mapped shards. With ann=True an IVF
+        # index is kept next to them and only the `nprobe` nearest buckets
+        # are scored per query. With a quantization method, queries first
+        # score compressed codes and only a shortlist of float rows is read.
+        self.use_ann = ann
+        self.nprobe = nprobe
+        self.quantization = quantization
+        self.rescore = rescore
+        self.ann_index = None
+        self.quantized = None
+        self.metadata_index = None
+
+    @property
+    def model(self):
+        return get_model(SENTENCE_TRANSFORMER, self.model_name)
+
+    def warmup(self) -> None:
+        """Load the embedding model now instead of on the first query"""
+        get_model_registry().warmup(SENTENCE_TRANSFORMER, self.model_name)
 
     def generate_embedding(self, text):
         if not text or not text.strip():
             raise ValueError("cannot generate embedding for empty text")
-        return self.model.encode([text])[0]
+        return get_query_cache().get_or_compute(
+            self.model_name,
+            text,
+            lambda t: self.model.encode([t])[0],
+            self._query_dim(),
+        )
+
+    def generate_embeddings(self, texts: list[str]) -> np.ndarray:
+        """Query embeddings for several texts with a single encode call"""
+        for text in texts:
+            if not text or not text.strip():
+                raise ValueError("cannot generate embedding for empty text")
+        return get_query_cache().get_or_compute_many(
+            self.model_name,
+            texts,
+            lambda missing: self.model.encode(missing),
+            self._query_dim(),
+        )
+
+    def _query_dim(self) -> Optional[int]:
+        # Cached query vectors must match the loaded corpus embeddings.
+        return None if self.embeddings is None else self.embeddings.shape[1]
 
     def build_embeddings(self, documents):
         self.documents = documents
-        self.document_map = {}
-        movie_strings = []
-        for doc in documents:
-            self.document_map[doc["id"]] = doc
-            movie_strings.append(f"{doc['title']}: {doc['description']}")
-        self.embeddings = self.model.encode(movie_strings, show_progress_bar=True)
-
-        os.makedirs(os.path.dirname(MOVIE_EMBEDDINGS_PATH), exist_ok=True)
-        np.save(MOVIE_EMBEDDINGS_PATH, self.embeddings)
+        self.document_map = document_map(documents)
+        digest = self._source_digest(movie_texts(documents))
+        parts, hashes = self._embed_stream(
+            movie_texts(documents),
+            MOVIE_EMBEDDINGS_DIR,
+            MOVIE_EMBEDDINGS_WORK_DIR,
+            digest,
+        )
+
+        write_embedding_shards(
+            MOVIE_EMBEDDINGS_DIR,
+            parts,
+            hashes,
+            digest,
+            source_fingerprint=self._source_fingerprint(documents),
+        )
+        shutil.rmtree(MOVIE_EMBEDDINGS_WORK_DIR, ignore_errors=True)
+        self.embeddings = load_embedding_shards(MOVIE_EMBEDDINGS_DIR)
+        self.ann_index, self.quantized = self._prepare_indexes(
+            MOVIE_ANN_DIR, MOVIE_QUANTIZED_DIR, self.embeddings, True
+        )
         return self.embeddings
 
     def load_or_create_embeddings(self, documents):
         self.documents = documents
-        self.document_map = {}
-        for doc in documents:
-            self.document_map[doc["id"]] = doc
+        self.document_map = document_map(documents)
 
-        if os.path.exists(MOVIE_EMBEDDINGS_PATH):
-            self.embeddings = np.load(MOVIE_EMBEDDINGS_PATH)
-            if len(self.embeddings) == len(documents):
-                return self.embeddings
+        embeddings = load_embedding_shards(MOVIE_EMBEDDINGS_DIR)
+        if self._is_current(
+            embeddings,
+            self._source_fingerprint(documents),
+            lambda: movie_texts(documents),
+        ):
+            self.embeddings = embeddings
+            self.ann_index, self.quantized = self._prepare_indexes(
+                MOVIE_ANN_DIR, MOVIE_QUANTIZED_DIR, self.embeddings
+            )
+            return self.embeddings
 
         return self.build_embeddings(documents)
 
-    def search(self, query, limit=DEFAULT_SEARCH_LIMIT):
+    def _source_digest(self, texts: Iterable[str]) -> str:
+        return corpus_digest(text_hash(self.model_name, text) for text in texts)
+
+    def _source_fingerprint(self, documents, settings: str = "") -> Optional[str]:
+        # A document store identifies its file cheaply; lists have none.
+        if not isinstance(documents, DocumentStore):
+            return None
+        return f"{documents.fingerprint}:{self.model_name}:{settings}"
+
+    def _is_current(
+        self,
+        embeddings: Optional[ShardedEmbeddings],
+        fingerprint: Optional[str],
+        source_texts: Callable[[], Iterable[str]],
+    ) -> bool:
+        """Whether saved embeddings were built from the current documents
+
+        A document store is matched by fingerprint without reading a single
+        document; on a mismatch the incremental build still reuses every
+        unchanged vector. Plain document lists are compared by digest.
+        """
+        if embeddings is None:
+            return False
+        if fingerprint is not None:
+            return embeddings.source_fingerprint == fingerprint
+        return embeddings.source_digest == self._source_digest(source_texts())
+
+    def _embed_stream(
+        self, texts: Iterable[str], directory: str, work_dir: str, digest: str
+    ) -> tuple[ShardedEmbeddings, np.ndarray]:
+        # Texts whose content is unchanged keep the vectors saved in
+        # `directory`, and progress is checkpointed under `digest` so an
+        # interrupted build resumes.
+        return encode_stream(
+            texts,
+            self.model_name,
+            work_dir,
+            digest,
+            load_embedding_shards(directory),
+            self.workers,
+        )
+
+    def _prepare_indexes(
+        self,
+        ann_dir: str,
+        quantized_dir: str,
+        embeddings: ShardedEmbeddings,
+        rebuild: bool = False,
+    ) -> tuple[Optional[IVFIndex], Optional[QuantizedEmbeddings]]:
+        ann_index, quantized = None, None
+        generation = embeddings.generation
+        if self.use_ann:
+            if rebuild:
+                ann_index = IVFIndex.build(embeddings)
+                ann_index.save(ann_dir, generation)
+            else:
+                ann_index = load_or_build_ivf(ann_dir, embeddings, generation)
+        if self.quantization is not None:
+            if rebuild:
+                quantized = QuantizedEmbeddings.build(embeddings, self.quantization)
+                quantized.save(quantized_dir, generation)
+            else:
+                quantized = load_or_build_quantized(
+                    quantized_dir, embeddings, self.quantization, generation
+                )
+        return ann_index, quantized
+
+    def search(self, query, limit=DEFAULT_SEARCH_LIMIT, filter_expr=None):
+        self._require_embeddings()
+        query_embedding = self.generate_embedding(query)
+        top, scores = search_rows(
+            self.embeddings,
+            query_embedding,
+            limit,
+            self.ann_index,
+            self.nprobe,
+            self.quantized,
+            self.rescore,
+            self._filter_mask(filter_expr),
+        )
+        return self._format_rows(top, scores)
+
+    def search_batch(
+        self,
+        queries: list[str],
+        limit: int = DEFAULT_SEARCH_LIMIT,
+        filter_expr: Optional[str] = None,
+    ) -> list[list[dict]]:
+        """Results of `search` for every query, encoded and scored together"""
+        self._require_embeddings()
+        if not queries:
+            return []
+        batch = search_rows_batch(
+            self.embeddings,
+            self.generate_embeddings(queries),
+            limit,
+            self.ann_index,
+            self.nprobe,
+            self.quantized,
+            self.rescore,
+            self._filter_mask(filter_expr),
+        )
+        return [self._format_rows(top, scores) for top, scores in batch]
+
+    def _filter_mask(self, filter_expr: Optional[str]) -> Optional[np.ndarray]:
+        """Mask of the loaded documents matching a metadata filter, if any"""
+        if filter_expr is None:
+            return None
+        index = self.metadata_index
+        if index is None or index.documents is not self.documents:
+            self.metadata_index = metadata_index_for(self.documents)
+        return self.metadata_index.mask(filter_expr)
+
+    def _require_embeddings(self) -> None:
         if self.embeddings is None or self.embeddings.size == 0:
             raise ValueError(
                 "No embeddings loaded. Call `load_or_create_embeddings` first."
@@ -68,17 +285,10 @@ class SemanticSearch:
                 "No documents loaded. Call `load_or_create_embeddings` first."
             )
 
-        query_embedding = self.generate_embedding(query)
-
-        similarities = []
-        for i, doc_embedding in enumerate(self.embeddings):
-            similarity = cosine_similarity(query_embedding, doc_embedding)
-            similarities.append((similarity, self.documents[i]))
-
-        similarities.sort(key=lambda x: x[0], reverse=True)
-
+    def _format_rows(self, top: np.ndarray, scores: np.ndarray) -> list[dict]:
         results = []
-        for score, doc in similarities[:limit]:
+        for i, score in zip(top.tolist(), scores.tolist()):
+            doc = self.documents[i]
             results.append(
                 {
                     "score": score,
@@ -90,6 +300,24 @@ class SemanticSearch:
         return results
 
 
+def movie_texts(documents) -> Iterator[str]:
+    return (f"{doc['title']}: {doc['description']}" for doc in documents)
+
+
+def chunk_settings(
+    method: str = DEFAULT_CHUNKING, dedup: str = DEFAULT_CHUNK_DEDUP
+) -> str:
+    return f"{method}:{CHUNKERS[method][1]}:{DEFAULT_CHUNK_OVERLAP}:{dedup}"
+
+
+def chunk_source_texts(
+    documents, method: str = DEFAULT_CHUNKING, dedup: str = DEFAULT_CHUNK_DEDUP
+) -> Iterator[str]:
+    # Chunk settings are part of the source, so changing them rebuilds.
+    settings = chunk_settings(method, dedup)
+    return (f"{settings}:{doc.get('description', '')}" for doc in documents)
+
+
 def cosine_similarity(vec1, vec2):
     dot_product = np.dot(vec1, vec2)
     norm1 = np.linalg.norm(vec1)
@@ -115,9 +343,9 @@ def embed_text(text):
     print(f"Dimensions: {embedding.shape[0]}")
 
 
-def verify_embeddings():
-    search_instance = SemanticSearch()
-    documents = load_movies()
+def verify_embeddings(workers=1):
+    search_instance = SemanticSearch(workers=workers)
+    documents = load_documents()
     embeddings = search_instance.load_or_create_embeddings(documents)
     print(f"Number of docs:   {len(documents)}")
     print(
@@ -133,12 +361,22 @@ def embed_query_text(query):
     print(f"Shape: {embedding.shape}")
 
 
-def semantic_search(query, limit=DEFAULT_SEARCH_LIMIT):
-    search_instance = SemanticSearch()
-    documents = load_movies()
+def semantic_search(
+    query,
+    limit=DEFAULT_SEARCH_LIMIT,
+    ann=False,
+    nprobe=IVF_NPROBE,
+    quantization=None,
+    rescore=True,
+    filter_expr=None,
+):
+    search_instance = SemanticSearch(
+        ann=ann, nprobe=nprobe, quantization=quantization, rescore=rescore
+    )
+    documents = load_documents()
     search_instance.load_or_create_embeddings(documents)
 
-    results = search_instance.search(query, limit)
+    results = search_instance.search(query, limit, filter_expr)
 
     print(f"Query: {query}")
     print(f"Top {len(results)} results:")
@@ -150,25 +388,84 @@ def semantic_search(query, limit=DEFAULT_SEARCH_LIMIT):
         print()
 
 
-def fixed_size_chunking(
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+
+def iter_fixed_size_chunks(
     text: str,
     chunk_size: int = DEFAULT_CHUNK_SIZE,
     overlap: int = DEFAULT_CHUNK_OVERLAP,
-) -> list[str]:
-    words = text.split()
-    chunks = []
-
-    n_words = len(words)
-    i = 0
-    while i < n_words:
-        chunk_words = words[i : i + chunk_size]
-        if chunks and len(chunk_words) <= overlap:
+) -> Iterator[str]:
+    """Windows of `chunk_size` words, consecutive windows sharing `overlap`"""
+    yield from _windows(text.split(), chunk_size, overlap)
+
+
+def iter_semantic_chunks(
+    text: str,
+    max_chunk_size: int = DEFAULT_SEMANTIC_CHUNK_SIZE,
+    overlap: int = DEFAULT_CHUNK_OVERLAP,
+) -> Iterator[str]:
+    """Windows of up to `max_chunk_size` sentences sharing `overlap` sentences"""
+    text = text.strip()
+    if text:
+        yield from _windows(SENTENCE_BOUNDARY.split(text), max_chunk_size, overlap)
+
+
+def _windows(units: list[str], size: int, overlap: int) -> Iterator[str]:
+    if size - overlap <= 0:
+        raise ValueError("overlap must be smaller than the chunk size")
+    for start in range(0, len(units), size - overlap):
+        window = units[start : start + size]
+        if start and len(window) <= overlap:
             break
+        yield " ".join(unit.strip() for unit in window)
+
+
+# Chunker and default size for each chunking method.
+CHUNKERS: dict[str, tuple[Callable[[str, int, int], Iterator[str]], int]] = {
+    "semantic": (iter_semantic_chunks, DEFAULT_SEMANTIC_CHUNK_SIZE),
+    "fixed": (iter_fixed_size_chunks, DEFAULT_CHUNK_SIZE),
+}
+CHUNKING_METHODS = tuple(CHUNKERS)
+CHUNK_DEDUP_MODES = ("exact", "near")
+NON_WORD = re.compile(r"\W+")
+
+
+def near_duplicate_key(text: str) -> str:
+    """Text with case, punctuation and spacing differences removed"""
+    return NON_WORD.sub(" ", text.casefold()).strip()
+
+
+def iter_chunks(
+    documents: Iterable[dict],
+    method: str = DEFAULT_CHUNKING,
+    chunk_size: Optional[int] = None,
+    overlap: int = DEFAULT_CHUNK_OVERLAP,
+) -> Iterator[tuple[int, int, str]]:
+    """(movie_idx, chunk_idx, text) of every description chunk, lazily
+
+    Documents are chunked one at a time as the consumer pulls, so no
+    corpus-wide list of chunks is ever built. `chunk_size` counts sentences
+    for the "semantic" method and words for "fixed".
+    """
+    if method not in CHUNKERS:
+        raise ValueError(f"unknown chunking method: {method}")
+    chunker, default_size = CHUNKERS[method]
+    size = default_size if chunk_size is None else chunk_size
+    for movie_idx, doc in enumerate(documents):
+        text = doc.get("description", "")
+        if not text.strip():
+            continue
+        for chunk_idx, chunk in enumerate(chunker(text, size, overlap)):
+            yield movie_idx, chunk_idx, chunk
 
-        chunks.append(" ".join(chunk_words))
-        i += chunk_size - overlap
 
-    return chunks
+def fixed_size_chunking(
+    text: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    overlap: int = DEFAULT_CHUNK_OVERLAP,
+) -> list[str]:
+    return list(iter_fixed_size_chunks(text, chunk_size, overlap))
 
 
 def chunk_text(
@@ -187,34 +484,7 @@ def semantic_chunk(
     max_chunk_size: int = DEFAULT_SEMANTIC_CHUNK_SIZE,
     overlap: int = DEFAULT_CHUNK_OVERLAP,
 ) -> list[str]:
-    text = text.strip()
-    if not text:
-        return []
-
-    sentences = re.split(r"(?<=[.!?])\s+", text)
-
-    if len(sentences) == 1 and not text.endswith((".", "!", "?")):
-        sentences = [text]
-
-    chunks = []
-    i = 0
-    n_sentences = len(sentences)
-
-    while i < n_sentences:
-        chunk_sentences = sentences[i : i + max_chunk_size]
-        if chunks and len(chunk_sentences) <= overlap:
-            break
-
-        cleaned_sentences = []
-        for chunk_sentence in chunk_sentences:
-            cleaned_sentences.append(chunk_sentence.strip())
-        if not cleaned_sentences:
-            continue
-        chunk = " ".join(cleaned_sentences)
-        chunks.append(chunk)
-        i += max_chunk_size - overlap
-
-    return chunks
+    return list(iter_semantic_chunks(text, max_chunk_size, overlap))
 
 
 def semantic_chunk_text(
@@ -229,101 +499,220 @@ def semantic_chunk_text(
 
 
 class ChunkedSemanticSearch(SemanticSearch):
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2") -> None:
-        super().__init__(model_name)
+    def __init__(
+        self,
+        model_name: str = "all-MiniLM-L6-v2",
+        ann: bool = False,
+        nprobe: int = IVF_NPROBE,
+        quantization: Optional[str] = None,
+        rescore: bool = True,
+        aggregation: str = DEFAULT_CHUNK_AGGREGATION,
+        top_n: int = CHUNK_AGGREGATION_TOP_N,
+        workers: int = 1,
+        chunking: str = DEFAULT_CHUNKING,
+        dedup: str = DEFAULT_CHUNK_DEDUP,
+    ) -> None:
+        super().__init__(model_name, ann, nprobe, quantization, rescore, workers)
+        if aggregation not in AGGREGATION_MODES:
+            raise ValueError(f"unknown aggregation mode: {aggregation}")
+        if chunking not in CHUNKING_METHODS:
+            raise ValueError(f"unknown chunking method: {chunking}")
+        if dedup not in CHUNK_DEDUP_MODES:
+            raise ValueError(f"unknown chunk dedup mode: {dedup}")
+        self.chunking = chunking
+        # Chunks with identical text ("exact") or text differing only in
+        # case, punctuation and spacing ("near") share one embedding row.
+        self.dedup = dedup
+        # How chunk scores combine into a movie score; see ChunkMetadata.
+        self.aggregation = aggregation
+        self.top_n = top_n
         self.chunk_embeddings = None
         self.chunk_metadata = None
+        self.chunk_ann_index = None
+        self.chunk_quantized = None
+
+    def _query_dim(self) -> Optional[int]:
+        if self.chunk_embeddings is None:
+            return None
+        return self.chunk_embeddings.shape[1]
 
     def build_chunk_embeddings(self, documents: list[dict]) -> np.ndarray:
         self.documents = documents
-
-        self.document_map = {}
-        for doc in documents:
-            self.document_map[doc["id"]] = doc
-
-        all_chunks = []
-        chunk_metadata = []
-
-        for idx, doc in enumerate(documents):
-            text = doc.get("description", "")
-            if not text.strip():
-                continue
-
-            chunks = semantic_chunk(
-                text,
-                max_chunk_size=DEFAULT_SEMANTIC_CHUNK_SIZE,
-                overlap=DEFAULT_CHUNK_OVERLAP,
-            )
-
-            for i, chunk in enumerate(chunks):
-                all_chunks.append(chunk)
-                chunk_metadata.append(
-                    {"movie_idx": idx, "chunk_idx": i, "total_chunks": len(chunks)}
-                )
-
-        self.chunk_embeddings = self.model.encode(all_chunks, show_progress_bar=True)
-        self.chunk_metadata = chunk_metadata
-
-        os.makedirs(os.path.dirname(CHUNK_EMBEDDINGS_PATH), exist_ok=True)
-        np.save(CHUNK_EMBEDDINGS_PATH, self.chunk_embeddings)
-        with open(CHUNK_METADATA_PATH, "w") as f:
-            json.dump(
-                {"chunks": chunk_metadata, "total_chunks": len(all_chunks)}, f, indent=2
-            )
+        self.document_map = document_map(documents)
+
+        movie_idx, chunk_idx, vector_row = array("i"), array("i"), array("i")
+        vector_rows: dict[bytes, int] = {}
+
+        def chunk_texts() -> Iterator[str]:
+            # Metadata is recorded as the encoder pulls each chunk, so only
+            # one piece of chunk text is held at a time. Only the first chunk
+            # with a given text reaches the encoder.
+            for movie, number, text in iter_chunks(documents, self.chunking):
+                key = text if self.dedup == "exact" else near_duplicate_key(text)
+                key_hash = text_hash(self.model_name, key)
+                row = vector_rows.get(key_hash)
+                is_new = row is None
+                if is_new:
+                    row = vector_rows[key_hash] = len(vector_rows)
+                movie_idx.append(movie)
+                chunk_idx.append(number)
+                vector_row.append(row)
+                if is_new:
+                    yield text
+
+        digest = self._source_digest(
+            chunk_source_texts(documents, self.chunking, self.dedup)
+        )
+        parts, hashes = self._embed_stream(
+            chunk_texts(), CHUNK_EMBEDDINGS_DIR, CHUNK_EMBEDDINGS_WORK_DIR, digest
+        )
+        movies = np.frombuffer(movie_idx, dtype=np.int32)
+        chunk_counts = np.bincount(movies, minlength=len(documents))
+        self.chunk_metadata = ChunkMetadata(
+            movies,
+            np.frombuffer(chunk_idx, dtype=np.int32),
+            chunk_counts[movies].astype(np.int32),
+            np.frombuffer(vector_row, dtype=np.int32),
+        )
+
+        write_embedding_shards(
+            CHUNK_EMBEDDINGS_DIR,
+            parts,
+            hashes,
+            digest,
+            self.chunk_metadata.arrays(),
+            source_fingerprint=self._source_fingerprint(
+                documents, chunk_settings(self.chunking, self.dedup)
+            ),
+        )
+        shutil.rmtree(CHUNK_EMBEDDINGS_WORK_DIR, ignore_errors=True)
+        self.chunk_embeddings = load_embedding_shards(CHUNK_EMBEDDINGS_DIR)
+        self.chunk_ann_index, self.chunk_quantized = self._prepare_indexes(
+            CHUNK_ANN_DIR, CHUNK_QUANTIZED_DIR, self.chunk_embeddings, True
+        )
 
         return self.chunk_embeddings
 
     def load_or_create_chunk_embeddings(self, documents: list[dict]) -> np.ndarray:
         self.documents = documents
-        self.document_map = {}
-        for doc in documents:
-            self.document_map[doc["id"]] = doc
-
-        if os.path.exists(CHUNK_EMBEDDINGS_PATH) and os.path.exists(
-            CHUNK_METADATA_PATH
+        self.document_map = document_map(documents)
+
+        embeddings = load_embedding_shards(CHUNK_EMBEDDINGS_DIR)
+        if self._is_current(
+            embeddings,
+            self._source_fingerprint(
+                documents, chunk_settings(self.chunking, self.dedup)
+            ),
+            lambda: chunk_source_texts(documents, self.chunking, self.dedup),
         ):
-            self.chunk_embeddings = np.load(CHUNK_EMBEDDINGS_PATH)
-            with open(CHUNK_METADATA_PATH, "r") as f:
-                data = json.load(f)
-                self.chunk_metadata = data["chunks"]
+            metadata = chunk_metadata_from(embeddings.arrays)
+        else:
+            metadata = None
+        if metadata is not None:
+            self.chunk_embeddings = embeddings
+            self.chunk_metadata = metadata
+            self.chunk_ann_index, self.chunk_quantized = self._prepare_indexes(
+                CHUNK_ANN_DIR, CHUNK_QUANTIZED_DIR, self.chunk_embeddings
+            )
             return self.chunk_embeddings
 
         return self.build_chunk_embeddings(documents)
 
-    def search_chunks(self, query: str, limit: int = 10) -> list[dict]:
+    def search_chunks(
+        self, query: str, limit: int = 10, filter_expr: Optional[str] = None
+    ) -> list[dict]:
+        self._require_chunk_embeddings()
+        if limit <= 0:
+            return []
+        query_embedding = normalize_embeddings(self.generate_embedding(query))
+        allowed = self._chunk_filter(filter_expr)
+        return self._format_movies(self._rank_movies(query_embedding, limit, allowed))
+
+    def search_chunks_batch(
+        self, queries: list[str], limit: int = 10, filter_expr: Optional[str] = None
+    ) -> list[list[dict]]:
+        """Results of `search_chunks` for every query, encoded and scored together
+
+        Without an ANN index or quantized codes, each block of queries is
+        scored against every chunk with one matrix product per shard. A
+        filter then keeps only the chunks of allowed movies.
+        """
+        self._require_chunk_embeddings()
+        if limit <= 0 or not queries:
+            return [[] for _ in queries]
+        query_embeddings = normalize_embeddings(self.generate_embeddings(queries))
+        exact = self.chunk_ann_index is None and self.chunk_quantized is None
+        allowed = self._chunk_filter(filter_expr)
+        chunk_mask = None if allowed is None else allowed[1]
+
+        results = []
+        for start in range(0, len(queries), SEMANTIC_QUERY_BATCH_SIZE):
+            block = query_embeddings[start : start + SEMANTIC_QUERY_BATCH_SIZE]
+            if exact:
+                for scores in score_matrix(self.chunk_embeddings, block):
+                    movie_scores = self._best_movies(None, scores, limit, chunk_mask)
+                    results.append(self._format_movies(movie_scores))
+            else:
+                for query_embedding in block:
+                    movie_scores = self._rank_movies(query_embedding, limit, allowed)
+                    results.append(self._format_movies(movie_scores))
+        return results
+
+    def _chunk_filter(
+        self, filter_expr: Optional[str]
+    ) -> Optional[tuple[np.ndarray, np.ndarray]]:
+        # Embedding rows and chunks that belong to movies passing the filter.
+        movie_mask = self._filter_mask(filter_expr)
+        if movie_mask is None:
+            return None
+        return self.chunk_metadata.allowed_rows(movie_mask)
+
+    def _require_chunk_embeddings(self) -> None:
         if self.chunk_embeddings is None or self.chunk_metadata is None:
             raise ValueError(
                 "No chunk embeddings loaded. Call load_or_create_chunk_embeddings first."
             )
 
-        query_embedding = self.generate_embedding(query)
-
-        chunk_scores = []
-        for i, chunk_embedding in enumerate(self.chunk_embeddings):
-            similarity = cosine_similarity(query_embedding, chunk_embedding)
-            chunk_scores.append(
-                {
-                    "chunk_idx": i,
-                    "movie_idx": self.chunk_metadata[i]["movie_idx"],
-                    "score": similarity,
-                }
+    def _rank_movies(
+        self,
+        query_embedding: np.ndarray,
+        limit: int,
+        allowed: Optional[tuple[np.ndarray, np.ndarray]] = None,
+    ) -> dict[int, float]:
+        row_mask, chunk_mask = (None, None) if allowed is None else allowed
+        rows, scores = candidate_scores(
+            self.chunk_embeddings,
+            query_embedding,
+            limit * QUANTIZED_RESCORE_FACTOR,
+            self.chunk_ann_index,
+            self.nprobe,
+            self.chunk_quantized,
+            self.rescore,
+            row_mask,
+        )
+        movie_scores = self._best_movies(rows, scores, limit, chunk_mask)
+        narrowed = self.chunk_ann_index is not None or (
+            self.chunk_quantized is not None and self.rescore
+        )
+        if narrowed and rows is not None and len(movie_scores) < limit:
+            # The probed buckets or the rescored shortlist held too few
+            # movies, so every chunk is ranked instead.
+            rows, scores = candidate_scores(
+                self.chunk_embeddings,
+                query_embedding,
+                len(self.chunk_embeddings),
+                None,
+                self.nprobe,
+                self.chunk_quantized,
+                self.rescore,
+                row_mask,
             )
+            movie_scores = self._best_movies(rows, scores, limit, chunk_mask)
+        return movie_scores
 
-        movie_scores = {}
-        for chunk_score in chunk_scores:
-            movie_idx = chunk_score["movie_idx"]
-            if (
-                movie_idx not in movie_scores
-                or chunk_score["score"] > movie_scores[movie_idx]
-            ):
-                movie_scores[movie_idx] = chunk_score["score"]
-
-        sorted_movies = sorted(movie_scores.items(), key=lambda x: x[1], reverse=True)
-
+    def _format_movies(self, movie_scores: dict[int, float]) -> list[dict]:
         results = []
-        for movie_idx, score in sorted_movies[:limit]:
-            if movie_idx is None:
-                continue
+        for movie_idx, score in movie_scores.items():
             doc = self.documents[movie_idx]
             results.append(
                 format_search_result(
@@ -336,16 +725,73 @@ class ChunkedSemanticSearch(SemanticSearch):
 
         return results
 
-
-def embed_chunks_command() -> np.ndarray:
-    movies = load_movies()
-    searcher = ChunkedSemanticSearch()
+    def _best_movies(
+        self,
+        rows: Optional[np.ndarray],
+        scores: np.ndarray,
+        limit: int,
+        chunk_mask: Optional[np.ndarray] = None,
+    ) -> dict[int, float]:
+        # Scores belong to embedding rows; every chunk sharing a row gets its
+        # score before chunks are combined per movie. A shared row can also
+        # serve chunks of filtered-out movies, so those chunks are dropped.
+        rows, scores = self.chunk_metadata.expand(rows, scores)
+        if chunk_mask is not None:
+            if rows is None:
+                rows = np.flatnonzero(chunk_mask)
+                scores = scores[rows]
+            else:
+                keep = chunk_mask[rows]
+                rows, scores = rows[keep], scores[keep]
+        movies, movie_scores = self.chunk_metadata.aggregate(
+            scores, rows, self.aggregation, self.top_n
+        )
+        top = top_k_indices(movie_scores, limit)
+        return dict(zip(movies[top].tolist(), movie_scores[top].tolist()))
+
+
+def embed_chunks_command(
+    ann: bool = False,
+    quantization: Optional[str] = None,
+    workers: int = 1,
+    chunking: str = DEFAULT_CHUNKING,
+    dedup: str = DEFAULT_CHUNK_DEDUP,
+) -> np.ndarray:
+    movies = load_documents()
+    searcher = ChunkedSemanticSearch(
+        ann=ann,
+        quantization=quantization,
+        workers=workers,
+        chunking=chunking,
+        dedup=dedup,
+    )
     return searcher.load_or_create_chunk_embeddings(movies)
 
 
-def search_chunked_command(query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> dict:
-    movies = load_movies()
-    searcher = ChunkedSemanticSearch()
+def search_chunked_command(
+    query: str,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    ann: bool = False,
+    nprobe: int = IVF_NPROBE,
+    quantization: Optional[str] = None,
+    rescore: bool = True,
+    aggregation: str = DEFAULT_CHUNK_AGGREGATION,
+    top_n: int = CHUNK_AGGREGATION_TOP_N,
+    chunking: str = DEFAULT_CHUNKING,
+    dedup: str = DEFAULT_CHUNK_DEDUP,
+    filter_expr: Optional[str] = None,
+) -> dict:
+    movies = load_documents()
+    searcher = ChunkedSemanticSearch(
+        ann=ann,
+        nprobe=nprobe,
+        quantization=quantization,
+        rescore=rescore,
+        aggregation=aggregation,
+        top_n=top_n,
+        chunking=chunking,
+        dedup=dedup,
+    )
     searcher.load_or_create_chunk_embeddings(movies)
-    results = searcher.search_chunks(query, limit)
+    results = searcher.search_chunks(query, limit, filter_expr)
     return {"query": query, "results": results}
\ No newline at end of file
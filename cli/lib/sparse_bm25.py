@@ -0,0 +1,165 @@
+import json
+import os
+from collections import Counter
+from typing import Callable, Optional
+
+import numpy as np
+
+from .search_utils import BM25_K1, SPARSE_QUERY_BATCH_SIZE
+
+SPARSE_META_NAME = "sparse.json"
+
+
+class SparseBM25:
+    """BM25-weighted term-document matrix in CSR form (one row per term)
+
+    Each row holds the dense doc ids of a term's postings and their full BM25
+    contribution, so scoring a query is a sparse row-vector times matrix
+    product and a batch of queries is one accumulation over all their rows.
+    Rows follow the sorted term order of the index, so a loaded matrix finds
+    rows through the index's own term dictionary (`term_row` returns -1 for
+    unknown terms).
+    """
+
+    def __init__(
+        self,
+        term_row: Callable[[str], int],
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        data: np.ndarray,
+        doc_count: int,
+    ) -> None:
+        self.term_row = term_row
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.doc_count = doc_count
+
+    @classmethod
+    def from_postings(
+        cls, postings, bm25_idfs, length_norms, doc_count: int
+    ) -> "SparseBM25":
+        terms = sorted(postings)
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        doc_ids, tfs = [], []
+        for row, term in enumerate(terms):
+            term_doc_ids, term_tfs = postings.get(term)
+            doc_ids.append(np.frombuffer(term_doc_ids, dtype=np.int32))
+            tfs.append(np.frombuffer(term_tfs, dtype=np.int32))
+            indptr[row + 1] = indptr[row] + len(term_doc_ids)
+
+        indices = np.concatenate(doc_ids) if doc_ids else np.zeros(0, np.int32)
+        tf = np.concatenate(tfs).astype(np.float64) if tfs else np.zeros(0)
+        idfs = np.array([bm25_idfs[term] for term in terms], dtype=np.float64)
+        norms = np.asarray(length_norms, dtype=np.float64)
+        rows = np.repeat(np.arange(len(terms)), np.diff(indptr))
+        data = (tf * (BM25_K1 + 1)) / (tf + norms[indices]) * idfs[rows]
+        term_rows = {term: row for row, term in enumerate(terms)}
+        return cls(
+            lambda term: term_rows.get(term, -1), indptr, indices, data, doc_count
+        )
+
+    @property
+    def term_count(self) -> int:
+        return len(self.indptr) - 1
+
+    def save(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "indptr.npy"), self.indptr)
+        np.save(os.path.join(directory, "indices.npy"), self.indices)
+        np.save(os.path.join(directory, "data.npy"), self.data)
+        with open(os.path.join(directory, SPARSE_META_NAME), "w") as f:
+            json.dump({"doc_count": self.doc_count}, f)
+
+    @classmethod
+    def load(cls, directory: str, term_row: Callable[[str], int]) -> "SparseBM25":
+        with open(os.path.join(directory, SPARSE_META_NAME), "r") as f:
+            meta = json.load(f)
+        return cls(
+            term_row,
+            np.load(os.path.join(directory, "indptr.npy"), mmap_mode="r"),
+            np.load(os.path.join(directory, "indices.npy"), mmap_mode="r"),
+            np.load(os.path.join(directory, "data.npy"), mmap_mode="r"),
+            meta["doc_count"],
+        )
+
+    def search(
+        self, query_counts: Counter, limit: int, allowed: Optional[np.ndarray] = None
+    ) -> list[tuple[int, float]]:
+        doc_ids, weights = self.__gather(query_counts, allowed)
+        if len(doc_ids) == 0 or limit <= 0:
+            return []
+        # Only documents that match a query term are accumulated, so the cost
+        # follows the postings of the query rather than the corpus size.
+        matched, inverse = np.unique(doc_ids, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+        top = top_k_indices(scores, limit)
+        return list(zip(matched[top].tolist(), scores[top].tolist()))
+
+    def search_batch(
+        self,
+        queries: list[Counter],
+        limit: int,
+        allowed: Optional[np.ndarray] = None,
+        batch_size: int = SPARSE_QUERY_BATCH_SIZE,
+    ) -> list[list[tuple[int, float]]]:
+        results = []
+        for start in range(0, len(queries), batch_size):
+            batch = queries[start : start + batch_size]
+            cells, weights = [], []
+            for query_idx, query_counts in enumerate(batch):
+                doc_ids, query_weights = self.__gather(query_counts, allowed)
+                cells.append(doc_ids.astype(np.int64) + query_idx * self.doc_count)
+                weights.append(query_weights)
+            # One accumulation scores the whole batch as a dense
+            # (queries x documents) matrix, bounded by batch_size rows.
+            scores = np.bincount(
+                np.concatenate(cells),
+                weights=np.concatenate(weights),
+                minlength=len(batch) * self.doc_count,
+            ).reshape(len(batch), self.doc_count)
+            for row in scores:
+                top = top_k_indices(row, limit)
+                top = top[row[top] > 0]
+                results.append(list(zip(top.tolist(), row[top].tolist())))
+        return results
+
+    def __gather(
+        self, query_counts: Counter, allowed: Optional[np.ndarray] = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # A filter mask drops postings of other documents before they are
+        # accumulated, so they never reach the top-k selection.
+        doc_ids, weights = [], []
+        for token, count in query_counts.items():
+            row = self.term_row(token)
+            if row < 0:
+                continue
+            start, end = self.indptr[row], self.indptr[row + 1]
+            row_doc_ids, row_weights = self.indices[start:end], self.data[start:end]
+            if allowed is not None:
+                keep = allowed[row_doc_ids]
+                row_doc_ids, row_weights = row_doc_ids[keep], row_weights[keep]
+            doc_ids.append(row_doc_ids)
+            weights.append(row_weights * count)
+        if not doc_ids:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float64)
+        return np.concatenate(doc_ids), np.concatenate(weights)
+
+
+def top_k_indices(scores: np.ndarray, limit: int) -> np.ndarray:
+    """Indices of the `limit` largest scores, best first"""
+    if limit <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if limit < len(scores):
+        candidates = np.argpartition(-scores, limit - 1)[:limit]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def load_sparse_bm25(
+    directory: str, term_row: Callable[[str], int]
+) -> Optional[SparseBM25]:
+    if not os.path.exists(os.path.join(directory, SPARSE_META_NAME)):
+        return None
+    return SparseBM25.load(directory, term_row)
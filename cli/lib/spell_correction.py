@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+import re
+from collections import Counter
+from typing import Iterable, Optional
+
+import numpy as np
+
+from .keyword_search import InvertedIndex
+from .search_utils import (
+    SPELL_DICTIONARY_PATH,
+    SPELL_MAX_EDIT_DISTANCE,
+    SPELL_PREFIX_LENGTH,
+)
+from .text_analyzer import PUNCTUATION_TABLE, get_analyzer
+
+WORD_PATTERN = re.compile(r"[\w']+")
+DELETE_DTYPE = np.dtype([("key", "<u8"), ("word", "<i4")])
+
+
+class SpellCorrector:
+    """SymSpell-style typo correction over the indexed vocabulary
+
+    Every dictionary word is stored under each string obtained by deleting up
+    to `max_distance` characters from its prefix. A query word is looked up by
+    generating its own deletions the same way, so only words sharing one of
+    those keys are compared with a bounded edit distance. The deletion index
+    is a sorted array of (key hash, word number) pairs, saved next to the
+    dictionary and memory-mapped on load, so it is generated only when the
+    dictionary is rebuilt. Colliding hashes merely add candidates, which the
+    edit distance check then rejects.
+    """
+
+    def __init__(
+        self,
+        words: dict[str, int],
+        max_distance: int = SPELL_MAX_EDIT_DISTANCE,
+        prefix_length: int = SPELL_PREFIX_LENGTH,
+        stems: Optional[Iterable[str]] = None,
+        deletes: Optional[np.ndarray] = None,
+    ) -> None:
+        self.words = words
+        self.word_list = list(words)
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        # Words stemming to an indexed term already match, even if the exact
+        # form never occurs in the corpus.
+        if stems is None:
+            analyzer = get_analyzer()
+            stems = (analyzer.stem(word) for word in words)
+        self.stems = set(stems)
+        if deletes is None:
+            deletes = self.__build_deletes()
+        self.deletes = deletes
+
+    def __build_deletes(self) -> np.ndarray:
+        entries = []
+        for number, word in enumerate(self.word_list):
+            for key in self.__deletions(word[: self.prefix_length], self.max_distance):
+                entries.append((delete_key_hash(key), number))
+        deletes = np.array(entries, dtype=DELETE_DTYPE)
+        deletes.sort(order="key", kind="stable")
+        return deletes
+
+    @classmethod
+    def from_index(cls, idx: InvertedIndex) -> "SpellCorrector":
+        """Surface forms of the index terms, weighted by document frequency"""
+        analyzer = get_analyzer()
+        words: Counter = Counter()
+        for doc in idx.docmap.values():
+            text = f"{doc['title']} {doc['description']}"
+            for word in set(text.lower().translate(PUNCTUATION_TABLE).split()):
+                if word not in analyzer.stopwords and not word.isdigit():
+                    words[word] += 1
+        return cls(dict(words))
+
+    def save(self, path: str) -> None:
+        # The dictionary is written last and records the size of the deletion
+        # index, so a half-finished save is never paired with it.
+        np.save(deletes_path(path), self.deletes)
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "words": self.words,
+                    "stems": sorted(self.stems),
+                    "max_distance": self.max_distance,
+                    "prefix_length": self.prefix_length,
+                    "delete_count": len(self.deletes),
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "SpellCorrector":
+        with open(path, "r") as f:
+            saved = json.load(f)
+        deletes = None
+        # The deletion index only fits the bounds it was generated with.
+        if (
+            saved.get("max_distance") == SPELL_MAX_EDIT_DISTANCE
+            and saved.get("prefix_length") == SPELL_PREFIX_LENGTH
+            and os.path.exists(deletes_path(path))
+        ):
+            deletes = np.load(deletes_path(path), mmap_mode="r")
+            if len(deletes) != saved.get("delete_count"):
+                deletes = None
+        return cls(saved["words"], stems=saved.get("stems"), deletes=deletes)
+
+    def lookup(self, word: str) -> list[tuple[str, int, int]]:
+        """Dictionary words within the edit-distance bound for `word`
+
+        Short words get a tighter bound, since two edits turn most three or
+        four letter words into some other word.
+
+        Returns:
+            (word, distance, document frequency), closest and most common first
+        """
+        if word in self.words:
+            return [(word, 0, self.words[word])]
+        max_distance = min(self.max_distance, (len(word) - 1) // 2)
+        if max_distance <= 0:
+            return []
+
+        keys = self.__deletions(word[: self.prefix_length], max_distance)
+        hashes = np.array([delete_key_hash(key) for key in keys], dtype=np.uint64)
+        stored = self.deletes["key"]
+        starts = np.searchsorted(stored, hashes, side="left")
+        ends = np.searchsorted(stored, hashes, side="right")
+        numbers = set()
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            numbers.update(self.deletes["word"][start:end].tolist())
+
+        suggestions = []
+        for number in sorted(numbers):
+            candidate = self.word_list[number]
+            if abs(len(candidate) - len(word)) > max_distance:
+                continue
+            distance = edit_distance(word, candidate, max_distance)
+            if distance <= max_distance:
+                suggestions.append((candidate, distance, self.words[candidate]))
+        suggestions.sort(key=lambda s: (s[1], -s[2], s[0]))
+        return suggestions
+
+    def correct(self, word: str) -> Optional[str]:
+        suggestions = self.lookup(word)
+        return suggestions[0][0] if suggestions else None
+
+    def correct_query(self, query: str) -> tuple[str, list[str]]:
+        """Replace misspelled query words with their closest dictionary word
+
+        Returns:
+            The corrected query, with punctuation and quoting left in place,
+            and the words for which no correction was found
+        """
+        analyzer = get_analyzer()
+        unresolved = []
+
+        def replace(match: re.Match) -> str:
+            word = match.group(0).lower().translate(PUNCTUATION_TABLE)
+            if (
+                not word
+                or word in analyzer.stopwords
+                or word.isdigit()
+                or analyzer.stem(word) in self.stems
+            ):
+                return match.group(0)
+            correction = self.correct(word)
+            if correction is None:
+                unresolved.append(match.group(0))
+                return match.group(0)
+            return match.group(0) if correction == word else correction
+
+        return WORD_PATTERN.sub(replace, query), unresolved
+
+    @staticmethod
+    def __deletions(word: str, max_distance: int) -> set[str]:
+        keys = {word}
+        frontier = {word}
+        for _ in range(max_distance):
+            next_frontier = set()
+            for key in frontier:
+                for i in range(len(key)):
+                    next_frontier.add(key[:i] + key[i + 1 :])
+            keys |= next_frontier
+            frontier = next_frontier
+        return keys
+
+
+def delete_key_hash(key: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little"
+    )
+
+
+def deletes_path(dictionary_path: str) -> str:
+    """Deletion index file saved alongside a spelling dictionary"""
+    return f"{os.path.splitext(dictionary_path)[0]}.deletes.npy"
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Optimal string alignment distance, or max_distance + 1 once exceeded"""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous_row = None
+    row = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before_previous, previous_row = previous_row, row
+        row = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            row[j] = min(
+                previous_row[j] + 1,
+                row[j - 1] + 1,
+                previous_row[j - 1] + cost,
+            )
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], before_previous[j - 2] + 1)
+        if min(row) > max_distance:
+            return max_distance + 1
+    return row[-1]
+
+
+_default_corrector: Optional[SpellCorrector] = None
+
+
+def get_spell_corrector() -> SpellCorrector:
+    """Process-wide corrector, rebuilt when the index or its updates are newer"""
+    global _default_corrector
+    if _default_corrector is not None:
+        return _default_corrector
+
+    idx = InvertedIndex()
+    if (
+        not idx.is_stale
+        and os.path.exists(SPELL_DICTIONARY_PATH)
+        and os.path.getmtime(SPELL_DICTIONARY_PATH) >= idx.updated_at
+    ):
+        _default_corrector = SpellCorrector.load(SPELL_DICTIONARY_PATH)
+    else:
+        idx.load_or_build()
+        _default_corrector = SpellCorrector.from_index(idx)
+        _default_corrector.save(SPELL_DICTIONARY_PATH)
+    return _default_corrector
@@ -0,0 +1,100 @@
+import json
+import os
+import string
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from nltk.stem import PorterStemmer
+
+from .search_utils import STEM_CACHE_SIZE, load_stopwords
+
+PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
+
+
+class TextAnalyzer:
+    """Lowercase, strip punctuation, drop stopwords and Porter-stem text
+
+    Everything that used to be rebuilt per call (stopword list, translation
+    table, stemmer) is set up once, and stems are memoized in a bounded LRU
+    that can be saved next to the index and reloaded to skip cold stemming.
+    Only index builds and saves read the saved cache; queries stem their few
+    words directly.
+    """
+
+    def __init__(
+        self,
+        stopwords: Optional[Iterable[str]] = None,
+        stem_cache_size: int = STEM_CACHE_SIZE,
+    ) -> None:
+        if stopwords is None:
+            stopwords = load_stopwords()
+        self.stopwords = frozenset(stopwords)
+        self.stemmer = PorterStemmer()
+        self.stem_cache_size = stem_cache_size
+        self.stem_cache: OrderedDict[str, str] = OrderedDict()
+        self.loaded_stem_caches: set[str] = set()
+        # Stems computed since the last `take_new_stems`, when tracked.
+        self.new_stems: Optional[dict[str, str]] = None
+
+    def stem(self, word: str) -> str:
+        stem = self.stem_cache.get(word)
+        if stem is not None:
+            self.stem_cache.move_to_end(word)
+            return stem
+        stem = self.stemmer.stem(word)
+        self.stem_cache[word] = stem
+        if self.new_stems is not None:
+            self.new_stems[word] = stem
+        if len(self.stem_cache) > self.stem_cache_size:
+            self.stem_cache.popitem(last=False)
+        return stem
+
+    def analyze(self, text: str) -> list[str]:
+        stopwords = self.stopwords
+        stem = self.stem
+        tokens = []
+        for word in text.lower().translate(PUNCTUATION_TABLE).split():
+            if word not in stopwords:
+                tokens.append(stem(word))
+        return tokens
+
+    def analyze_many(self, texts: Iterable[str]) -> list[list[str]]:
+        return [self.analyze(text) for text in texts]
+
+    def take_new_stems(self) -> dict[str, str]:
+        """Stems computed since the previous call, which starts the tracking"""
+        new_stems = self.new_stems or {}
+        self.new_stems = {}
+        return new_stems
+
+    def save_stem_cache(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.stem_cache, f)
+
+    def load_stem_cache(self, path: str) -> None:
+        # Each file is merged at most once per process.
+        if path in self.loaded_stem_caches or not os.path.exists(path):
+            return
+        with open(path, "r") as f:
+            self.merge_stem_cache(json.load(f))
+        self.loaded_stem_caches.add(path)
+
+    def merge_stem_cache(self, stems: dict[str, str]) -> None:
+        # Entries already seen in this process are treated as more recent, so
+        # merged ones go in front of them, keeping their own LRU order.
+        for word, stem in reversed(stems.items()):
+            if word not in self.stem_cache:
+                self.stem_cache[word] = stem
+                self.stem_cache.move_to_end(word, last=False)
+        while len(self.stem_cache) > self.stem_cache_size:
+            self.stem_cache.popitem(last=False)
+
+
+_default_analyzer: Optional[TextAnalyzer] = None
+
+
+def get_analyzer() -> TextAnalyzer:
+    global _default_analyzer
+    if _default_analyzer is None:
+        _default_analyzer = TextAnalyzer()
+    return _default_analyzer
@@ -0,0 +1,187 @@
+from typing import Optional
+
+import numpy as np
+
+from .ann_index import IVFIndex
+from .embedding_store import ShardedEmbeddings
+from .quantization import QuantizedEmbeddings
+from .search_utils import (
+    EMBEDDING_DTYPE,
+    IVF_NPROBE,
+    QUANTIZED_RESCORE_FACTOR,
+    SEMANTIC_QUERY_BATCH_SIZE,
+)
+from .sparse_bm25 import top_k_indices
+
+
+def normalize_embeddings(embeddings: np.ndarray) -> np.ndarray:
+    """L2-normalize rows into a C-contiguous EMBEDDING_DTYPE matrix
+
+    Cosine similarity against normalized rows is a plain dot product, so
+    norms are paid once here instead of on every comparison. Zero rows stay
+    zero and score 0 against any query.
+    """
+    matrix = np.array(embeddings, dtype=EMBEDDING_DTYPE, order="C", copy=True)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    matrix /= norms
+    return matrix
+
+
+def cosine_top_k(
+    matrix: np.ndarray, query: np.ndarray, limit: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Rows of a normalized matrix most similar to a query vector
+
+    Returns:
+        Row indices and their cosine similarities, best first
+    """
+    scores = matrix @ normalize_embeddings(query)
+    top = top_k_indices(scores, limit)
+    return top, scores[top]
+
+
+def candidate_scores(
+    matrix: np.ndarray,
+    query: np.ndarray,
+    shortlist: int,
+    ann_index: Optional[IVFIndex] = None,
+    nprobe: int = IVF_NPROBE,
+    quantized: Optional[QuantizedEmbeddings] = None,
+    rescore: bool = True,
+    allowed: Optional[np.ndarray] = None,
+) -> tuple[Optional[np.ndarray], np.ndarray]:
+    """Rows a normalized query should be ranked against, with their scores
+
+    The ANN index narrows the rows to the probed buckets, and an `allowed`
+    mask (a compiled metadata filter) drops rows from the candidates. Exact
+    scans score every row shard by shard and keep the allowed scores, so a
+    broad filter never gathers the float rows into memory. Quantized codes
+    score the candidates approximately; with rescore, the best
+    `shortlist` of those are scored again against the float rows, so only
+    they are read.
+
+    Returns:
+        Candidate row indices (None for every row, in order) and scores
+    """
+    rows = None
+    if ann_index is not None and nprobe < ann_index.n_lists:
+        rows = ann_index.candidates(query, nprobe)
+    probed = rows is not None
+    if allowed is not None:
+        rows = np.flatnonzero(allowed) if rows is None else rows[allowed[rows]]
+
+    if quantized is None:
+        if rows is None:
+            return rows, matrix @ query
+        if probed:
+            return rows, matrix[rows] @ query
+        return rows, (matrix @ query)[rows]
+
+    scores = quantized.scores(query, rows)
+    if not rescore:
+        return rows, scores
+    top = top_k_indices(scores, shortlist)
+    rows = top if rows is None else rows[top]
+    order = np.argsort(rows, kind="stable")
+    exact = np.empty(len(rows), dtype=EMBEDDING_DTYPE)
+    exact[order] = normalize_embeddings(matrix[rows[order]]) @ query
+    return rows, exact
+
+
+def search_rows(
+    matrix: np.ndarray,
+    query: np.ndarray,
+    limit: int,
+    ann_index: Optional[IVFIndex] = None,
+    nprobe: int = IVF_NPROBE,
+    quantized: Optional[QuantizedEmbeddings] = None,
+    rescore: bool = True,
+    allowed: Optional[np.ndarray] = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Top rows by cosine similarity, through the ANN index or codes if given
+
+    Falls back to a scan of every row when the probed buckets hold fewer than
+    `limit` rows. Exact scans of sharded matrices merge per-shard top-k.
+    With an `allowed` mask only those rows are scored.
+    """
+    query = normalize_embeddings(query)
+    exact = ann_index is None and quantized is None
+    if exact and allowed is None and isinstance(matrix, ShardedEmbeddings):
+        return matrix.top_k(query, limit)
+    shortlist = limit * QUANTIZED_RESCORE_FACTOR
+    rows, scores = candidate_scores(
+        matrix, query, shortlist, ann_index, nprobe, quantized, rescore, allowed
+    )
+    if rows is not None and len(rows) < limit and ann_index is not None:
+        rows, scores = candidate_scores(
+            matrix, query, shortlist, None, nprobe, quantized, rescore, allowed
+        )
+    top = top_k_indices(scores, limit)
+    return (top if rows is None else rows[top]), scores[top]
+
+
+def row_blocks(matrix: np.ndarray) -> list[tuple[int, np.ndarray]]:
+    """(first row, rows) pieces of a plain or sharded embedding matrix"""
+    if isinstance(matrix, ShardedEmbeddings):
+        return list(zip(matrix.offsets.tolist(), matrix.shards))
+    return [(0, matrix)]
+
+
+def score_matrix(matrix: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """Similarity of every query (row) to every matrix row, shape (queries, rows)"""
+    blocks = [queries @ rows.T for _, rows in row_blocks(matrix)]
+    if len(blocks) == 1:
+        return blocks[0]
+    return np.concatenate(blocks, axis=1)
+
+
+def search_rows_batch(
+    matrix: np.ndarray,
+    queries: np.ndarray,
+    limit: int,
+    ann_index: Optional[IVFIndex] = None,
+    nprobe: int = IVF_NPROBE,
+    quantized: Optional[QuantizedEmbeddings] = None,
+    rescore: bool = True,
+    allowed: Optional[np.ndarray] = None,
+) -> list[tuple[np.ndarray, np.ndarray]]:
+    """`search_rows` for several queries at once
+
+    Exact search scores up to SEMANTIC_QUERY_BATCH_SIZE queries with one
+    matrix product per shard and merges the per-shard top-k of each query.
+    With an `allowed` mask, disallowed rows score -inf within each shard and
+    are dropped from the results. ANN and quantized search rank each query
+    on its own.
+    """
+    queries = normalize_embeddings(queries)
+    if ann_index is not None or quantized is not None:
+        return [
+            search_rows(
+                matrix, query, limit, ann_index, nprobe, quantized, rescore, allowed
+            )
+            for query in queries
+        ]
+
+    results = []
+    for start in range(0, len(queries), SEMANTIC_QUERY_BATCH_SIZE):
+        block = queries[start : start + SEMANTIC_QUERY_BATCH_SIZE]
+        candidates = [([], []) for _ in range(len(block))]
+        for offset, rows in row_blocks(matrix):
+            scores = block @ rows.T
+            if allowed is not None:
+                scores[:, ~allowed[offset : offset + len(rows)]] = -np.inf
+            for (found_rows, found_scores), column in zip(candidates, scores):
+                top = top_k_indices(column, limit)
+                found_rows.append(top + offset)
+                found_scores.append(column[top])
+        for found_rows, found_scores in candidates:
+            rows = np.concatenate(found_rows)
+            scores = np.concatenate(found_scores)
+            top = top_k_indices(scores, limit)
+            rows, scores = rows[top], scores[top]
+            if allowed is not None:
+                found = scores > -np.inf
+                rows, scores = rows[found], scores[found]
+            results.append((rows, scores))
+    return results
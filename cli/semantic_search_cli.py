@@ -1,7 +1,18 @@
 
 import argparse
 
+from lib.chunk_metadata import AGGREGATION_MODES
+from lib.quantization import QUANTIZATION_METHODS
+from lib.search_utils import (
+    CHUNK_AGGREGATION_TOP_N,
+    DEFAULT_CHUNK_DEDUP,
+    DEFAULT_CHUNKING,
+    DEFAULT_CHUNK_AGGREGATION,
+    IVF_NPROBE,
+)
 from lib.semantic_search import (
+    CHUNK_DEDUP_MODES,
+    CHUNKING_METHODS,
     chunk_text,
     embed_chunks_command,
     embed_query_text,
@@ -25,9 +36,15 @@ def main() -> None:
     )
     single_embed_parser.add_argument("text", type=str, help="Text to embed")
 
-    subparsers.add_parser(
+    verify_embeddings_parser = subparsers.add_parser(
         "verify_embeddings", help="Verify embeddings for the movie dataset"
     )
+    verify_embeddings_parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes used to encode the corpus",
+    )
 
     embed_query_parser = subparsers.add_parser(
         "embedquery", help="Generate an embedding for a search query"
@@ -41,6 +58,34 @@ def main() -> None:
     search_parser.add_argument(
         "--limit", type=int, default=5, help="Number of results to return"
     )
+    search_parser.add_argument(
+        "--filter",
+        dest="filter_expr",
+        help='Only return movies matching a metadata filter, e.g. "year>=1990 '
+        'genres=comedy"',
+    )
+    search_parser.add_argument(
+        "--ann",
+        action="store_true",
+        help="Search an IVF approximate nearest neighbour index",
+    )
+    search_parser.add_argument(
+        "--nprobe",
+        type=int,
+        default=IVF_NPROBE,
+        help="IVF buckets scored per query; higher is slower but more exact",
+    )
+    search_parser.add_argument(
+        "--quantization",
+        choices=QUANTIZATION_METHODS,
+        help="Score compressed embeddings first, then rescore a shortlist",
+    )
+    search_parser.add_argument(
+        "--no-rescore",
+        dest="rescore",
+        action="store_false",
+        help="Rank by quantized scores alone, without exact rescoring",
+    )
 
     chunk_parser = subparsers.add_parser(
         "chunk", help="Split text into fixed-size chunks with optional overlap"
@@ -73,9 +118,37 @@ def main() -> None:
         help="Number of sentences to overlap between chunks",
     )
 
-    subparsers.add_parser(
+    embed_chunks_parser = subparsers.add_parser(
         "embed_chunks", help="Generate embeddings for chunked documents"
     )
+    embed_chunks_parser.add_argument(
+        "--ann",
+        action="store_true",
+        help="Also build the IVF approximate nearest neighbour index",
+    )
+    embed_chunks_parser.add_argument(
+        "--quantization",
+        choices=QUANTIZATION_METHODS,
+        help="Also build quantized codes for the chunk embeddings",
+    )
+    embed_chunks_parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes used to encode the chunks",
+    )
+    embed_chunks_parser.add_argument(
+        "--chunking",
+        choices=CHUNKING_METHODS,
+        default=DEFAULT_CHUNKING,
+        help="Split descriptions into sentence windows or fixed word windows",
+    )
+    embed_chunks_parser.add_argument(
+        "--dedup",
+        choices=CHUNK_DEDUP_MODES,
+        default=DEFAULT_CHUNK_DEDUP,
+        help="Share one vector between identical or near-identical chunks",
+    )
 
     search_chunked_parser = subparsers.add_parser(
         "search_chunked", help="Search using chunked embeddings"
@@ -84,6 +157,59 @@ def main() -> None:
     search_chunked_parser.add_argument(
         "--limit", type=int, default=5, help="Number of results to return"
     )
+    search_chunked_parser.add_argument(
+        "--filter",
+        dest="filter_expr",
+        help='Only return movies matching a metadata filter, e.g. "year>=1990 '
+        'genres=comedy"',
+    )
+    search_chunked_parser.add_argument(
+        "--ann",
+        action="store_true",
+        help="Search an IVF approximate nearest neighbour index",
+    )
+    search_chunked_parser.add_argument(
+        "--nprobe",
+        type=int,
+        default=IVF_NPROBE,
+        help="IVF buckets scored per query; higher is slower but more exact",
+    )
+    search_chunked_parser.add_argument(
+        "--quantization",
+        choices=QUANTIZATION_METHODS,
+        help="Score compressed embeddings first, then rescore a shortlist",
+    )
+    search_chunked_parser.add_argument(
+        "--no-rescore",
+        dest="rescore",
+        action="store_false",
+        help="Rank by quantized scores alone, without exact rescoring",
+    )
+
+    search_chunked_parser.add_argument(
+        "--aggregation",
+        choices=AGGREGATION_MODES,
+        default=DEFAULT_CHUNK_AGGREGATION,
+        help="How chunk scores combine into a movie score",
+    )
+    search_chunked_parser.add_argument(
+        "--top-n",
+        type=int,
+        default=CHUNK_AGGREGATION_TOP_N,
+        help="Chunks averaged per movie with --aggregation mean_top_n",
+    )
+    search_chunked_parser.add_argument(
+        "--chunking",
+        choices=CHUNKING_METHODS,
+        default=DEFAULT_CHUNKING,
+        help="Chunking method the chunk embeddings were built with",
+    )
+    search_chunked_parser.add_argument(
+        "--dedup",
+        choices=CHUNK_DEDUP_MODES,
+        default=DEFAULT_CHUNK_DEDUP,
+        help="Chunk dedup mode the chunk embeddings were built with",
+    )
 
     args = parser.parse_args()
 
@@ -93,20 +219,42 @@ def main() -> None:
         case "embed_text":
             embed_text(args.text)
         case "verify_embeddings":
-            verify_embeddings()
+            verify_embeddings(args.workers)
         case "embedquery":
             embed_query_text(args.query)
         case "search":
-            semantic_search(args.query, args.limit)
+            semantic_search(
+                args.query,
+                args.limit,
+                args.ann,
+                args.nprobe,
+                args.quantization,
+                args.rescore,
+                args.filter_expr,
+            )
         case "chunk":
             chunk_text(args.text, args.chunk_size, args.overlap)
         case "semantic_chunk":
             semantic_chunk_text(args.text, args.max_chunk_size, args.overlap)
         case "embed_chunks":
-            embeddings = embed_chunks_command()
+            embeddings = embed_chunks_command(
+                args.ann, args.quantization, args.workers, args.chunking, args.dedup
+            )
             print(f"Generated {len(embeddings)} chunked embeddings")
         case "search_chunked":
-            result = search_chunked_command(args.query, args.limit)
+            result = search_chunked_command(
+                args.query,
+                args.limit,
+                args.ann,
+                args.nprobe,
+                args.quantization,
+                args.rescore,
+                args.aggregation,
+                args.top_n,
+                args.chunking,
+                args.dedup,
+                args.filter_expr,
+            )
             print(f"Query: {result['query']}")
             print("Results:")
             for i, res in enumerate(result["results"], 1):